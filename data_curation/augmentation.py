@@ -1,10 +1,12 @@
 import random
+import typing
 
 
 def scramble_word_order(
     text: str,
     max_perms: int,
     min_perms: int = 1,
+    rng: typing.Optional[random.Random] = None,
 ) -> str:
     """
     Scrambles the order of words in the input text by moving a specified
@@ -13,20 +15,23 @@ def scramble_word_order(
     :param text: The input text to scramble.
     :param max_perms: The maximum number of words to move.
     :param min_perms: The minimum number of words to move.
+    :param rng: Optionally, the random number generator to use instead of
+      the global one.
     :return: The text with words scrambled.
     """
     words = text.split()
     if len(words) < 2:
         return text
+    rng = rng or random  # ty: ignore
 
     # Ensure max_perms does not exceed the number of words
-    num_perms = min(random.randint(min_perms, max_perms), len(words) - 1)
+    num_perms = min(rng.randint(min_perms, max_perms), len(words) - 1)
 
     # Select unique indices to scramble
-    indices_to_move = sorted(random.sample(range(len(words)), num_perms), reverse=True)
+    indices_to_move = sorted(rng.sample(range(len(words)), num_perms), reverse=True)
 
     for idx in indices_to_move:
-        new_pos = random.choice([i for i in range(len(words)) if i != idx])
+        new_pos = rng.choice([i for i in range(len(words)) if i != idx])
         word = words.pop(idx)
         words.insert(new_pos, word)
 
@@ -34,7 +39,11 @@ def scramble_word_order(
 
 
 def insert_loinc_related_names(
-    text: str, loinc_names: list[str], max_inserts: int, min_inserts: int = 1
+    text: str,
+    loinc_names: list[str],
+    max_inserts: int,
+    min_inserts: int = 1,
+    rng: typing.Optional[random.Random] = None,
 ) -> str:
     """
     Inserts 1 or more LOINC related names into the input text at random positions.
@@ -42,20 +51,23 @@ def insert_loinc_related_names(
     :param text: The input text to modify.
     :param loinc_names: A list of LOINC related names to insert.
     :param num_inserts: The number of LOINC names to insert.
+    :param rng: Optionally, the random number generator to use instead of
+      the global one.
     :return: The text with LOINC related name(s) inserted.
     """
     words = text.split()
     if not loinc_names or len(words) < 1:
         return text
+    rng = rng or random  # ty: ignore
 
     # Ensure num_inserts does not exceed the number of loinc_names
-    num_inserts = random.randint(min_inserts, min(len(loinc_names), max_inserts))
+    num_inserts = rng.randint(min_inserts, min(len(loinc_names), max_inserts))
 
     # Select indices to insert at (can repeat)
-    indices_to_insert = [random.randrange(len(words) + 1) for _ in range(num_inserts)]
+    indices_to_insert = [rng.randrange(len(words) + 1) for _ in range(num_inserts)]
 
     # Select unique LOINC names to insert
-    loinc_names_to_insert = random.sample(loinc_names, num_inserts)
+    loinc_names_to_insert = rng.sample(loinc_names, num_inserts)
 
     for _ in range(num_inserts):
         name_to_insert = loinc_names_to_insert.pop()
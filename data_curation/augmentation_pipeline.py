@@ -0,0 +1,214 @@
+"""
+Expand a LOINC extract into augmented (noisy text, standard name) training pairs.
+
+The pipe-delimited LOINC extract written by `terminology_valueset_sync.py` is
+read as a stream and split into shards of codes. Each shard is augmented in
+its own worker process and written to its own output file, so no single
+process handles every pair. Each shard gets its own random number generator
+seeded from the base seed and its shard number, which makes the output
+identical regardless of how many workers are used. Shards left in the output
+directory by an earlier run are removed first.
+
+Each output row is pipe-delimited: augmented_text|standard_name|code
+
+Usage:
+    python -m data_curation.augmentation_pipeline <loinc_extract> <output_dir>
+    python -m data_curation.augmentation_pipeline names.csv pairs/ --variants 10 --workers 8
+
+To view all options and usage details:
+    python -m data_curation.augmentation_pipeline --help
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import glob
+import os
+import random
+import typing
+
+from data_curation import augmentation
+
+NAME_COLUMNS = ("long_name", "short_name", "display_name")
+
+
+def iter_loinc_rows(extract_path: str) -> typing.Iterator[tuple[str, list[str], list[str]]]:
+    """
+    Streams the codes from a pipe-delimited LOINC extract. The related names
+    of each code are split once here rather than once per augmentation.
+
+    :param extract_path: The path to the LOINC extract.
+    :returns: An iterator of (code, standard names, related names) tuples.
+    """
+    with open(extract_path, "r", newline="", encoding="utf-8") as fp:
+        for row in csv.DictReader(fp, delimiter="|"):
+            code = (row.get("code") or "").strip()
+            names = [(row.get(col) or "").strip() for col in NAME_COLUMNS]
+            names = [n for n in names if n != ""]
+            related = [n.strip() for n in (row.get("related_names") or "").split(";")]
+            related = [n for n in related if n != ""]
+            if code != "" and names:
+                yield code, names, related
+
+
+def iter_shards(rows: typing.Iterable, shard_size: int) -> typing.Iterator[list]:
+    """
+    Groups a stream of rows into lists of at most `shard_size` rows.
+    """
+    shard = []
+    for row in rows:
+        shard.append(row)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def augment_name(
+    name: str,
+    related_names: list[str],
+    max_perms: int,
+    max_inserts: int,
+    rng: random.Random,
+) -> str:
+    """
+    Produces one noisy variant of a standard name by scrambling its word
+    order, inserting related names, or both.
+    """
+    operation = rng.choice(["scramble", "insert", "both"] if related_names else ["scramble"])
+    text = name
+    if operation in ("insert", "both"):
+        text = augmentation.insert_loinc_related_names(
+            text, related_names, max_inserts=max_inserts, rng=rng
+        )
+    if operation in ("scramble", "both"):
+        text = augmentation.scramble_word_order(text, max_perms=max_perms, rng=rng)
+    return text
+
+
+def augment_shard(
+    shard: list[tuple[str, list[str], list[str]]],
+    shard_num: int,
+    output_dir: str,
+    variants: int,
+    seed: int,
+    max_perms: int,
+    max_inserts: int,
+) -> int:
+    """
+    Augments every name in a shard and writes the pairs to the shard's own
+    output file.
+
+    :returns: The number of pairs written.
+    """
+    # Seeding per shard keeps the output independent of which worker (or
+    # how many workers) processed the shard, and a local generator leaves the
+    # caller's random state alone
+    rng = random.Random(f"{seed}-{shard_num}")
+    path = shard_output_path(output_dir, shard_num)
+    tmp_path = path + ".tmp"
+    num_pairs = 0
+    with open(tmp_path, "w", newline="", encoding="utf-8") as fp:
+        writer = csv.writer(fp, delimiter="|")
+        for code, names, related in shard:
+            for name in names:
+                for _ in range(variants):
+                    writer.writerow(
+                        [augment_name(name, related, max_perms, max_inserts, rng), name, code]
+                    )
+                    num_pairs += 1
+    os.replace(tmp_path, path)
+    return num_pairs
+
+
+def shard_output_path(output_dir: str, shard_num: int) -> str:
+    """
+    The path of the output file for a shard.
+    """
+    return os.path.join(output_dir, f"pairs-{shard_num:05d}.csv")
+
+
+def run_pipeline(
+    extract_path: str,
+    output_dir: str,
+    variants: int = 5,
+    shard_size: int = 1000,
+    workers: int = 1,
+    seed: int = 42,
+    max_perms: int = 3,
+    max_inserts: int = 2,
+) -> int:
+    """
+    Augments every code in the extract across a pool of worker processes.
+
+    :param extract_path: The path to the LOINC extract.
+    :param output_dir: The directory to write the pair shards to.
+    :param variants: The number of augmented variants per standard name.
+    :param shard_size: The number of codes per shard.
+    :param workers: The number of worker processes. With 0, shards are
+      augmented in the current process.
+    :param seed: The base random seed.
+    :param max_perms: The most words to move when scrambling.
+    :param max_inserts: The most related names to insert.
+    :returns: The total number of pairs written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # A previous run with more shards would otherwise leave extra files for
+    # readers of the directory to pick up
+    for path in glob.glob(os.path.join(output_dir, "pairs-*.csv*")):
+        os.remove(path)
+    shards = iter_shards(iter_loinc_rows(extract_path), shard_size)
+    args = (output_dir, variants, seed, max_perms, max_inserts)
+
+    if workers == 0:
+        return sum(augment_shard(shard, n, *args) for n, shard in enumerate(shards))
+
+    total = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        # Bound the number of shards waiting in the pool so memory doesn't
+        # grow with the size of the extract
+        in_flight: set[concurrent.futures.Future] = set()
+        for shard_num, shard in enumerate(shards):
+            if len(in_flight) >= workers * 2:
+                done, in_flight = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                total += sum(f.result() for f in done)
+            in_flight.add(pool.submit(augment_shard, shard, shard_num, *args))
+        total += sum(f.result() for f in concurrent.futures.as_completed(in_flight))
+    return total
+
+
+def main():
+    """
+    Run the augmentation pipeline from the command line.
+    """
+    parser = argparse.ArgumentParser(
+        description="Expand a LOINC extract into augmented training pairs."
+    )
+    parser.add_argument("extract", help="Pipe-delimited LOINC extract")
+    parser.add_argument("output_dir", help="Directory to write pair shards to")
+    parser.add_argument("--variants", type=int, default=5, help="Variants per name (default: 5)")
+    parser.add_argument("--shard-size", type=int, default=1000, help="Codes per shard")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--max-perms", type=int, default=3)
+    parser.add_argument("--max-inserts", type=int, default=2)
+    args = parser.parse_args()
+
+    total = run_pipeline(
+        args.extract,
+        args.output_dir,
+        variants=args.variants,
+        shard_size=args.shard_size,
+        workers=args.workers,
+        seed=args.seed,
+        max_perms=args.max_perms,
+        max_inserts=args.max_inserts,
+    )
+    print(f"Wrote {total} pairs to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""
+Drive the Lambda container with synthetic SQS traffic and report how it holds up.
+
+Objects of configurable size are seeded into an S3 stand-in, and the
+container is invoked through the Lambda runtime emulator with SQS batches of
+S3 "Object Created" EventBridge events pointing at them, in the shape
+`s3_handler.get_file_content_from_s3_event` parses. Invocations are started
+on a fixed schedule at the target rate (an open loop, so a slow container
+builds a backlog instead of slowing the generator down), and the report
+gives throughput, latency percentiles, error rate and, when a container
+name is given, its memory at the start, peak and end of the run.
+
+Start the container and a moto S3 stand-in with the load test overrides:
+
+    docker compose -f compose.yml -f compose.loadtest.yml up -d
+
+Usage:
+    python dev_scripts/load_test.py
+    python dev_scripts/load_test.py --rps 20 --duration 120 --batch-size 10 \\
+        --object-size 2048-65536 --duplicate-rate 0.1 --container dibbs-text-to-code-lambda-1
+
+Note that the runtime emulator handles one invocation at a time, so rates
+above its throughput measure queueing; deployed concurrency is better sized
+from the per-invocation latency.
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+import typing
+import urllib.error
+import urllib.request
+import uuid
+
+import boto3
+
+INVOKE_URL = "http://localhost:8080/2015-03-31/functions/function/invocations"
+S3_ENDPOINT_URL = "http://localhost:5000"
+BUCKET_NAME = "ttc-load-test"
+
+LAB_LINES = [
+    "Hemoglobin [Mass/volume] in Blood|13.2 g/dL|Normal",
+    "Glucose [Mass/volume] in Serum or Plasma|182 mg/dL|High",
+    "SARS-CoV-2 RNA [Presence] in Nasopharynx by NAA|Not detected|Negative",
+    "25-Hydroxyvitamin D3 [Mass/volume] in Serum or Plasma|18 ng/mL|Low",
+    "Hematocrit [Volume Fraction] of Blood by Automated count|41 %|Normal",
+]
+_MEMORY_UNITS = {"b": 1, "kib": 2**10, "mib": 2**20, "gib": 2**30, "kb": 10**3, "mb": 10**6}
+
+
+def parse_size_range(value: str) -> tuple[int, int]:
+    """
+    Parses an object size given as "N" or "MIN-MAX" bytes.
+    """
+    low, _, high = value.partition("-")
+    low_bytes, high_bytes = int(low), int(high or low)
+    if not 0 < low_bytes <= high_bytes:
+        raise ValueError(f"Invalid object size range '{value}'")
+    return low_bytes, high_bytes
+
+
+def synthetic_object(size: int, rng: random.Random) -> bytes:
+    """
+    Builds an object of exactly `size` bytes from lab result lines.
+    """
+    lines = []
+    total = 0
+    while total < size:
+        line = rng.choice(LAB_LINES) + "\n"
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode()[:size]
+
+
+def seed_objects(
+    s3_client, bucket: str, num_objects: int, size_range: tuple[int, int], seed: int = 42
+) -> list[dict]:
+    """
+    Creates the bucket if needed and uploads objects for the events to refer to.
+
+    :returns: The key, size and ETag of each object.
+    """
+    rng = random.Random(seed)
+    try:
+        s3_client.create_bucket(Bucket=bucket)
+    except s3_client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    objects = []
+    for i in range(num_objects):
+        key = f"eicr/load-test-{i:06d}.txt"
+        body = synthetic_object(rng.randint(*size_range), rng)
+        response = s3_client.put_object(Bucket=bucket, Key=key, Body=body)
+        objects.append({"key": key, "size": len(body), "etag": response["ETag"].strip('"')})
+    return objects
+
+
+def s3_object_created_event(bucket: str, obj: dict, region: str = "us-east-1") -> dict:
+    """
+    Builds an S3 "Object Created" event as EventBridge delivers it.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {
+        "version": "0",
+        "id": str(uuid.uuid4()),
+        "detail-type": "Object Created",
+        "source": "aws.s3",
+        "account": "000000000000",
+        "time": now,
+        "region": region,
+        "resources": [f"arn:aws:s3:::{bucket}"],
+        "detail": {
+            "version": "0",
+            "bucket": {"name": bucket},
+            "object": {
+                "key": obj["key"],
+                "size": obj["size"],
+                "etag": obj["etag"],
+                "sequencer": uuid.uuid4().hex[:18].upper(),
+            },
+            "request-id": uuid.uuid4().hex[:16].upper(),
+            "requester": "000000000000",
+            "reason": "PutObject",
+        },
+    }
+
+
+def sqs_batch_event(
+    bucket: str,
+    objects: list[dict],
+    batch_size: int,
+    rng: random.Random,
+    duplicate_rate: float = 0.0,
+) -> dict:
+    """
+    Builds an SQS event of `batch_size` records, each carrying an S3 event
+    for a random object. With probability `duplicate_rate`, a record repeats
+    an object already in the batch, as at-least-once delivery does.
+    """
+    records = []
+    chosen: list[dict] = []
+    for _ in range(batch_size):
+        if chosen and rng.random() < duplicate_rate:
+            obj = rng.choice(chosen)
+        else:
+            obj = rng.choice(objects)
+            chosen.append(obj)
+        body = json.dumps(s3_object_created_event(bucket, obj))
+        records.append(
+            {
+                "messageId": str(uuid.uuid4()),
+                "receiptHandle": uuid.uuid4().hex,
+                "body": body,
+                "attributes": {
+                    "ApproximateReceiveCount": "1",
+                    "SentTimestamp": str(int(time.time() * 1000)),
+                },
+                "messageAttributes": {},
+                "eventSource": "aws:sqs",
+                "eventSourceARN": "arn:aws:sqs:us-east-1:000000000000:ttc-load-test",
+                "awsRegion": "us-east-1",
+            }
+        )
+    return {"Records": records}
+
+
+def invoke(
+    url: str, event: dict, timeout: float, scheduled: typing.Optional[float] = None
+) -> tuple[float, typing.Optional[str]]:
+    """
+    Sends one invocation to the runtime emulator.
+
+    :param url: The runtime emulator's invocation URL.
+    :param event: The event to invoke with.
+    :param timeout: The timeout in seconds.
+    :param scheduled: Optionally, the `time.perf_counter` time the invocation
+      was due to be sent. Latency is measured from it rather than from when
+      it was actually sent, so time spent queued behind slow invocations
+      counts against the run instead of being hidden by it.
+    :returns: The latency in seconds and an error description, if it failed.
+    """
+    data = json.dumps(event).encode()
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    start = time.perf_counter() if scheduled is None else scheduled
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+    except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+        return time.perf_counter() - start, type(e).__name__
+    latency = time.perf_counter() - start
+    # The emulator reports handler exceptions in a 200 response
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return latency, "InvalidResponse"
+    if isinstance(payload, dict) and "errorType" in payload:
+        return latency, payload["errorType"]
+    return latency, None
+
+
+def container_memory_bytes(container: str) -> typing.Optional[int]:
+    """
+    Reads a container's current memory use from `docker stats`.
+    """
+    try:
+        output = subprocess.run(
+            ["docker", "stats", "--no-stream", "--format", "{{.MemUsage}}", container],
+            capture_output=True,
+            text=True,
+            timeout=10,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.match(r"\s*([\d.]+)\s*([A-Za-z]+)", output)
+    if match is None or match.group(2).lower() not in _MEMORY_UNITS:
+        return None
+    return int(float(match.group(1)) * _MEMORY_UNITS[match.group(2).lower()])
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """
+    Returns the nearest-rank percentile of a list of values.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100.0 * len(ordered)) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def summarize(
+    latencies: list[float],
+    errors: list[str],
+    elapsed: float,
+    batch_size: int,
+    memory: typing.Optional[list[int]] = None,
+) -> dict:
+    """
+    Builds the run report from the latency and error of every invocation.
+    Only the records of successful invocations count towards throughput.
+    """
+    num_invocations = len(latencies)
+    num_records = (num_invocations - len(errors)) * batch_size
+    error_counts: dict[str, int] = {}
+    for error in errors:
+        error_counts[error] = error_counts.get(error, 0) + 1
+    report: dict[str, typing.Any] = {
+        "invocations": num_invocations,
+        "records": num_records,
+        "elapsed_seconds": round(elapsed, 2),
+        "invocations_per_second": round(num_invocations / elapsed, 2) if elapsed > 0 else 0.0,
+        "records_per_second": round(num_records / elapsed, 2) if elapsed > 0 else 0.0,
+        "error_rate": round(len(errors) / num_invocations, 4) if num_invocations else 0.0,
+        "errors": error_counts,
+    }
+    for pct in (50, 90, 95, 99):
+        report[f"p{pct}_latency_ms"] = round(percentile(latencies, pct) * 1000.0, 2)
+    report["max_latency_ms"] = round(max(latencies, default=0.0) * 1000.0, 2)
+    if memory:
+        report["memory_start_bytes"] = memory[0]
+        report["memory_peak_bytes"] = max(memory)
+        report["memory_end_bytes"] = memory[-1]
+        report["memory_growth_bytes"] = memory[-1] - memory[0]
+    return report
+
+
+def run_load_test(
+    url: str,
+    bucket: str,
+    objects: list[dict],
+    rps: float,
+    duration: float,
+    batch_size: int = 10,
+    duplicate_rate: float = 0.0,
+    concurrency: int = 16,
+    timeout: float = 30.0,
+    container: typing.Optional[str] = None,
+    seed: int = 42,
+) -> dict:
+    """
+    Invokes the container at a fixed rate for a fixed time.
+
+    :param url: The runtime emulator's invocation URL.
+    :param bucket: The bucket the seeded objects are in.
+    :param objects: The seeded objects, from `seed_objects`.
+    :param rps: The target invocations per second.
+    :param duration: The length of the run in seconds.
+    :param batch_size: The number of SQS records per invocation.
+    :param duplicate_rate: The chance a record repeats an object in its batch.
+    :param concurrency: The most invocations in flight at once.
+    :param timeout: The per-invocation timeout in seconds.
+    :param container: Optionally, the container to sample memory from.
+    :param seed: The random seed for choosing objects.
+    :returns: The run report from `summarize`.
+    """
+    rng = random.Random(seed)
+    num_invocations = max(int(rps * duration), 1)
+    latencies: list[float] = []
+    errors: list[str] = []
+    memory: list[int] = []
+    stop_sampling = threading.Event()
+
+    def sample_memory():
+        while True:
+            sample = container_memory_bytes(container)
+            if sample is not None:
+                memory.append(sample)
+            if stop_sampling.wait(1.0):
+                return
+
+    sampler = None
+    if container is not None:
+        sampler = threading.Thread(target=sample_memory, daemon=True)
+        sampler.start()
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = []
+        for i in range(num_invocations):
+            # Wait for this invocation's slot in the schedule
+            scheduled = start + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            event = sqs_batch_event(bucket, objects, batch_size, rng, duplicate_rate)
+            futures.append(pool.submit(invoke, url, event, timeout, scheduled))
+        for future in concurrent.futures.as_completed(futures):
+            latency, error = future.result()
+            latencies.append(latency)
+            if error is not None:
+                errors.append(error)
+    elapsed = time.perf_counter() - start
+
+    if sampler is not None:
+        stop_sampling.set()
+        sampler.join()
+        final = container_memory_bytes(container)
+        if final is not None:
+            memory.append(final)
+    return summarize(latencies, errors, elapsed, batch_size, memory)
+
+
+def main():
+    """
+    Seed the S3 stand-in and run the load test from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Load test the Lambda container.")
+    parser.add_argument("--url", default=INVOKE_URL, help="Runtime emulator invocation URL")
+    parser.add_argument("--s3-endpoint", default=S3_ENDPOINT_URL, help="S3 stand-in endpoint")
+    parser.add_argument("--bucket", default=BUCKET_NAME)
+    parser.add_argument("--objects", type=int, default=100, help="Number of objects to seed")
+    parser.add_argument("--object-size", default="4096", help="Bytes, as N or MIN-MAX")
+    parser.add_argument("--rps", type=float, default=5.0, help="Target invocations per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run for")
+    parser.add_argument("--batch-size", type=int, default=10, help="SQS records per invocation")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=16, help="Invocations in flight")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--container", default=None, help="Container to sample memory from")
+    parser.add_argument("--out", default=None, help="Path to write the JSON report to")
+    args = parser.parse_args()
+
+    s3_client = boto3.client(
+        "s3",
+        endpoint_url=args.s3_endpoint,
+        region_name=os.getenv("AWS_REGION", "us-east-1"),
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID", "test"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY", "test"),
+    )
+    print(f"Seeding {args.objects} objects into {args.bucket}...")
+    objects = seed_objects(s3_client, args.bucket, args.objects, parse_size_range(args.object_size))
+
+    print(f"Invoking at {args.rps}/s for {args.duration}s...")
+    report = run_load_test(
+        args.url,
+        args.bucket,
+        objects,
+        args.rps,
+        args.duration,
+        batch_size=args.batch_size,
+        duplicate_rate=args.duplicate_rate,
+        concurrency=args.concurrency,
+        timeout=args.timeout,
+        container=args.container,
+    )
+    print(json.dumps(report, indent=2))
+    if args.out is not None:
+        with open(args.out, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""
+Bulk-code large volumes of free-text lab strings against the LOINC vector DB.
+Every match carries the LOINC code of the name it matched.
+
+Inputs are plain text files with one lab string per line (for pipe-delimited
+files only the first column is used). Each input may be a local file, a local
+directory, or an S3 prefix of the form s3://bucket/prefix. Inputs are read as
+a stream and cut into fixed-size shards; shards are encoded and searched in a
+pool of worker processes, and each finished shard is written to its own
+newline-delimited JSON file in the output directory. A shard whose output
+file already exists is skipped, so an interrupted run can be resumed by
+running the same command again. Shard IDs include a digest of the shard's
+strings, so a shard whose input changed is coded again and its old output
+is removed once the run completes. The output directory records the model,
+inputs, shard size, top K and vector DB it was written with, and a run with
+different settings is refused rather than mixed in.
+
+Usage:
+    python -m model_tuning.batch_coding <output_dir> <input> [<input> ...]
+    python -m model_tuning.batch_coding out/ s3://my-bucket/eicr-labs/ --workers 8
+
+To view all options and usage details:
+    python -m model_tuning.batch_coding --help
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import pickle
+import time
+import typing
+from dataclasses import dataclass
+
+import torch
+from sentence_transformers import SentenceTransformer
+from sentence_transformers import util
+
+from dibbs_text_to_code.batching import encode_bucketed
+from dibbs_text_to_code.s3_handler import create_s3_client
+from dibbs_text_to_code.valuesets import load_valueset_csv
+from model_tuning.performance import embed_loinc_names
+from model_tuning.performance import EMBEDDING_CACHE_DIR
+from model_tuning.performance import MODEL_NAME
+from model_tuning.performance import SNOINC_CODES_FILE
+from model_tuning.token_cache import corpus_digest
+
+DEFAULT_SHARD_SIZE = 10000
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_TOP_K = 5
+MANIFEST_FILE = "manifest.json"
+# Kept apart from `performance.py`'s cache, which holds names without codes
+DEFAULT_EMBEDDINGS_PATH = EMBEDDING_CACHE_DIR + "batch_coding_embeddings.pkl"
+NAME_COLUMNS = ("long_name", "short_name", "display_name")
+
+# Populated once per worker process by `_init_worker` so that the model and
+# vector DB are loaded a single time rather than once per shard
+_worker_state: dict[str, typing.Any] = {}
+
+
+@dataclass
+class Shard:
+    """
+    A fixed-size slice of one input source, identified by a stable ID so that
+    completed shards can be recognized when a run is resumed.
+    """
+
+    shard_id: str
+    texts: list[str]
+
+
+def iter_input_lines(source: str) -> typing.Iterator[str]:
+    """
+    Streams the lab strings from a local file, a local directory (all files,
+    in sorted order) or an S3 prefix (all objects, in key order). Blank lines
+    are skipped and, for pipe-delimited files, only the first column is kept.
+
+    :param source: A local path or an s3://bucket/prefix URI.
+    :returns: An iterator over the lab strings in the source.
+    """
+    if source.startswith("s3://"):
+        lines = _iter_s3_lines(source)
+    elif os.path.isdir(source):
+        lines = _iter_dir_lines(source)
+    else:
+        lines = _iter_file_lines(source)
+
+    for line in lines:
+        text = line.split("|", maxsplit=1)[0].strip()
+        if text != "":
+            yield text
+
+
+def iter_shards(sources: list[str], shard_size: int) -> typing.Iterator[Shard]:
+    """
+    Cuts the input sources into shards of at most `shard_size` strings. Shard
+    IDs combine a digest of the source, the shard's position within it and a
+    digest of its strings, so the same inputs always produce the same shard
+    IDs and changed inputs never match an earlier shard.
+
+    :param sources: A list of local paths or S3 URIs to read from.
+    :param shard_size: The maximum number of strings in a shard.
+    :returns: An iterator over the shards of every source, in order.
+    """
+    for source in sources:
+        source_digest = hashlib.sha1(source.encode()).hexdigest()[:12]
+        shard_num = 0
+        texts: list[str] = []
+        for text in iter_input_lines(source):
+            texts.append(text)
+            if len(texts) == shard_size:
+                yield Shard(_shard_id(source_digest, shard_num, texts), texts)
+                shard_num += 1
+                texts = []
+        if texts:
+            yield Shard(_shard_id(source_digest, shard_num, texts), texts)
+
+
+def prepare_output_dir(
+    output_dir: str,
+    sources: list[str],
+    model_name: str,
+    shard_size: int,
+    top_k: int,
+    index_source: dict[str, str],
+) -> None:
+    """
+    Creates the output directory and its manifest, or checks that an
+    existing manifest was written with the same settings.
+
+    :param index_source: Where the vector DB came from, from `index_source`.
+    :raises ValueError: If the output directory belongs to a different job.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {
+        "sources": sources,
+        "model_name": model_name,
+        "shard_size": shard_size,
+        "top_k": top_k,
+        "index": index_source,
+    }
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as fp:
+            existing = json.load(fp)
+        if existing != manifest:
+            raise ValueError(
+                f"{output_dir} holds results from a run with different settings; "
+                "use a new output directory"
+            )
+        return
+    with open(manifest_path, "w") as fp:
+        json.dump(manifest, fp, indent=2)
+
+
+def build_vector_db(model: SentenceTransformer, extract_path: str, embeddings_path: str) -> None:
+    """
+    Embeds the LOINC names from the SNOINC extract and caches each name's
+    text, LOINC code and embedding at `embeddings_path`.
+    """
+    concepts = load_valueset_csv(extract_path, NAME_COLUMNS)
+    embeddings = embed_loinc_names(model, [c.text for c in concepts])
+    os.makedirs(os.path.dirname(os.path.abspath(embeddings_path)), exist_ok=True)
+    with open(embeddings_path, "wb") as fp:
+        pickle.dump(
+            {
+                "names": [c.text for c in concepts],
+                "loinc_codes": [c.code for c in concepts],
+                "extract_path": extract_path,
+                "embeddings": embeddings,
+            },
+            fp,
+        )
+
+
+def index_source(embeddings_path: str) -> dict[str, str]:
+    """
+    Describes the vector DB cached at `embeddings_path` for the manifest:
+    the extract it was built from and a digest of the cache file.
+
+    :raises ValueError: If the cache has no LOINC codes, e.g. because it was
+      written by `performance.py`.
+    """
+    digest = hashlib.sha1()
+    with open(embeddings_path, "rb") as fp:
+        while chunk := fp.read(2**20):
+            digest.update(chunk)
+    with open(embeddings_path, "rb") as fp:
+        cache_data = pickle.load(fp)
+    if "loinc_codes" not in cache_data:
+        raise ValueError(
+            f"{embeddings_path} has no LOINC codes; point --embeddings at a new path "
+            "to build a vector DB from the extract"
+        )
+    return {
+        "embeddings_path": embeddings_path,
+        "extract_path": cache_data["extract_path"],
+        "sha1": digest.hexdigest(),
+    }
+
+
+def code_shard(texts: list[str]) -> list[dict]:
+    """
+    Encodes a shard of lab strings in batches and searches the vector DB for
+    each one. Must run in a process set up by `_init_worker`.
+
+    :param texts: The lab strings to code.
+    :returns: One result per input with its top-K matching LOINC codes and
+      the names they matched on.
+    """
+    model = _worker_state["model"]
+    names = _worker_state["names"]
+    codes = _worker_state["loinc_codes"]
+    query_embeddings = encode_bucketed(
+        model, texts, batch_size=_worker_state["batch_size"], convert_to_tensor=True
+    )
+    hits = util.semantic_search(
+        query_embeddings, _worker_state["vector_db"], top_k=_worker_state["top_k"]
+    )
+    return [
+        {
+            "text": text,
+            "matches": [
+                {
+                    "code": codes[h["corpus_id"]],
+                    "name": names[h["corpus_id"]],
+                    "score": round(float(h["score"]), 5),
+                }
+                for h in text_hits
+            ],
+        }
+        for text, text_hits in zip(texts, hits)
+    ]
+
+
+def shard_output_path(output_dir: str, shard_id: str) -> str:
+    """
+    The path of the output file holding the results for a shard.
+    """
+    return os.path.join(output_dir, f"codes-{shard_id}.jsonl")
+
+
+def write_shard(output_dir: str, shard_id: str, results: list[dict]) -> str:
+    """
+    Writes a shard's results as newline-delimited JSON. The file is written
+    under a temporary name and renamed into place, so the presence of the
+    final file always means the shard completed.
+    """
+    path = shard_output_path(output_dir, shard_id)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        for result in results:
+            fp.write(json.dumps(result) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def run_batch_coding(
+    sources: list[str],
+    output_dir: str,
+    model_name: str = MODEL_NAME,
+    embeddings_path: str = DEFAULT_EMBEDDINGS_PATH,
+    extract_path: str = SNOINC_CODES_FILE,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    top_k: int = DEFAULT_TOP_K,
+    workers: int = 1,
+) -> dict[str, int]:
+    """
+    Codes every lab string in the sources and writes the results to sharded
+    output files, skipping shards that a previous run already completed.
+
+    :param sources: A list of local paths or S3 URIs to read from.
+    :param output_dir: The directory to write the result shards to.
+    :param model_name: The SentenceTransformers model to encode with.
+    :param embeddings_path: The path of the cached LOINC codes, names and
+      embeddings, as written by `build_vector_db`.
+    :param extract_path: The SNOINC extract used to build the embeddings
+      when no cache exists yet.
+    :param shard_size: The number of strings in each output shard.
+    :param batch_size: The number of strings per model forward pass.
+    :param top_k: The number of LOINC matches to keep per string.
+    :param workers: The number of worker processes. With 0, shards are coded
+      in the current process.
+    :returns: A summary of how many shards and strings were coded or skipped.
+    :raises ValueError: If the output directory was written with different
+      settings, or the embeddings cache has no LOINC codes.
+    """
+    # Build the vector DB once up front so the workers only need to load it
+    if not os.path.exists(embeddings_path):
+        build_vector_db(SentenceTransformer(model_name), extract_path, embeddings_path)
+    prepare_output_dir(
+        output_dir, sources, model_name, shard_size, top_k, index_source(embeddings_path)
+    )
+    init_args = (model_name, embeddings_path, top_k, batch_size, max(workers, 1))
+
+    summary = {"shards_coded": 0, "shards_skipped": 0, "texts_coded": 0}
+    shard_ids: set[str] = set()
+    pending_shards = _iter_pending_shards(sources, output_dir, shard_size, summary, shard_ids)
+
+    def _record(shard_id: str, results: list[dict]) -> None:
+        write_shard(output_dir, shard_id, results)
+        summary["shards_coded"] += 1
+        summary["texts_coded"] += len(results)
+        print(f"  Wrote shard {shard_id} ({len(results)} strings)")
+
+    if workers == 0:
+        _init_worker(*init_args)
+        for shard in pending_shards:
+            _record(shard.shard_id, code_shard(shard.texts))
+        _remove_stale_shards(output_dir, shard_ids)
+        return summary
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=init_args
+    ) as pool:
+        # Keep only a couple of shards per worker in flight so that memory
+        # stays bounded no matter how large the inputs are
+        in_flight: dict[concurrent.futures.Future, str] = {}
+        for shard in pending_shards:
+            if len(in_flight) >= workers * 2:
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    _record(in_flight.pop(future), future.result())
+            in_flight[pool.submit(code_shard, shard.texts)] = shard.shard_id
+        for future in concurrent.futures.as_completed(in_flight):
+            _record(in_flight[future], future.result())
+
+    _remove_stale_shards(output_dir, shard_ids)
+    return summary
+
+
+def _init_worker(
+    model_name: str, embeddings_path: str, top_k: int, batch_size: int, workers: int
+) -> None:
+    """
+    Loads the model and vector DB into a worker process. Torch threads are
+    divided between the workers so they don't oversubscribe the CPU.
+    """
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    model = SentenceTransformer(model_name)
+    with open(embeddings_path, "rb") as fp:
+        cache_data = pickle.load(fp)
+    _worker_state.update(
+        model=model,
+        names=cache_data["names"],
+        loinc_codes=cache_data["loinc_codes"],
+        vector_db=cache_data["embeddings"],
+        top_k=top_k,
+        batch_size=batch_size,
+    )
+
+
+def _shard_id(source_digest: str, shard_num: int, texts: list[str]) -> str:
+    """
+    The ID of a shard, from its source, position and contents.
+    """
+    return f"{source_digest}-{shard_num:06d}-{corpus_digest(texts)[:12]}"
+
+
+def _iter_pending_shards(
+    sources: list[str],
+    output_dir: str,
+    shard_size: int,
+    summary: dict[str, int],
+    shard_ids: set[str],
+) -> typing.Iterator[Shard]:
+    """
+    Yields the shards that don't yet have an output file, counting the rest
+    and collecting the ID of every shard seen.
+    """
+    for shard in iter_shards(sources, shard_size):
+        shard_ids.add(shard.shard_id)
+        if os.path.exists(shard_output_path(output_dir, shard.shard_id)):
+            summary["shards_skipped"] += 1
+            continue
+        yield shard
+
+
+def _remove_stale_shards(output_dir: str, shard_ids: set[str]) -> None:
+    """
+    Deletes output files for shards that are no longer part of the inputs,
+    which are left behind when an input changes between runs.
+    """
+    for filename in os.listdir(output_dir):
+        if not (filename.startswith("codes-") and filename.endswith(".jsonl")):
+            continue
+        if filename[len("codes-") : -len(".jsonl")] not in shard_ids:
+            os.remove(os.path.join(output_dir, filename))
+            print(f"  Removed stale shard {filename}")
+
+
+def _iter_file_lines(path: str) -> typing.Iterator[str]:
+    """
+    Streams the lines of a local file.
+    """
+    with open(path, "r") as fp:
+        yield from fp
+
+
+def _iter_dir_lines(path: str) -> typing.Iterator[str]:
+    """
+    Streams the lines of every file in a local directory tree.
+    """
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            yield from _iter_file_lines(os.path.join(root, filename))
+
+
+def _iter_s3_lines(uri: str) -> typing.Iterator[str]:
+    """
+    Streams the lines of every object under an S3 prefix.
+    """
+    bucket_name, _, prefix = uri[len("s3://") :].partition("/")
+    client = create_s3_client()
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            response = client.get_object(Bucket=bucket_name, Key=obj["Key"])
+            for line in response["Body"].iter_lines():
+                yield line.decode("utf-8")
+
+
+def main():
+    """
+    Run the batch coding job from the command line.
+    """
+    parser = argparse.ArgumentParser(
+        description="Code lab strings from local files or S3 prefixes against LOINC."
+    )
+    parser.add_argument("output_dir", help="Directory to write result shards to")
+    parser.add_argument("inputs", nargs="+", help="Local files, directories or s3:// prefixes")
+    parser.add_argument("--model", default=MODEL_NAME, help="SentenceTransformers model name")
+    parser.add_argument(
+        "--embeddings",
+        default=DEFAULT_EMBEDDINGS_PATH,
+        help="Path of the cached LOINC codes, names and embeddings",
+    )
+    parser.add_argument("--extract", default=SNOINC_CODES_FILE, help="SNOINC extract path")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes"
+    )
+    args = parser.parse_args()
+
+    start = time.time()
+    summary = run_batch_coding(
+        args.inputs,
+        args.output_dir,
+        model_name=args.model,
+        embeddings_path=args.embeddings,
+        extract_path=args.extract,
+        shard_size=args.shard_size,
+        batch_size=args.batch_size,
+        top_k=args.top_k,
+        workers=args.workers,
+    )
+    elapsed = time.time() - start
+    print(
+        f"Coded {summary['texts_coded']} strings in {summary['shards_coded']} shards "
+        f"({summary['shards_skipped']} shards already complete) in {elapsed:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Measure the encoding throughput gained by length-bucketed batching.
+
+The SNOINC extract's names are encoded twice with the same batch size: once
+in a single `model.encode` call, which sorts by character count, and once
+with `encode_bucketed`, which sorts by token count and encodes each bucket
+separately. For each mode the script reports names per second along with the
+share of processed tokens that were padding.
+
+Usage:
+    python -m model_tuning.benchmark_bucketing
+    python -m model_tuning.benchmark_bucketing --extract names.csv --batch-size 64 --limit 20000
+"""
+
+import argparse
+import time
+import typing
+
+from sentence_transformers import SentenceTransformer
+
+from dibbs_text_to_code.batching import encode_bucketed
+from dibbs_text_to_code.batching import length_batches
+from dibbs_text_to_code.batching import padded_token_count
+from dibbs_text_to_code.batching import token_lengths
+from model_tuning.performance import MODEL_NAME
+from model_tuning.performance import parse_snoinc_extracts
+from model_tuning.performance import SNOINC_CODES_FILE
+
+
+def char_sorted_batches(texts: list[str], batch_size: int) -> list[list[int]]:
+    """
+    The batches `model.encode` forms on its own: longest character count
+    first, cut into fixed-size groups.
+    """
+    order = sorted(range(len(texts)), key=lambda i: -len(texts[i]))
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def run_benchmark(
+    model: SentenceTransformer,
+    names: list[str],
+    batch_size: int,
+    max_tokens: typing.Optional[int] = None,
+) -> dict:
+    """
+    Encodes the names with and without bucketing and reports the throughput
+    and padding of each.
+
+    :returns: A mapping of mode to its names per second and padding share.
+    """
+    lengths = token_lengths(model, names)
+    real_tokens = sum(lengths)
+    plans = {
+        "baseline": char_sorted_batches(names, batch_size),
+        "bucketed": length_batches(lengths, batch_size, max_tokens),
+    }
+    encoders = {
+        "baseline": lambda: model.encode(names, batch_size=batch_size),
+        "bucketed": lambda: encode_bucketed(
+            model, names, batch_size=batch_size, max_tokens=max_tokens
+        ),
+    }
+
+    # Encode a single batch first so model warm-up isn't charged to either mode
+    model.encode(names[:batch_size], batch_size=batch_size)
+    results = {}
+    for mode, encode in encoders.items():
+        start = time.perf_counter()
+        encode()
+        elapsed = time.perf_counter() - start
+        padded = padded_token_count(lengths, plans[mode])
+        results[mode] = {
+            "names_per_second": round(len(names) / elapsed, 1),
+            "padding_share": round(1.0 - real_tokens / padded, 4),
+        }
+    return results
+
+
+def main():
+    """
+    Run the bucketing benchmark from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark length-bucketed encoding.")
+    parser.add_argument("--extract", default=SNOINC_CODES_FILE, help="SNOINC extract path")
+    parser.add_argument("--model", default=MODEL_NAME, help="SentenceTransformers model name")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-tokens", type=int, default=None, help="Padded tokens per batch")
+    parser.add_argument("--limit", type=int, default=None, help="Only encode the first N names")
+    args = parser.parse_args()
+
+    print("Instantiating language model...")
+    model = SentenceTransformer(args.model)
+    lcns, sns, dns = parse_snoinc_extracts(args.extract)
+    names = [n for n in lcns + sns + dns if n != ""][: args.limit]
+
+    print(f"Encoding {len(names)} names with batch size {args.batch_size}...")
+    results = run_benchmark(model, names, args.batch_size, args.max_tokens)
+    for mode, stats in results.items():
+        print(
+            f"  {mode}: {stats['names_per_second']} names/s, "
+            f"{stats['padding_share'] * 100.0:.1f}% padding"
+        )
+    speedup = results["bucketed"]["names_per_second"] / results["baseline"]["names_per_second"]
+    print(f"  Speedup: {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Distill the production encoder into a shallower student for faster inference.
+
+The student starts as a copy of the teacher with only some of its transformer
+layers kept, which roughly divides encoding time by the fraction of layers
+removed. It is then trained to reproduce the teacher's embeddings (mean
+squared error) for the standard LOINC names in the SNOINC extract and, when a
+directory of pair shards from `data_curation/augmentation_pipeline.py` is
+given, for their augmented variants as well, so the student also learns how
+the teacher places noisy inputs. Training batches are grouped by token
+length to avoid padding waste. The student keeps the teacher's tokenizer, so
+with a token cache directory both models are fed from the same cached token
+ids and nothing is tokenized after the first run.
+
+After training, the teacher and student are both scored on the gold sets
+with the evaluation harness, and the run fails when the student's Top-K
+accuracy falls further behind the teacher's than allowed.
+
+Usage:
+    python -m model_tuning.distillation <output_dir>
+    python -m model_tuning.distillation student/ --layers 3 --pairs-dir pairs/ --epochs 2
+
+To view all options and usage details:
+    python -m model_tuning.distillation --help
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import random
+import time
+import typing
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from dibbs_text_to_code.batching import length_batches
+from dibbs_text_to_code.batching import token_lengths
+from model_tuning.evaluation import EvalConfig
+from model_tuning.evaluation import run_evaluation
+from model_tuning.performance import MODEL_NAME
+from model_tuning.performance import parse_snoinc_extracts
+from model_tuning.performance import SNOINC_CODES_FILE
+from model_tuning.performance import VALIDATION_FILE
+from model_tuning.token_cache import load_or_build
+
+DEFAULT_LAYERS = 3
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_LEARNING_RATE = 1e-4
+DEFAULT_MAX_ACCURACY_DROP = 0.02
+
+
+def load_training_sentences(extract_path: str, pairs_dir: typing.Optional[str] = None) -> list[str]:
+    """
+    Collects the distinct sentences to distill on: every standard name in the
+    extract, plus the augmented text of every pair in the pair shards.
+
+    :param extract_path: The SNOINC extract.
+    :param pairs_dir: Optionally, a directory of `pairs-*.csv` shards.
+    :returns: The sentences, in first-seen order.
+    """
+    lcns, sns, dns = parse_snoinc_extracts(extract_path)
+    sentences = dict.fromkeys(n for n in lcns + sns + dns if n != "")
+    if pairs_dir is not None:
+        for path in sorted(glob.glob(os.path.join(pairs_dir, "pairs-*.csv"))):
+            with open(path, "r", newline="", encoding="utf-8") as fp:
+                for row in csv.reader(fp, delimiter="|"):
+                    if row and row[0].strip() != "":
+                        sentences[row[0].strip()] = None
+    return list(sentences)
+
+
+def layers_to_keep(num_layers: int, num_keep: int) -> list[int]:
+    """
+    Picks evenly spaced layers to keep, always including the first and last,
+    which tend to matter most to the final embedding.
+    """
+    if not 0 < num_keep <= num_layers:
+        raise ValueError(f"Can't keep {num_keep} of {num_layers} layers")
+    if num_keep == 1:
+        return [num_layers - 1]
+    return sorted({int(round(i)) for i in np.linspace(0, num_layers - 1, num_keep)})
+
+
+def make_student(
+    teacher_name: str, num_layers: int = DEFAULT_LAYERS, device: typing.Optional[str] = None
+) -> SentenceTransformer:
+    """
+    Loads a copy of the teacher with all but `num_layers` of its transformer
+    layers removed.
+
+    :raises ValueError: If the teacher isn't a BERT-style encoder.
+    """
+    student = SentenceTransformer(teacher_name, device=device)
+    auto_model = student[0].auto_model
+    encoder = getattr(auto_model, "encoder", None)
+    if encoder is None or not hasattr(encoder, "layer"):
+        raise ValueError(f"{teacher_name} doesn't have a BERT-style encoder to prune")
+
+    keep = layers_to_keep(len(encoder.layer), num_layers)
+    encoder.layer = torch.nn.ModuleList([encoder.layer[i] for i in keep])
+    auto_model.config.num_hidden_layers = len(keep)
+    return student
+
+
+def distill(
+    teacher: SentenceTransformer,
+    student: SentenceTransformer,
+    sentences: list[str],
+    output_dir: str,
+    epochs: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    learning_rate: float = DEFAULT_LEARNING_RATE,
+    seed: int = 42,
+    log_every: int = 100,
+    token_cache_dir: typing.Optional[str] = None,
+) -> float:
+    """
+    Trains the student to reproduce the teacher's embeddings and saves it in
+    SentenceTransformers format. Teacher embeddings are computed batch by
+    batch rather than stored, so memory doesn't grow with the corpus.
+
+    :param teacher: The model to imitate.
+    :param student: The model to train.
+    :param sentences: The sentences to train on.
+    :param output_dir: The directory to save the student to.
+    :param epochs: The number of passes over the sentences.
+    :param batch_size: The number of sentences per batch.
+    :param learning_rate: The optimizer's learning rate.
+    :param seed: The random seed for batch order.
+    :param log_every: The number of batches between progress reports.
+    :param token_cache_dir: Optionally, a token cache directory to read the
+      sentences' token ids and lengths from.
+    :returns: The mean loss of the final epoch.
+    """
+    rng = random.Random(seed)
+    corpus = None
+    if token_cache_dir is not None:
+        corpus = load_or_build(student, sentences, token_cache_dir)
+        lengths = corpus.lengths.tolist()
+    else:
+        lengths = token_lengths(student, sentences)
+    batches = length_batches(lengths, batch_size)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate)
+    loss_fn = torch.nn.MSELoss()
+
+    teacher.eval()
+    student.train()
+    mean_loss = 0.0
+    for epoch in range(epochs):
+        rng.shuffle(batches)
+        start, total_loss = time.perf_counter(), 0.0
+        for batch_num, batch in enumerate(batches, 1):
+            if corpus is not None:
+                features = {k: v.to(student.device) for k, v in corpus.features(batch).items()}
+                with torch.no_grad():
+                    target = teacher(dict(features))["sentence_embedding"]
+            else:
+                texts = [sentences[i] for i in batch]
+                target = teacher.encode(texts, batch_size=len(texts), convert_to_tensor=True)
+                features = {k: v.to(student.device) for k, v in student.tokenize(texts).items()}
+            embeddings = student(features)["sentence_embedding"]
+            loss = loss_fn(embeddings, target.to(student.device))
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+            total_loss += loss.item()
+            if batch_num % log_every == 0:
+                print(
+                    f"  Epoch {epoch + 1}, batch {batch_num}/{len(batches)}: "
+                    f"loss {total_loss / batch_num:.6f}, "
+                    f"{batch_num / (time.perf_counter() - start):.1f} batches/sec"
+                )
+        mean_loss = total_loss / max(len(batches), 1)
+        print(f"Epoch {epoch + 1} mean loss: {mean_loss:.6f}")
+
+    student.eval()
+    student.save(output_dir)
+    return mean_loss
+
+
+def compare_to_teacher(
+    results: dict,
+    teacher_config: EvalConfig,
+    student_config: EvalConfig,
+    max_accuracy_drop: float = DEFAULT_MAX_ACCURACY_DROP,
+) -> dict:
+    """
+    Summarizes how the student did against the teacher in an evaluation run.
+
+    :param results: The output of `evaluation.run_evaluation` for both models.
+    :param teacher_config: The teacher's configuration in the run.
+    :param student_config: The student's configuration in the run.
+    :param max_accuracy_drop: The largest acceptable absolute drop in Top-K
+      accuracy at any K.
+    :returns: The accuracy drop per K, the throughput and p95 latency
+      speedups, and whether the student passed.
+    """
+    teacher = results["results"][teacher_config.name]
+    student = results["results"][student_config.name]
+    accuracy_drop = {
+        k: round(accuracy - student["top_k_accuracy"][k], 5)
+        for k, accuracy in teacher["top_k_accuracy"].items()
+    }
+    return {
+        "accuracy_drop": accuracy_drop,
+        "throughput_speedup": round(
+            student["queries_per_second"] / max(teacher["queries_per_second"], 1e-9), 2
+        ),
+        "p95_latency_speedup": round(
+            teacher["p95_latency_ms"] / max(student["p95_latency_ms"], 1e-9), 2
+        ),
+        "passed": all(drop <= max_accuracy_drop for drop in accuracy_drop.values()),
+    }
+
+
+def main():
+    """
+    Distill, evaluate and save a student encoder from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Distill a smaller student encoder.")
+    parser.add_argument("output_dir", help="Directory to save the student model to")
+    parser.add_argument("--teacher", default=MODEL_NAME, help="SentenceTransformers model name")
+    parser.add_argument("--layers", type=int, default=DEFAULT_LAYERS, help="Student layers")
+    parser.add_argument("--extract", default=SNOINC_CODES_FILE, help="SNOINC extract path")
+    parser.add_argument("--pairs-dir", default=None, help="Augmented pair shards to train on")
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--learning-rate", type=float, default=DEFAULT_LEARNING_RATE)
+    parser.add_argument("--gold", nargs="+", default=[VALIDATION_FILE], help="Gold set files")
+    parser.add_argument("--max-accuracy-drop", type=float, default=DEFAULT_MAX_ACCURACY_DROP)
+    parser.add_argument("--report", default=None, help="Path to write the JSON report to")
+    parser.add_argument("--token-cache", default=None, help="Token cache directory")
+    args = parser.parse_args()
+
+    print("Instantiating teacher and student models...")
+    teacher = SentenceTransformer(args.teacher)
+    student = make_student(args.teacher, args.layers)
+    sentences = load_training_sentences(args.extract, args.pairs_dir)
+    print(f"Distilling on {len(sentences)} sentences...")
+    distill(
+        teacher,
+        student,
+        sentences,
+        args.output_dir,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        token_cache_dir=args.token_cache,
+    )
+
+    print("Evaluating teacher and student...")
+    teacher_config, student_config = EvalConfig(args.teacher), EvalConfig(args.output_dir)
+    results = run_evaluation([teacher_config, student_config], args.gold, args.extract)
+    report = compare_to_teacher(results, teacher_config, student_config, args.max_accuracy_drop)
+    report["evaluation"] = results
+    if args.report is not None:
+        with open(args.report, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+    print(f"  Top-K accuracy drop: {report['accuracy_drop']}")
+    print(f"  Throughput speedup: {report['throughput_speedup']}x")
+    print(f"  p95 latency speedup: {report['p95_latency_speedup']}x")
+    if not report["passed"]:
+        print(f"Student lost more than {args.max_accuracy_drop} Top-K accuracy")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Build the LOINC embedding index in resumable shards.
+
+The standardized names from the SNOINC extract are split into fixed-size
+shards. Each shard is encoded (across a SentenceTransformers multi-process
+pool when more than one worker is requested) and saved to the work directory
+as soon as it finishes, so a crash or timeout only loses the shard in
+progress. Re-running the job skips completed shards, and once every shard
+exists they are merged into a single index file in the format that
+`performance.py` loads from its embedding cache. With a token cache
+directory, the names are tokenized once and later runs encode them from the
+cached token ids.
+
+Usage:
+    python -m model_tuning.embedding_job <work_dir> <index_out>
+    python -m model_tuning.embedding_job shards/ loinc_lab_names.pkl --workers 4
+    python -m model_tuning.embedding_job shards/ loinc_lab_names.pkl --token-cache tokens/
+"""
+
+import argparse
+import json
+import os
+import pickle
+import time
+import typing
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+from dibbs_text_to_code.batching import encode_bucketed
+from model_tuning.performance import MODEL_NAME
+from model_tuning.performance import parse_snoinc_extracts
+from model_tuning.performance import SNOINC_CODES_FILE
+from model_tuning.token_cache import corpus_digest
+from model_tuning.token_cache import encode_cached
+from model_tuning.token_cache import load_or_build
+
+DEFAULT_SHARD_SIZE = 5000
+DEFAULT_BATCH_SIZE = 64
+MANIFEST_FILE = "manifest.json"
+
+
+def shard_path(work_dir: str, shard_num: int) -> str:
+    """
+    The path of the saved embeddings for a shard.
+    """
+    return os.path.join(work_dir, f"embeddings-{shard_num:05d}.npy")
+
+
+def prepare_work_dir(work_dir: str, model_name: str, names: list[str], shard_size: int) -> None:
+    """
+    Creates the work directory and its manifest, or checks that an existing
+    manifest was written for the same model, corpus and shard size.
+
+    :raises ValueError: If the work directory belongs to a different job.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    manifest = {
+        "model_name": model_name,
+        "num_names": len(names),
+        "shard_size": shard_size,
+        "corpus_digest": corpus_digest(names),
+    }
+    manifest_path = os.path.join(work_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as fp:
+            existing = json.load(fp)
+        if existing != manifest:
+            raise ValueError(
+                f"{work_dir} holds shards for a different job; use a new work directory"
+            )
+        return
+    with open(manifest_path, "w") as fp:
+        json.dump(manifest, fp, indent=2)
+
+
+def encode_shards(
+    model: SentenceTransformer,
+    names: list[str],
+    work_dir: str,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 1,
+    token_cache_dir: typing.Optional[str] = None,
+) -> int:
+    """
+    Encodes every shard that doesn't already have saved embeddings.
+
+    :param model: The SentenceTransformers model to encode with.
+    :param names: The full list of names to embed.
+    :param work_dir: The directory holding the shard files.
+    :param shard_size: The number of names per shard.
+    :param batch_size: The number of names per model forward pass.
+    :param workers: The number of encoding processes.
+    :param token_cache_dir: Optionally, a token cache directory; names are
+      then encoded from cached token ids. Only used with a single worker.
+    :returns: The number of shards encoded by this call.
+    """
+    num_shards = (len(names) + shard_size - 1) // shard_size
+    pending = [n for n in range(num_shards) if not os.path.exists(shard_path(work_dir, n))]
+    if not pending:
+        return 0
+
+    pool = model.start_multi_process_pool(["cpu"] * workers) if workers > 1 else None
+    corpus = None
+    if pool is None and token_cache_dir is not None:
+        corpus = load_or_build(model, names, token_cache_dir)
+    try:
+        for shard_num in pending:
+            start = time.time()
+            texts = names[shard_num * shard_size : (shard_num + 1) * shard_size]
+            if pool is not None:
+                embeddings = model.encode_multi_process(texts, pool, batch_size=batch_size)
+            elif corpus is not None:
+                positions = range(shard_num * shard_size, shard_num * shard_size + len(texts))
+                embeddings = encode_cached(model, corpus, positions, batch_size=batch_size)
+            else:
+                embeddings = encode_bucketed(model, texts, batch_size=batch_size)
+            _save_shard(work_dir, shard_num, np.asarray(embeddings, dtype=np.float32))
+            print(
+                f"  Encoded shard {shard_num + 1}/{num_shards} "
+                f"({len(texts)} names, {time.time() - start:.1f}s)"
+            )
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+    return len(pending)
+
+
+def merge_shards(work_dir: str, names: list[str], shard_size: int, out_path: str) -> None:
+    """
+    Concatenates the shard embeddings in order and writes the final index as
+    a {"codes": names, "embeddings": tensor} pickle.
+
+    :raises ValueError: If a shard is missing or the wrong size.
+    """
+    num_shards = (len(names) + shard_size - 1) // shard_size
+    arrays = []
+    for shard_num in range(num_shards):
+        path = shard_path(work_dir, shard_num)
+        if not os.path.exists(path):
+            raise ValueError(f"Shard {shard_num} has not been encoded yet")
+        arrays.append(np.load(path))
+    embeddings = np.concatenate(arrays) if arrays else np.zeros((0, 0), dtype=np.float32)
+    if embeddings.shape[0] != len(names):
+        raise ValueError(f"Shards hold {embeddings.shape[0]} embeddings for {len(names)} names")
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        pickle.dump({"codes": names, "embeddings": torch.from_numpy(embeddings)}, fp)
+    os.replace(tmp_path, out_path)
+
+
+def run_embedding_job(
+    names: list[str],
+    work_dir: str,
+    out_path: str,
+    model_name: str = MODEL_NAME,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    workers: int = 1,
+    model: typing.Optional[SentenceTransformer] = None,
+    token_cache_dir: typing.Optional[str] = None,
+) -> None:
+    """
+    Encodes any missing shards of the corpus and merges them into the index.
+
+    :param names: The names to embed.
+    :param work_dir: The directory holding the shard files and manifest.
+    :param out_path: The path to write the merged index to.
+    :param model_name: The SentenceTransformers model to encode with.
+    :param shard_size: The number of names per shard.
+    :param batch_size: The number of names per model forward pass.
+    :param workers: The number of encoding processes.
+    :param model: Optionally, an already loaded model to use.
+    :param token_cache_dir: Optionally, a token cache directory to encode
+      from, which saves re-tokenizing the names on every run.
+    """
+    prepare_work_dir(work_dir, model_name, names, shard_size)
+    if model is None:
+        model = SentenceTransformer(model_name)
+    encoded = encode_shards(
+        model, names, work_dir, shard_size, batch_size, workers, token_cache_dir
+    )
+    print(f"Encoded {encoded} shards; merging into {out_path}")
+    merge_shards(work_dir, names, shard_size, out_path)
+
+
+def _save_shard(work_dir: str, shard_num: int, embeddings: np.ndarray) -> None:
+    """
+    Saves a shard under a temporary name and renames it into place, so a
+    shard file only exists once it is complete.
+    """
+    path = shard_path(work_dir, shard_num)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        np.save(fp, embeddings)
+    os.replace(tmp_path, path)
+
+
+def main():
+    """
+    Run the embedding job from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Build the LOINC embedding index in shards.")
+    parser.add_argument("work_dir", help="Directory for shard files and the job manifest")
+    parser.add_argument("index_out", help="Path to write the merged index to")
+    parser.add_argument("--extract", default=SNOINC_CODES_FILE, help="SNOINC extract path")
+    parser.add_argument("--model", default=MODEL_NAME, help="SentenceTransformers model name")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=1, help="Number of encoding processes")
+    parser.add_argument("--token-cache", default=None, help="Token cache directory to encode from")
+    args = parser.parse_args()
+
+    lcns, sns, dns = parse_snoinc_extracts(args.extract)
+    run_embedding_job(
+        lcns + sns + dns,
+        args.work_dir,
+        args.index_out,
+        model_name=args.model,
+        shard_size=args.shard_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        token_cache_dir=args.token_cache,
+    )
+
+
+if __name__ == "__main__":
+    main()
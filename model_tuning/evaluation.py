@@ -0,0 +1,444 @@
+"""
+Evaluate text-to-code configurations against labelled gold sets.
+
+A gold set is a pipe-delimited file whose first two columns are the free-text
+input and the standard LOINC name it should map to, such as
+`validation_toy.txt` or the pair shards written by
+`data_curation/augmentation_pipeline.py`. Each configuration (a model, an
+index type and an embedding dtype) is scored on Top-K accuracy and mean
+reciprocal rank, and timed one query at a time for queries per second and
+latency percentiles. Results are written as JSON so that a later run can be
+compared against them; `compare` exits with a non-zero status when any
+configuration has regressed beyond the allowed tolerances.
+
+Each configuration is evaluated in a fresh subprocess by default, so its
+peak memory (the peak resident set size of that process) covers only its own
+model and index rather than every configuration evaluated before it.
+
+Usage:
+    python -m model_tuning.evaluation run <gold_set> [<gold_set> ...] --out <results.json>
+    python -m model_tuning.evaluation run gold.txt --index dense hybrid --out new.json
+    python -m model_tuning.evaluation compare baseline.json new.json
+
+To view all options and usage details:
+    python -m model_tuning.evaluation --help
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import hashlib
+import json
+import multiprocessing
+import time
+import typing
+from dataclasses import asdict
+from dataclasses import dataclass
+
+import numpy as np
+
+from dibbs_text_to_code.batching import EncodeFn
+from dibbs_text_to_code.metrics import peak_rss_bytes
+from dibbs_text_to_code.retrieval import HybridRetriever
+from dibbs_text_to_code.valuesets import Concept
+from dibbs_text_to_code.valuesets import EmbeddingIndex
+from dibbs_text_to_code.valuesets import LexicalMatcher
+from dibbs_text_to_code.valuesets import load_related_names
+from dibbs_text_to_code.valuesets import load_valueset_csv
+from dibbs_text_to_code.valuesets import ValueSetIndex
+from model_tuning.performance import K_VALUES
+from model_tuning.performance import MODEL_NAME
+from model_tuning.performance import SNOINC_CODES_FILE
+
+INDEX_TYPES = ("dense", "hybrid", "lexical")
+DTYPES = ("float32", "float16")
+
+
+@dataclass(frozen=True)
+class EvalConfig:
+    """
+    One configuration of the coding pipeline to evaluate.
+    """
+
+    model: str = MODEL_NAME
+    index_type: str = "dense"
+    dtype: str = "float32"
+
+    @property
+    def name(self) -> str:
+        """
+        The key the configuration's results are stored under.
+        """
+        return f"{self.model}/{self.index_type}/{self.dtype}"
+
+
+@dataclass(frozen=True)
+class Tolerances:
+    """
+    How far a candidate run may fall behind its baseline before it counts as
+    a regression. Accuracy and MRR drops are absolute; throughput, latency and
+    memory changes are fractions of the baseline value.
+    """
+
+    max_accuracy_drop: float = 0.0
+    max_throughput_drop: float = 0.1
+    max_latency_increase: float = 0.1
+    max_memory_increase: float = 0.1
+
+
+def load_gold_set(paths: typing.Iterable[str]) -> list[tuple[str, str]]:
+    """
+    Reads (input, expected name) pairs from one or more pipe-delimited files.
+    Fields are parsed as CSV, so the quoted fields the augmentation pipeline
+    writes are read correctly. Columns past the second, such as the code in
+    augmented pair shards, are ignored.
+    """
+    examples = []
+    for path in paths:
+        with open(path, "r", newline="", encoding="utf-8") as fp:
+            for columns in csv.reader(fp, delimiter="|"):
+                if len(columns) >= 2 and columns[0].strip() and columns[1].strip():
+                    examples.append((columns[0].strip(), columns[1].strip()))
+    return examples
+
+
+def gold_set_digest(examples: list[tuple[str, str]]) -> str:
+    """
+    Computes a digest of a gold set so that runs on different sets are never
+    compared with each other.
+    """
+    digest = hashlib.sha1()
+    for text, expected in examples:
+        digest.update(f"{text}|{expected}\n".encode())
+    return digest.hexdigest()
+
+
+def build_index(
+    config: EvalConfig,
+    concepts: list[Concept],
+    encode_fn: typing.Optional[EncodeFn],
+    related_names: typing.Optional[dict[str, list[str]]] = None,
+) -> ValueSetIndex:
+    """
+    Builds the index a configuration describes over the given concepts.
+    """
+    if config.index_type == "lexical":
+        return LexicalMatcher(concepts)
+    if encode_fn is None:
+        raise ValueError(f"Index type '{config.index_type}' needs an encoder")
+    if config.index_type == "dense":
+        return EmbeddingIndex(concepts, encode_fn, dtype=np.dtype(config.dtype))
+    if config.index_type == "hybrid":
+        return HybridRetriever(concepts, encode_fn, related_names)
+    raise ValueError(f"Unknown index type '{config.index_type}'")
+
+
+def evaluate_index(
+    index: ValueSetIndex,
+    examples: list[tuple[str, str]],
+    k_values: typing.Sequence[int] = K_VALUES,
+    concepts: typing.Optional[list[Concept]] = None,
+) -> dict:
+    """
+    Scores an index on a gold set. Every query is searched on its own so the
+    latencies reflect what a single lookup costs.
+
+    :param index: The index to evaluate.
+    :param examples: The (input, expected name) pairs.
+    :param k_values: The values of K to report Top-K accuracy for.
+    :param concepts: Optionally, the indexed concepts. A match then counts
+      as correct when it shares a code with the expected name, since the
+      long, short and display names of a code are all indexed.
+    :returns: The accuracy, MRR, throughput and latency metrics.
+    """
+    codes_by_name: dict[str, set[str]] = {}
+    for concept in concepts or []:
+        codes_by_name.setdefault(concept.text, set()).add(concept.code)
+
+    max_k = max(k_values)
+    ranks = []
+    latencies = []
+    for text, expected in examples:
+        expected_codes = codes_by_name.get(expected, set())
+        start = time.perf_counter()
+        matches = index.search([text], top_k=max_k)[0]
+        latencies.append(time.perf_counter() - start)
+        rank = next(
+            (
+                i + 1
+                for i, m in enumerate(matches)
+                if m.text == expected or m.code in expected_codes
+            ),
+            None,
+        )
+        ranks.append(rank)
+
+    num = max(len(examples), 1)
+    total_time = sum(latencies)
+    latencies_ms = np.array(latencies or [0.0]) * 1000.0
+    return {
+        "top_k_accuracy": {
+            str(k): round(sum(1 for r in ranks if r is not None and r <= k) / num, 5)
+            for k in k_values
+        },
+        "mrr": round(sum(1.0 / r for r in ranks if r is not None) / num, 5),
+        "queries_per_second": round(len(examples) / total_time, 2) if total_time > 0 else 0.0,
+        "p50_latency_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_latency_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+    }
+
+
+def evaluate_config(
+    config: EvalConfig,
+    examples: list[tuple[str, str]],
+    concepts: list[Concept],
+    encode_fn: typing.Optional[EncodeFn],
+    related_names: typing.Optional[dict[str, list[str]]] = None,
+    k_values: typing.Sequence[int] = K_VALUES,
+) -> dict:
+    """
+    Builds a configuration's index and evaluates it.
+
+    :returns: The configuration, its metrics, the index build time and the
+      peak memory of the process, which only isolates this configuration
+      when it is evaluated in a process of its own.
+    """
+    start = time.perf_counter()
+    index = build_index(config, concepts, encode_fn, related_names)
+    build_seconds = time.perf_counter() - start
+    metrics = evaluate_index(index, examples, k_values, concepts)
+    return {
+        "config": asdict(config),
+        "num_examples": len(examples),
+        "build_seconds": round(build_seconds, 3),
+        "peak_rss_bytes": peak_rss_bytes(),
+        **metrics,
+    }
+
+
+def compare_results(
+    baseline: dict, candidate: dict, tolerances: Tolerances = Tolerances()
+) -> list[str]:
+    """
+    Compares two results files and describes every regression of the
+    candidate against the baseline.
+
+    :param baseline: The results of the accepted run.
+    :param candidate: The results of the run under test.
+    :param tolerances: How much worse the candidate may be.
+    :returns: One message per regression; empty when there are none.
+    :raises ValueError: If the runs were made on different gold sets.
+    """
+    if baseline.get("gold_set_digest") != candidate.get("gold_set_digest"):
+        raise ValueError("The runs were evaluated on different gold sets")
+
+    regressions = []
+    for name, base in baseline["results"].items():
+        cand = candidate["results"].get(name)
+        if cand is None:
+            regressions.append(f"{name}: missing from the candidate run")
+            continue
+
+        for k, accuracy in base["top_k_accuracy"].items():
+            new_accuracy = cand["top_k_accuracy"].get(k, 0.0)
+            if accuracy - new_accuracy > tolerances.max_accuracy_drop:
+                regressions.append(f"{name}: Top-{k} accuracy fell {accuracy} -> {new_accuracy}")
+        if base["mrr"] - cand["mrr"] > tolerances.max_accuracy_drop:
+            regressions.append(f"{name}: MRR fell {base['mrr']} -> {cand['mrr']}")
+
+        if cand["queries_per_second"] < base["queries_per_second"] * (
+            1.0 - tolerances.max_throughput_drop
+        ):
+            regressions.append(
+                f"{name}: queries/sec fell "
+                f"{base['queries_per_second']} -> {cand['queries_per_second']}"
+            )
+        if cand["p95_latency_ms"] > base["p95_latency_ms"] * (
+            1.0 + tolerances.max_latency_increase
+        ):
+            regressions.append(
+                f"{name}: p95 latency rose {base['p95_latency_ms']}ms -> {cand['p95_latency_ms']}ms"
+            )
+        if cand["peak_rss_bytes"] > base["peak_rss_bytes"] * (1.0 + tolerances.max_memory_increase):
+            regressions.append(
+                f"{name}: peak memory rose {base['peak_rss_bytes']} -> {cand['peak_rss_bytes']} bytes"
+            )
+    return regressions
+
+
+def run_evaluation(
+    configs: list[EvalConfig],
+    gold_paths: list[str],
+    extract_path: str = SNOINC_CODES_FILE,
+    k_values: typing.Sequence[int] = K_VALUES,
+    load_encoder: typing.Optional[typing.Callable[[str], EncodeFn]] = None,
+    isolate: bool = True,
+) -> dict:
+    """
+    Evaluates every configuration on the combined gold sets.
+
+    :param configs: The configurations to evaluate.
+    :param gold_paths: The gold set files.
+    :param extract_path: The LOINC lab names value set to code against.
+    :param k_values: The values of K to report Top-K accuracy for.
+    :param load_encoder: Optionally, a function returning the batch encoder
+      for a model name. Defaults to loading a SentenceTransformers model.
+      Must be picklable (e.g. a module-level function) when `isolate` is set.
+    :param isolate: Whether to evaluate each configuration in a fresh
+      subprocess, so its peak memory isn't inflated by earlier ones. When
+      off, models are loaded once and shared, but every configuration
+      reports the peak of the whole process so far.
+    :returns: The results, keyed by configuration name, with run metadata.
+    """
+    if load_encoder is None:
+        load_encoder = _load_sentence_transformer
+    examples = load_gold_set(gold_paths)
+
+    results = {}
+    if isolate:
+        for config in configs:
+            print(f"  Evaluating {config.name}...")
+            # Spawned rather than forked, so the child starts without this
+            # process's memory
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                results[config.name] = pool.submit(
+                    _evaluate_from_files, config, gold_paths, extract_path, k_values, load_encoder
+                ).result()
+    else:
+        concepts = load_valueset_csv(extract_path, ("long_name", "short_name", "display_name"))
+        related_names = load_related_names(extract_path)
+        encoders: dict[str, EncodeFn] = {}
+        for config in configs:
+            encode_fn = None
+            if config.index_type != "lexical":
+                if config.model not in encoders:
+                    encoders[config.model] = load_encoder(config.model)
+                encode_fn = encoders[config.model]
+            print(f"  Evaluating {config.name}...")
+            results[config.name] = evaluate_config(
+                config, examples, concepts, encode_fn, related_names, k_values
+            )
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "gold_sets": list(gold_paths),
+        "gold_set_digest": gold_set_digest(examples),
+        "results": results,
+    }
+
+
+def _evaluate_from_files(
+    config: EvalConfig,
+    gold_paths: list[str],
+    extract_path: str,
+    k_values: typing.Sequence[int],
+    load_encoder: typing.Callable[[str], EncodeFn],
+) -> dict:
+    """
+    Loads the gold sets, value set and encoder and evaluates one
+    configuration, for running in a subprocess of its own.
+    """
+    examples = load_gold_set(gold_paths)
+    concepts = load_valueset_csv(extract_path, ("long_name", "short_name", "display_name"))
+    related_names = load_related_names(extract_path)
+    encode_fn = None if config.index_type == "lexical" else load_encoder(config.model)
+    return evaluate_config(config, examples, concepts, encode_fn, related_names, k_values)
+
+
+def _load_sentence_transformer(model_name: str) -> EncodeFn:
+    """
+    Loads a SentenceTransformers model as a batch encoder.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    from dibbs_text_to_code.batching import sentence_transformer_encode_fn
+
+    return sentence_transformer_encode_fn(SentenceTransformer(model_name), convert_to_tensor=False)
+
+
+def _print_results(results: dict) -> None:
+    """
+    Prints a short summary of each configuration's results.
+    """
+    for name, result in results["results"].items():
+        accuracy = ", ".join(
+            f"Top-{k} {v * 100.0:.1f}%" for k, v in result["top_k_accuracy"].items()
+        )
+        print(f"{name}")
+        print(f"    {accuracy}, MRR {result['mrr']}")
+        print(
+            f"    {result['queries_per_second']} queries/sec, "
+            f"p95 {result['p95_latency_ms']}ms, "
+            f"peak RSS {result['peak_rss_bytes'] / 2**20:.0f}MiB"
+        )
+
+
+def main():
+    """
+    Run or compare evaluations from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Evaluate text-to-code configurations.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Evaluate configurations on gold sets")
+    run_parser.add_argument("gold_sets", nargs="+", help="Pipe-delimited input|expected files")
+    run_parser.add_argument("--out", required=True, help="Path to write the JSON results to")
+    run_parser.add_argument("--extract", default=SNOINC_CODES_FILE, help="LOINC value set path")
+    run_parser.add_argument("--model", nargs="+", default=[MODEL_NAME])
+    run_parser.add_argument("--index", nargs="+", default=["dense"], choices=INDEX_TYPES)
+    run_parser.add_argument("--dtype", nargs="+", default=["float32"], choices=DTYPES)
+    run_parser.add_argument("--baseline", help="Results to compare this run against")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("baseline", help="Results of the accepted run")
+    compare_parser.add_argument("candidate", help="Results of the run under test")
+
+    for sub in (run_parser, compare_parser):
+        sub.add_argument("--max-accuracy-drop", type=float, default=0.0)
+        sub.add_argument("--max-throughput-drop", type=float, default=0.1)
+        sub.add_argument("--max-latency-increase", type=float, default=0.1)
+        sub.add_argument("--max-memory-increase", type=float, default=0.1)
+    args = parser.parse_args()
+
+    tolerances = Tolerances(
+        args.max_accuracy_drop,
+        args.max_throughput_drop,
+        args.max_latency_increase,
+        args.max_memory_increase,
+    )
+    if args.command == "run":
+        configs = [
+            EvalConfig(model, index_type, dtype)
+            for model in args.model
+            for index_type in args.index
+            # The dtype only changes how dense embeddings are stored
+            for dtype in (args.dtype if index_type == "dense" else ["float32"])
+        ]
+        candidate = run_evaluation(configs, args.gold_sets, args.extract)
+        with open(args.out, "w") as fp:
+            json.dump(candidate, fp, indent=2)
+        _print_results(candidate)
+        baseline_path = args.baseline
+    else:
+        with open(args.candidate, "r") as fp:
+            candidate = json.load(fp)
+        baseline_path = args.baseline
+
+    if baseline_path is None:
+        return
+    with open(baseline_path, "r") as fp:
+        baseline = json.load(fp)
+    regressions = compare_results(baseline, candidate, tolerances)
+    if regressions:
+        print("Regressions found:")
+        for regression in regressions:
+            print(f"  {regression}")
+        raise SystemExit(1)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
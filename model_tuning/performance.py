@@ -1,12 +1,21 @@
 import os
 import pickle
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+from typing import Optional
 
 from sentence_transformers import SentenceTransformer
 from sentence_transformers import util
 from torch import Tensor
 
+from dibbs_text_to_code.batching import encode_bucketed
+from dibbs_text_to_code.batching import MicroBatcher
+from dibbs_text_to_code.batching import sentence_transformer_encode_fn
+from dibbs_text_to_code.valuesets import ValueSetIndex
+from model_tuning.token_cache import encode_cached
+from model_tuning.token_cache import load_or_build
+
 MODEL_NAME = "all-MiniLM-L6-v2"
 SNOINC_CODES_FILE = "../data/snoinc_extracts/loinc_lab_names_20250911.csv"
 EMBEDDING_CACHE_DIR = "../data/training_files/embeddings/"
@@ -66,21 +75,43 @@ def parse_snoinc_extracts(
 
 
 def embed_loinc_names(
-    model: SentenceTransformer, name_list: List[str], save_embeddings: bool = False
+    model: SentenceTransformer,
+    name_list: List[str],
+    save_embeddings: bool = False,
+    batch_size: int = 32,
+    token_cache_dir: Optional[str] = None,
 ):
     """
     Use a SentenceTransformers model to embed the standard name codes for
     a given set of LOINC values. These embeddings form the "Vector DB" that
     will be used for semantic search on the examples-to-evaluate. Optionally,
     save the embeddings to disk since computing them is time-consuming.
+    Names are encoded in buckets of similar token length so short names
+    aren't padded out to the long panel names they'd otherwise share a
+    batch with.
 
     :param model: The Sentence Transformers model to use for embedding.
     :param name_list: A list of strings to embed into the Vector DB.
     :param save_embeddings: Optionally, a boolean in dicating whether to persist
       the computed embeddings to disk.
+    :param batch_size: The number of names per model forward pass.
+    :param token_cache_dir: Optionally, a token cache directory, so the names
+      are only tokenized on the first run.
     :returns: The computed embeddings.
     """
-    corpus_embeddings = model.encode(name_list, show_progress_bar=True, convert_to_tensor=True)
+    if token_cache_dir is not None:
+        corpus = load_or_build(model, name_list, token_cache_dir)
+        corpus_embeddings = encode_cached(
+            model, corpus, batch_size=batch_size, convert_to_tensor=True, show_progress_bar=True
+        )
+    else:
+        corpus_embeddings = encode_bucketed(
+            model,
+            name_list,
+            batch_size=batch_size,
+            show_progress_bar=True,
+            convert_to_tensor=True,
+        )
 
     if save_embeddings:
         with open(EMBEDDING_CACHE_DIR + EMBEDDING_FILE, "wb") as fp:
@@ -95,6 +126,8 @@ def predict_and_evaluate_validation_set(
     standard_loinc_names: List[str],
     examples: List[List[str]],
     k: int,
+    retriever: Optional[ValueSetIndex] = None,
+    batch_size: int = 32,
 ) -> None:
     """
     Compute performance statistics for a given model on a given set of validation
@@ -113,38 +146,52 @@ def predict_and_evaluate_validation_set(
     :param examples: A list of lists of strings representing the experimental
       examples to evaluate.
     :param k: An integer for how many neighbors to retrieve from the DB.
+    :param retriever: Optionally, an index such as a `HybridRetriever` to
+      search with instead of exact dense search over `vector_db`. Its
+      matches are compared against the correct code by their text.
+    :param batch_size: The number of inputs evaluated concurrently, and the
+      most the micro-batcher encodes at once.
     :returns: None
     """
-    cosine_sims = []
-    times = []
-    examples_with_correct_output_in_top_k = 0.0
-
-    for e in examples:
-        nonstandard_in = e[0].strip()
-        correct_code = e[1].strip()
-
-        # This utility performs exact neighbor semantic search
-        # If approximate is desired, see
-        # https://sbert.net/examples/sentence_transformer/applications/semantic-search/README.html#approximate-nearest-neighbor     # noqa
-        # for details
+    inputs = [e[0].strip() for e in examples]
+    correct_codes = [e[1].strip() for e in examples]
+
+    def search_one(batcher: Optional[MicroBatcher], text: str) -> tuple[list[str], float, float]:
+        # Each input is timed from its arrival to its results, as one query
+        # to a service would be, while concurrent inputs share encode calls
         start = time.time()
-        enc = model.encode(nonstandard_in, convert_to_tensor=True)
-        hits = util.semantic_search(enc, vector_db, top_k=k)
-        hits = hits[0]
-
-        # Store some metrics
-        times.append(time.time() - start)
-        cosine_sims.append(hits[0]["score"])
-
-        # Check if correct answer is in the returned search results
-        correct_in_top_k = False
-        for h in hits:
-            mapped_sentence = standard_loinc_names[h["corpus_id"]]  # ty: ignore
-            if mapped_sentence == correct_code:
-                correct_in_top_k = True
-                break
-        if correct_in_top_k:
-            examples_with_correct_output_in_top_k += 1.0
+        if batcher is None:
+            matches = retriever.search([text], top_k=k)[0]  # ty: ignore
+            mapped = [m.text for m in matches]
+            top_score = matches[0].score if matches else 0.0
+        else:
+            enc = batcher.encode(text)
+            # This utility performs exact neighbor semantic search
+            # If approximate is desired, see
+            # https://sbert.net/examples/sentence_transformer/applications/semantic-search/README.html#approximate-nearest-neighbor     # noqa
+            # for details
+            hits = util.semantic_search(enc, vector_db, top_k=k)[0]
+            mapped = [standard_loinc_names[h["corpus_id"]] for h in hits]  # ty: ignore
+            top_score = hits[0]["score"]
+        return mapped, top_score, time.time() - start
+
+    batcher = None
+    if retriever is None:
+        batcher = MicroBatcher(sentence_transformer_encode_fn(model), max_batch_size=batch_size)
+    try:
+        with ThreadPoolExecutor(max_workers=batch_size) as pool:
+            results = list(pool.map(lambda text: search_one(batcher, text), inputs))
+    finally:
+        if batcher is not None:
+            batcher.close()
+    mapped_sentences = [mapped for mapped, _, _ in results]
+    cosine_sims = [top_score for _, top_score, _ in results]
+    times = [elapsed for _, _, elapsed in results]
+
+    # Check if correct answer is in the returned search results
+    examples_with_correct_output_in_top_k = float(
+        sum(correct in mapped for correct, mapped in zip(correct_codes, mapped_sentences))
+    )
 
     mean_cosine_sim = round(float(sum(cosine_sims)) / float(len(cosine_sims)), 3)
     mean_encoding_search_time = round(float(sum(times)) / float(len(times)), 3)
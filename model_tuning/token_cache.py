@@ -0,0 +1,319 @@
+"""
+Cache the tokenization of a corpus on disk, so jobs that repeatedly embed or
+train on the same strings don't re-tokenize them every run.
+
+A corpus is tokenized once with the model's own preprocessing and saved as
+two memory-mapped arrays: the token ids of every string laid end to end, and
+the offset of each string's ids within them. The cache is keyed by a
+fingerprint of the tokenizer (its vocabulary, normalization and maximum
+sequence length) and a digest of the strings, so a different model or
+corpus never picks up stale ids. Token lengths come straight from the
+offsets, which lets length-bucketed batches be planned without the
+tokenizer, and padded model inputs for any batch are built from the cached
+ids alone.
+"""
+
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import typing
+
+import numpy as np
+import torch
+from tqdm.auto import tqdm
+
+from dibbs_text_to_code.batching import length_batches
+
+DEFAULT_CACHE_DIR = "../data/training_files/token_cache/"
+DEFAULT_CHUNK_SIZE = 1024
+# The number of values copied at a time when assembling the cache files
+COPY_BLOCK_SIZE = 2**22
+IDS_FILE = "input_ids.npy"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+
+def corpus_digest(texts: typing.Iterable[str]) -> str:
+    """
+    Computes a digest of the corpus, which changes with any string or with
+    their order.
+    """
+    digest = hashlib.sha1()
+    for text in texts:
+        digest.update(text.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def tokenizer_fingerprint(model) -> str:
+    """
+    Computes a digest of everything about a SentenceTransformers model that
+    affects the token ids it produces.
+    """
+    tokenizer = model.tokenizer
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        # Truncation and padding settings change as the tokenizer is called,
+        # and are applied per batch rather than stored
+        config = json.loads(backend.to_str())
+        config.pop("truncation", None)
+        config.pop("padding", None)
+    else:
+        config = {"vocab": sorted(tokenizer.get_vocab().items())}
+    config["class"] = type(tokenizer).__name__
+    config["max_seq_length"] = model.max_seq_length
+    config["do_lower_case"] = getattr(model[0], "do_lower_case", False)
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class TokenizedCorpus:
+    """
+    The cached token ids of a corpus, memory-mapped from disk. Position `i`
+    holds the ids of the `i`th string, special tokens included and truncated
+    to the model's maximum sequence length.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: The cache entry's directory.
+        """
+        self.path = path
+        with open(os.path.join(path, META_FILE), "r") as fp:
+            self.meta = json.load(fp)
+        self.input_ids = np.load(os.path.join(path, IDS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+
+    def __len__(self) -> int:
+        """
+        The number of strings in the corpus.
+        """
+        return len(self.offsets) - 1
+
+    def __getstate__(self) -> dict:
+        """
+        Pickles only the path, so DataLoader workers map the files themselves
+        rather than each receiving a copy of the arrays.
+        """
+        return {"path": self.path}
+
+    def __setstate__(self, state: dict) -> None:
+        """
+        Maps the cache entry again after unpickling.
+        """
+        self.__init__(state["path"])
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """
+        The token length of each string.
+        """
+        return np.diff(self.offsets)
+
+    def token_ids(self, position: int) -> np.ndarray:
+        """
+        The token ids of one string.
+        """
+        return self.input_ids[self.offsets[position] : self.offsets[position + 1]]
+
+    def features(self, positions: typing.Sequence[int]) -> dict[str, torch.Tensor]:
+        """
+        Builds the model inputs for a batch of strings, padded only to the
+        longest of them, as the model's own `tokenize` would.
+        """
+        rows = [self.token_ids(i) for i in positions]
+        input_ids = torch.full(
+            (len(rows), max((len(r) for r in rows), default=0)),
+            self.meta["pad_token_id"],
+            dtype=torch.long,
+        )
+        attention_mask = torch.zeros_like(input_ids)
+        for row_num, ids in enumerate(rows):
+            input_ids[row_num, : len(ids)] = torch.from_numpy(ids.astype(np.int64))
+            attention_mask[row_num, : len(ids)] = 1
+        features = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.meta["model_input_names"]:
+            features["token_type_ids"] = torch.zeros_like(input_ids)
+        return features
+
+
+def build_token_cache(
+    model,
+    texts: typing.Iterable[str],
+    path: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> TokenizedCorpus:
+    """
+    Tokenizes a corpus with the model's `tokenize` and saves it as a cache
+    entry. The strings are streamed: each chunk's ids and lengths are
+    appended to files as it is tokenized, so memory stays bounded by the
+    chunk size however large the corpus is. The files are written to a
+    temporary directory that is renamed into place, so an entry only exists
+    once complete.
+
+    :param model: The SentenceTransformers model whose tokenizer to use.
+    :param texts: The strings to tokenize.
+    :param path: The cache entry's directory.
+    :param chunk_size: The number of strings tokenized at once.
+    :returns: The cached corpus.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(path)}-", dir=parent)
+    try:
+        digest = hashlib.sha1()
+        num_texts = 0
+        num_tokens = 0
+        ids_raw = os.path.join(tmp_dir, IDS_FILE + ".raw")
+        lengths_raw = os.path.join(tmp_dir, OFFSETS_FILE + ".raw")
+        with open(ids_raw, "wb") as ids_fp, open(lengths_raw, "wb") as lengths_fp:
+            iterator = iter(texts)
+            while chunk := list(itertools.islice(iterator, chunk_size)):
+                for text in chunk:
+                    digest.update(text.encode())
+                    digest.update(b"\0")
+                features = model.tokenize(chunk)
+                mask = features["attention_mask"].bool()
+                # Masking flattens row by row, leaving each string's ids in order
+                ids = features["input_ids"][mask].numpy().astype(np.int32)
+                ids_fp.write(ids.tobytes())
+                lengths_fp.write(mask.sum(dim=1).numpy().astype(np.int64).tobytes())
+                num_texts += len(chunk)
+                num_tokens += len(ids)
+
+        _raw_to_npy(ids_raw, os.path.join(tmp_dir, IDS_FILE), np.int32, num_tokens)
+        _lengths_to_offsets(lengths_raw, os.path.join(tmp_dir, OFFSETS_FILE), num_texts)
+
+        tokenizer = model.tokenizer
+        meta = {
+            "num_texts": num_texts,
+            "num_tokens": num_tokens,
+            "corpus_digest": digest.hexdigest(),
+            "tokenizer_fingerprint": tokenizer_fingerprint(model),
+            "model_input_names": list(tokenizer.model_input_names),
+            "pad_token_id": tokenizer.pad_token_id or 0,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        with open(os.path.join(tmp_dir, META_FILE), "w") as fp:
+            json.dump(meta, fp, indent=2)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    try:
+        os.replace(tmp_dir, path)
+    except OSError:
+        # Another job finished the same entry first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+    return TokenizedCorpus(path)
+
+
+def _raw_to_npy(raw_path: str, npy_path: str, dtype, count: int) -> None:
+    """
+    Copies an array of raw values into a `.npy` file block by block, then
+    removes the raw file.
+    """
+    out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=dtype, shape=(count,))
+    if count > 0:
+        raw = np.memmap(raw_path, dtype=dtype, mode="r", shape=(count,))
+        for start in range(0, count, COPY_BLOCK_SIZE):
+            out[start : start + COPY_BLOCK_SIZE] = raw[start : start + COPY_BLOCK_SIZE]
+        del raw
+    out.flush()
+    del out
+    os.remove(raw_path)
+
+
+def _lengths_to_offsets(raw_path: str, npy_path: str, count: int) -> None:
+    """
+    Writes the running total of raw string lengths as a `.npy` file of
+    offsets, one longer than the lengths, then removes the raw file.
+    """
+    out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=np.int64, shape=(count + 1,))
+    out[0] = 0
+    if count > 0:
+        raw = np.memmap(raw_path, dtype=np.int64, mode="r", shape=(count,))
+        total = 0
+        for start in range(0, count, COPY_BLOCK_SIZE):
+            block = np.cumsum(raw[start : start + COPY_BLOCK_SIZE]) + total
+            out[start + 1 : start + 1 + len(block)] = block
+            total = int(block[-1])
+        del raw
+    out.flush()
+    del out
+    os.remove(raw_path)
+
+
+def load_or_build(
+    model,
+    texts: typing.Iterable[str],
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> TokenizedCorpus:
+    """
+    Returns the cached tokenization of a corpus, tokenizing and caching it
+    first if this model and corpus haven't been seen before. The strings
+    are streamed, once to compute the cache key and again if they need
+    tokenizing, so `texts` must be iterable more than once, e.g. a list or
+    a re-readable file of sentences, rather than a generator.
+
+    :param model: The SentenceTransformers model whose tokenizer to use.
+    :param texts: The strings to tokenize.
+    :param cache_dir: The directory holding cache entries.
+    :param chunk_size: The number of strings tokenized at once.
+    :returns: The cached corpus.
+    """
+    if iter(texts) is texts:
+        raise TypeError("texts must be iterable more than once, not an iterator")
+    key = f"{tokenizer_fingerprint(model)[:16]}-{corpus_digest(texts)[:16]}"
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path):
+        return TokenizedCorpus(path)
+    return build_token_cache(model, texts, path, chunk_size)
+
+
+def encode_cached(
+    model,
+    corpus: TokenizedCorpus,
+    positions: typing.Optional[typing.Sequence[int]] = None,
+    batch_size: int = 32,
+    max_tokens: typing.Optional[int] = None,
+    convert_to_tensor: bool = False,
+    show_progress_bar: bool = False,
+):
+    """
+    Encodes strings from their cached token ids, in batches of similar
+    length, giving the same embeddings as `model.encode` without running
+    the tokenizer.
+
+    :param model: The SentenceTransformers model the cache was built with.
+    :param corpus: The cached corpus.
+    :param positions: Optionally, the positions in the corpus to encode;
+      defaults to all of them.
+    :param batch_size: The most strings per model forward pass.
+    :param max_tokens: Optionally, the most padded tokens per forward pass.
+    :param convert_to_tensor: Whether to return a tensor instead of a numpy
+      array.
+    :param show_progress_bar: Whether to show progress over the batches.
+    :returns: The embeddings, in the same order as `positions`.
+    """
+    positions = np.arange(len(corpus)) if positions is None else np.asarray(positions)
+    batches = length_batches(corpus.lengths[positions].tolist(), batch_size, max_tokens)
+    dim = model.get_sentence_embedding_dimension()
+    embeddings = torch.empty((len(positions), dim), dtype=torch.float32)
+
+    progress: typing.Iterable[list[int]] = batches
+    if show_progress_bar:
+        progress = tqdm(batches, desc="Batches")
+
+    model.eval()
+    with torch.inference_mode():
+        for batch in progress:
+            features = corpus.features(positions[batch].tolist())
+            features = {k: v.to(model.device) for k, v in features.items()}
+            embeddings[batch] = model(features)["sentence_embedding"].float().cpu()
+    return embeddings if convert_to_tensor else embeddings.numpy()
@@ -0,0 +1,411 @@
+"""
+Domain-adapt a SentenceTransformers model with TSDAE on the part description
+sentences written by `tsdae.py`.
+
+The sentence file is streamed rather than loaded: it is cut into fixed-size
+batches in file order, and DataLoader worker processes take turns applying
+deletion noise to and tokenizing those batches while the main process
+trains. Each batch is padded only to its own longest sentence, and with a
+token cache directory the original sentences are read from cached token ids
+instead of being tokenized again every epoch. Gradients can
+be accumulated over several batches to reach a large effective batch size on
+CPU, and a checkpoint holding the model, decoder and optimizer state is
+written periodically. A run pointed at an existing checkpoint directory
+resumes from the batch after the last checkpoint. The trained encoder is
+saved in SentenceTransformers format, so it can be loaded by name like any
+other model (e.g. through TTC_MODEL_NAME).
+
+Usage:
+    python -m model_tuning.train_tsdae <output_dir>
+    python -m model_tuning.train_tsdae tsdae-model/ --workers 4 --accumulation-steps 4
+    python -m model_tuning.train_tsdae tsdae-model/ --token-cache tokens/
+
+To view all options and usage details:
+    python -m model_tuning.train_tsdae --help
+"""
+
+import argparse
+import os
+import random
+import time
+import typing
+
+import torch
+from sentence_transformers import losses
+from sentence_transformers import SentenceTransformer
+from torch.utils.data import DataLoader
+from torch.utils.data import get_worker_info
+from torch.utils.data import IterableDataset
+
+from model_tuning.performance import MODEL_NAME
+from model_tuning.token_cache import load_or_build
+from model_tuning.token_cache import TokenizedCorpus
+from model_tuning.tsdae import OUTPUT_SENTENCES_FILE
+
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_LEARNING_RATE = 3e-5
+# The deletion ratio the TSDAE paper found to work best
+DEFAULT_DELETION_RATIO = 0.6
+CHECKPOINT_FILE = "checkpoint.pt"
+
+
+def delete_words(text: str, ratio: float, rng: random.Random) -> str:
+    """
+    Applies TSDAE's deletion noise, dropping each word with probability
+    `ratio`. At least one word is always kept.
+    """
+    words = text.split()
+    if not words:
+        return text
+    kept = [w for w in words if rng.random() >= ratio]
+    if not kept:
+        kept = [rng.choice(words)]
+    return " ".join(kept)
+
+
+def iter_sentences(sentences_path: str) -> typing.Iterator[str]:
+    """
+    Reads the non-empty lines of a sentence file.
+    """
+    with open(sentences_path, "r", encoding="utf-8") as fp:
+        for line in fp:
+            sentence = line.strip()
+            if sentence != "":
+                yield sentence
+
+
+class SentenceFile:
+    """
+    The sentences of a file, read afresh each time they are iterated, so a
+    large file can be streamed more than once without being held in memory.
+    """
+
+    def __init__(self, sentences_path: str):
+        """
+        :param sentences_path: The file of sentences, one per line.
+        """
+        self.sentences_path = sentences_path
+
+    def __iter__(self) -> typing.Iterator[str]:
+        """
+        Reads the non-empty lines of the file.
+        """
+        return iter_sentences(self.sentences_path)
+
+
+class DenoisingBatches(IterableDataset):
+    """
+    Streams a sentence file as ready-to-train batches of (noisy, original)
+    token tensors. Batches are numbered in file order and handed to the
+    DataLoader workers in turn, which the DataLoader reads back in the same
+    order, so training sees the same batches however many workers are used.
+    The noise for each batch is seeded by its number, so a resumed run
+    reproduces the batches an uninterrupted run would have seen.
+    """
+
+    def __init__(
+        self,
+        sentences_path: str,
+        tokenizer: typing.Any,
+        max_length: int,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        deletion_ratio: float = DEFAULT_DELETION_RATIO,
+        seed: int = 42,
+        epoch: int = 0,
+        skip_batches: int = 0,
+        token_cache: typing.Optional[TokenizedCorpus] = None,
+    ):
+        """
+        :param sentences_path: The file of sentences, one per line.
+        :param tokenizer: The model's Hugging Face tokenizer.
+        :param max_length: The longest sequence to tokenize to.
+        :param batch_size: The number of sentences per batch.
+        :param deletion_ratio: The fraction of words deleted as noise.
+        :param seed: The base random seed.
+        :param epoch: The epoch the batches are for.
+        :param skip_batches: The number of leading batches to skip, which
+          were already trained on before a resume.
+        :param token_cache: Optionally, the cached tokenization of the
+          sentence file, used for the original sentences. The noisy ones
+          differ every epoch, so are always tokenized.
+        """
+        self.sentences_path = sentences_path
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.deletion_ratio = deletion_ratio
+        self.seed = seed
+        self.epoch = epoch
+        self.skip_batches = skip_batches
+        self.token_cache = token_cache
+
+    def __iter__(self) -> typing.Iterator[tuple[dict, dict, int]]:
+        """
+        Yields (noisy features, original features, batch size) tuples.
+        """
+        worker = get_worker_info()
+        num_workers = worker.num_workers if worker is not None else 1
+        worker_id = worker.id if worker is not None else 0
+
+        for batch_num, sentences in enumerate(self._iter_sentence_batches()):
+            if batch_num < self.skip_batches:
+                continue
+            if (batch_num - self.skip_batches) % num_workers != worker_id:
+                continue
+            rng = random.Random(f"{self.seed}-{self.epoch}-{batch_num}")
+            noisy = [delete_words(s, self.deletion_ratio, rng) for s in sentences]
+            if self.token_cache is not None:
+                start = batch_num * self.batch_size
+                original = self.token_cache.features(range(start, start + len(sentences)))
+            else:
+                original = self._tokenize(sentences)
+            yield self._tokenize(noisy), original, len(sentences)
+
+    def _iter_sentence_batches(self) -> typing.Iterator[list[str]]:
+        """
+        Reads the non-empty lines of the sentence file in batches.
+        """
+        batch = []
+        for sentence in iter_sentences(self.sentences_path):
+            batch.append(sentence)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _tokenize(self, texts: list[str]) -> dict:
+        """
+        Tokenizes a batch, padding only to its longest sequence.
+        """
+        features = self.tokenizer(
+            texts,
+            padding=True,
+            truncation="longest_first",
+            max_length=self.max_length,
+            return_tensors="pt",
+        )
+        return dict(features)
+
+
+def save_checkpoint(checkpoint_dir: str, loss_model: torch.nn.Module, optimizer, state: dict):
+    """
+    Writes the model, decoder and optimizer state under a temporary name and
+    renames it into place, so a crash mid-write never corrupts the last good
+    checkpoint.
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    tmp_path = path + ".tmp"
+    torch.save(
+        {"model": loss_model.state_dict(), "optimizer": optimizer.state_dict(), "state": state},
+        tmp_path,
+    )
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(
+    checkpoint_dir: str, loss_model: torch.nn.Module, optimizer
+) -> typing.Optional[dict]:
+    """
+    Restores the model and optimizer from a checkpoint, if there is one.
+
+    :returns: The saved training progress, or None without a checkpoint.
+    """
+    path = os.path.join(checkpoint_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    checkpoint = torch.load(path, map_location="cpu")
+    loss_model.load_state_dict(checkpoint["model"])
+    optimizer.load_state_dict(checkpoint["optimizer"])
+    return checkpoint["state"]
+
+
+def train_tsdae(
+    model: SentenceTransformer,
+    sentences_path: str,
+    output_dir: str,
+    checkpoint_dir: typing.Optional[str] = None,
+    epochs: int = 1,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    accumulation_steps: int = 1,
+    learning_rate: float = DEFAULT_LEARNING_RATE,
+    workers: int = 2,
+    prefetch_factor: int = 4,
+    checkpoint_every: int = 500,
+    log_every: int = 50,
+    seed: int = 42,
+    max_steps: typing.Optional[int] = None,
+    token_cache_dir: typing.Optional[str] = None,
+) -> dict:
+    """
+    Trains a model with the TSDAE objective and saves it.
+
+    :param model: The SentenceTransformers model to adapt.
+    :param sentences_path: The file of training sentences, one per line.
+    :param output_dir: The directory to save the trained model to.
+    :param checkpoint_dir: The directory for checkpoints; defaults to a
+      "checkpoints" directory inside `output_dir`.
+    :param epochs: The number of passes over the sentence file.
+    :param batch_size: The number of sentences per forward pass.
+    :param accumulation_steps: The number of batches whose gradients are
+      summed before each optimizer step.
+    :param learning_rate: The optimizer's learning rate.
+    :param workers: The number of DataLoader processes preparing batches.
+      With 0, batches are prepared in the training process.
+    :param prefetch_factor: The number of batches each worker keeps ready.
+    :param checkpoint_every: The number of optimizer steps between checkpoints.
+    :param log_every: The number of optimizer steps between progress reports.
+    :param seed: The random seed for noise and model initialization.
+    :param max_steps: Optionally, stop after this many optimizer steps; the
+      model is then checkpointed but not saved to `output_dir`.
+    :param token_cache_dir: Optionally, a token cache directory for the
+      sentence file's tokenization.
+    :returns: The training progress: epoch, batches done within it, optimizer
+      steps and samples seen.
+    """
+    checkpoint_dir = checkpoint_dir or os.path.join(output_dir, "checkpoints")
+    torch.manual_seed(seed)
+    loss_model = losses.DenoisingAutoEncoderLoss(model, tie_encoder_decoder=True)
+    optimizer = torch.optim.AdamW(loss_model.parameters(), lr=learning_rate)
+    device = model.device
+    loss_model.to(device)
+
+    state = load_checkpoint(checkpoint_dir, loss_model, optimizer) or {
+        "epoch": 0,
+        "batches_done": 0,
+        "steps": 0,
+        "samples": 0,
+    }
+    if state["steps"] > 0:
+        print(f"Resuming at epoch {state['epoch'] + 1}, step {state['steps']}")
+    if workers > 0:
+        # The Rust tokenizers warn, and can deadlock, if used after a fork
+        # with their own thread pool enabled
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    token_cache = None
+    if token_cache_dir is not None:
+        token_cache = load_or_build(model, SentenceFile(sentences_path), token_cache_dir)
+
+    loss_model.train()
+    while state["epoch"] < epochs:
+        dataset = DenoisingBatches(
+            sentences_path,
+            model.tokenizer,
+            model.max_seq_length,
+            batch_size=batch_size,
+            seed=seed,
+            epoch=state["epoch"],
+            skip_batches=state["batches_done"],
+            token_cache=token_cache,
+        )
+        loader = DataLoader(
+            dataset,
+            batch_size=None,
+            num_workers=workers,
+            prefetch_factor=prefetch_factor if workers > 0 else None,
+            persistent_workers=False,
+        )
+
+        pending = 0
+        window_start, window_samples = time.perf_counter(), 0
+        for noisy, original, num_samples in loader:
+            noisy = {k: v.to(device) for k, v in noisy.items()}
+            original = {k: v.to(device) for k, v in original.items()}
+            loss = loss_model([noisy, original], None) / accumulation_steps
+            loss.backward()
+            pending += 1
+            state["batches_done"] += 1
+            state["samples"] += num_samples
+            window_samples += num_samples
+            if pending < accumulation_steps:
+                continue
+
+            _optimizer_step(loss_model, optimizer)
+            pending = 0
+            state["steps"] += 1
+            if state["steps"] % log_every == 0:
+                elapsed = time.perf_counter() - window_start
+                print(
+                    f"  Step {state['steps']}: loss {loss.item() * accumulation_steps:.4f}, "
+                    f"{window_samples / elapsed:.1f} samples/sec"
+                )
+                window_start, window_samples = time.perf_counter(), 0
+            if state["steps"] % checkpoint_every == 0:
+                save_checkpoint(checkpoint_dir, loss_model, optimizer, state)
+            if max_steps is not None and state["steps"] >= max_steps:
+                save_checkpoint(checkpoint_dir, loss_model, optimizer, state)
+                return state
+
+        # Apply whatever gradient is left over from a short final group
+        if pending > 0:
+            _optimizer_step(loss_model, optimizer)
+            state["steps"] += 1
+        state["epoch"] += 1
+        state["batches_done"] = 0
+        save_checkpoint(checkpoint_dir, loss_model, optimizer, state)
+
+    model.save(output_dir)
+    return state
+
+
+def _optimizer_step(loss_model: torch.nn.Module, optimizer) -> None:
+    """
+    Clips the accumulated gradients and applies them.
+    """
+    torch.nn.utils.clip_grad_norm_(loss_model.parameters(), 1.0)
+    optimizer.step()
+    optimizer.zero_grad()
+
+
+def main():
+    """
+    Run TSDAE training from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Domain-adapt a model with TSDAE.")
+    parser.add_argument("output_dir", help="Directory to save the trained model to")
+    parser.add_argument("--sentences", default=OUTPUT_SENTENCES_FILE, help="Sentence file")
+    parser.add_argument("--model", default=MODEL_NAME, help="SentenceTransformers model name")
+    parser.add_argument("--checkpoint-dir", default=None)
+    parser.add_argument("--epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--accumulation-steps", type=int, default=1)
+    parser.add_argument("--learning-rate", type=float, default=DEFAULT_LEARNING_RATE)
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader worker processes")
+    parser.add_argument("--prefetch-factor", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=None, help="Torch intra-op threads")
+    parser.add_argument("--checkpoint-every", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--token-cache", default=None, help="Token cache directory")
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    print("Instantiating language model...")
+    model = SentenceTransformer(args.model)
+    start = time.perf_counter()
+    state = train_tsdae(
+        model,
+        args.sentences,
+        args.output_dir,
+        checkpoint_dir=args.checkpoint_dir,
+        epochs=args.epochs,
+        batch_size=args.batch_size,
+        accumulation_steps=args.accumulation_steps,
+        learning_rate=args.learning_rate,
+        workers=args.workers,
+        prefetch_factor=args.prefetch_factor,
+        checkpoint_every=args.checkpoint_every,
+        seed=args.seed,
+        token_cache_dir=args.token_cache,
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"Trained {state['steps']} steps on {state['samples']} samples in {elapsed:.1f}s; "
+        f"model saved to {args.output_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
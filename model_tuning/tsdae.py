@@ -1,4 +1,6 @@
+import hashlib
 from re import Match
+from typing import Iterator
 from typing import Union
 
 import spacy
@@ -9,7 +11,9 @@ PART_DESCRIPTION_EXTRACTS_FILE = "../data/snoinc_extracts/loinc_codes_with_part_
 OUTPUT_SENTENCES_FILE = "../data/training_files/part_description_sentences.txt"
 
 
-def create_tsdae_data(nlp: spacy.Language, parts_fp: str, out_fp: str) -> None:
+def create_tsdae_data(
+    nlp: spacy.Language, parts_fp: str, out_fp: str, batch_size: int = 256
+) -> None:
     """
     Constructs a collection of domain-adapted sentences fit for use with
     unsupervised TSDAE (Transformer-based Sentence-Denoising Auto-Encoder)
@@ -18,18 +22,36 @@ def create_tsdae_data(nlp: spacy.Language, parts_fp: str, out_fp: str) -> None:
     quality and free of artifacts (e.g. URLs, bracketed referential text,
     extraneous characters and spacing, etc.).
 
+    Descriptions are streamed from the parts file straight into Spacy, so
+    only one batch of descriptions is held in memory at a time, and the
+    output sentences follow the order of the parts file.
+
     :param nlp: An instantiated Spacy model, preferably one of the English
       core web models (e.g. "en-core-web-sm")
     :param parts_fp: A string path to a file containing comma-separated
       LOINC codes and their corresponding part descriptions.
     :param out_fp: A string path at which to write the sentences file.
+    :param batch_size: The number of descriptions Spacy parses at a time.
     :returns: None
     """
-    # Many extracted parts contain duplicate passages (e.g. for
-    # organism tests in different modalities). Only store one copy
-    # of each to increase sentential diversity.
-    descriptions = set()
+    # Now apply sentential parsing from spacy to get the final sentences
+    processed_docs = nlp.pipe(_iter_unique_part_descriptions(parts_fp), batch_size=batch_size)
 
+    # Write the output sentence by sentence from the spacy parser
+    with open(out_fp, "w") as fp:
+        for doc in processed_docs:
+            for sent in doc.sents:
+                st = sent.text.strip()
+                st = _post_process_sentence(st)
+                if st != "":
+                    fp.write(st + "\n")
+
+
+def _iter_part_descriptions(parts_fp: str) -> Iterator[str]:
+    """
+    Helper generator that streams the cleaned part descriptions from the
+    parts file in file order, skipping any that clean down to nothing.
+    """
     # Some descriptions are built up over multiple lines due to
     # carriage returns within descriptions. All new descriptions
     # start with a LOINC code line, which is a hyphenated number.
@@ -45,27 +67,39 @@ def create_tsdae_data(nlp: spacy.Language, parts_fp: str, out_fp: str) -> None:
                     if curr_description != "":
                         curr_description = _preprocess_part_description(curr_description)
                         if curr_description != "":
-                            descriptions.add(curr_description)
+                            yield curr_description
                         curr_description = ""
 
                 curr_description += stripped_loinc_line + " "
 
-        # Might have residual data in the current tracker, process it
+    # Might have residual data in the current tracker, process it
+    if curr_description != "":
+        curr_description = _preprocess_part_description(curr_description)
         if curr_description != "":
-            curr_description = _preprocess_part_description(curr_description)
-            descriptions.add(curr_description)
+            yield curr_description
 
-    # Now apply sentential parsing from spacy to get the final sentences
-    processed_docs = nlp.pipe(list(descriptions))
 
-    # Write the output sentence by sentence from the spacy parser
-    with open(out_fp, "w") as fp:
-        for doc in processed_docs:
-            for sent in doc.sents:
-                st = sent.text.strip()
-                st = _post_process_sentence(st)
-                if st != "":
-                    fp.write(st + "\n")
+def _iter_unique_part_descriptions(parts_fp: str) -> Iterator[str]:
+    """
+    Helper generator that drops repeated part descriptions, keeping the first
+    occurrence of each. Many extracted parts contain duplicate passages (e.g.
+    for organism tests in different modalities), and storing only one copy of
+    each increases sentential diversity. Descriptions are remembered by a
+    64-bit digest rather than their full text to keep memory bounded.
+    """
+    seen: set[int] = set()
+    for description in _iter_part_descriptions(parts_fp):
+        digest = _description_digest(description)
+        if digest not in seen:
+            seen.add(digest)
+            yield description
+
+
+def _description_digest(description: str) -> int:
+    """
+    Helper method that computes a stable 64-bit digest of a description.
+    """
+    return int.from_bytes(hashlib.blake2b(description.encode(), digest_size=8).digest(), "big")
 
 
 def _line_is_citation(line: str) -> bool:
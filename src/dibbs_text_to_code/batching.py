@@ -0,0 +1,295 @@
+import asyncio
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+import typing
+
+import numpy as np
+
+# The encoder is far more efficient when given many strings at once, so
+# individual queries are held briefly while a batch is assembled
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("ENCODER_MAX_BATCH_SIZE", "64"))
+DEFAULT_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "5"))
+# Optionally, batches larger than this are split into groups of similar token
+# length so short queries don't pay for padding to a long one. Off by default:
+# micro-batches are small enough that one model call beats tokenizing twice
+DEFAULT_BUCKET_SIZE = (
+    int(os.environ["ENCODER_BUCKET_SIZE"]) if os.getenv("ENCODER_BUCKET_SIZE") else None
+)
+
+EncodeFn = typing.Callable[[list[str]], typing.Sequence[typing.Any]]
+
+# Placed on the queue to tell the worker thread to stop
+_SHUTDOWN = object()
+
+
+class MicroBatcher:
+    """
+    Collects single-string encode requests from any number of callers and
+    dispatches them to the encoder as one batch. A batch is flushed once it
+    reaches `max_batch_size` queries or once the oldest query has waited
+    `max_wait_ms` milliseconds, whichever comes first. Each caller receives
+    only the result for the string it submitted.
+    """
+
+    def __init__(
+        self,
+        encode_fn: EncodeFn,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ):
+        """
+        :param encode_fn: A callable that takes a list of strings and returns
+          a sequence of results (e.g. rows of an embedding tensor) in the
+          same order.
+        :param max_batch_size: The largest number of strings to encode at once.
+        :param max_wait_ms: The longest time, in milliseconds, a query waits
+          for other queries to join its batch.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must not be negative")
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def __enter__(self) -> "MicroBatcher":
+        """
+        Returns the batcher for use as a context manager.
+        """
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """
+        Closes the batcher when leaving the context manager.
+        """
+        self.close()
+
+    def submit(self, text: str) -> concurrent.futures.Future:
+        """
+        Queues a string for encoding and returns a future that resolves to its
+        encoded result. Safe to call from any thread.
+        """
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str, timeout: typing.Optional[float] = None) -> typing.Any:
+        """
+        Encodes a single string, blocking until its batch has been processed.
+        """
+        return self.submit(text).result(timeout=timeout)
+
+    async def encode_async(self, text: str) -> typing.Any:
+        """
+        Encodes a single string without blocking the running event loop.
+        """
+        return await asyncio.wrap_future(self.submit(text))
+
+    def close(self) -> None:
+        """
+        Stops accepting new queries, finishes encoding any that are already
+        queued and then stops the worker thread.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_SHUTDOWN)
+        self._worker.join()
+
+    def _run(self) -> None:
+        """
+        Worker loop that assembles batches from the queue and encodes them.
+        """
+        shutting_down = False
+        while not shutting_down:
+            item = self._queue.get()
+            if item is _SHUTDOWN:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    break
+                if item is _SHUTDOWN:
+                    shutting_down = True
+                    break
+                batch.append(item)
+            self._dispatch(batch)
+
+        # Anything still queued needs an answer, and is encoded in full
+        # batches rather than one string at a time
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _SHUTDOWN:
+                leftovers.append(item)
+        for start in range(0, len(leftovers), self.max_batch_size):
+            self._dispatch(leftovers[start : start + self.max_batch_size])
+
+    def _dispatch(self, batch: list[tuple[str, concurrent.futures.Future]]) -> None:
+        """
+        Encodes one batch and scatters the results back to their futures.
+        """
+        # Callers that cancelled while waiting don't need to be encoded
+        batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self.encode_fn([text for text, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Encoder returned {len(results)} results for {len(batch)} inputs")
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+def sentence_transformer_encode_fn(
+    model, bucket_size: typing.Optional[int] = DEFAULT_BUCKET_SIZE, **encode_kwargs
+) -> EncodeFn:
+    """
+    Wraps a SentenceTransformers model so it can be used as the `encode_fn`
+    of a `MicroBatcher`. By default each batch is handed to the model in a
+    single `encode` call and results are returned as tensors to match how
+    the semantic search utilities consume them.
+
+    :param model: The SentenceTransformer model to encode with.
+    :param bucket_size: Optionally, the most strings per model forward pass.
+      Batches larger than this are split into buckets of similar token
+      length with `encode_bucketed`; smaller ones are encoded in one call.
+    :param encode_kwargs: Additional keyword arguments passed to `model.encode`.
+    :returns: A callable mapping a list of strings to their embeddings.
+    """
+    encode_kwargs.setdefault("convert_to_tensor", True)
+
+    def encode_fn(texts: list[str]):
+        if bucket_size is None or len(texts) <= bucket_size:
+            return model.encode(texts, batch_size=max(len(texts), 1), **encode_kwargs)
+        return encode_bucketed(model, texts, batch_size=bucket_size, **encode_kwargs)
+
+    return encode_fn
+
+
+def token_lengths(model, texts: typing.Sequence[str]) -> list[int]:
+    """
+    Counts the tokens the model's tokenizer produces for each string,
+    including special tokens and capped at the model's maximum sequence
+    length. Models without a tokenizer fall back to character counts.
+    """
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None:
+        return [len(text) for text in texts]
+    max_length = getattr(model, "max_seq_length", None)
+    input_ids = tokenizer(
+        list(texts),
+        add_special_tokens=True,
+        truncation=max_length is not None,
+        max_length=max_length,
+    )["input_ids"]
+    return [len(ids) for ids in input_ids]
+
+
+def length_batches(
+    lengths: typing.Sequence[int], batch_size: int, max_tokens: typing.Optional[int] = None
+) -> list[list[int]]:
+    """
+    Groups positions into batches of similar length. Positions are sorted
+    longest first, so a batch is padded only to the length of its first
+    member and any out-of-memory error surfaces on the first batch.
+
+    :param lengths: The token length of each string.
+    :param batch_size: The most strings per batch.
+    :param max_tokens: Optionally, the most padded tokens per batch, which
+      keeps batches of very long strings smaller.
+    :returns: Lists of positions into `lengths`, one per batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    for i in order:
+        if batch and (
+            len(batch) == batch_size
+            or (max_tokens is not None and (len(batch) + 1) * lengths[batch[0]] > max_tokens)
+        ):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def padded_token_count(lengths: typing.Sequence[int], batches: list[list[int]]) -> int:
+    """
+    Counts the tokens the model processes for the given batches once every
+    string is padded to the longest in its batch.
+    """
+    return sum(len(batch) * max(lengths[i] for i in batch) for batch in batches)
+
+
+def encode_bucketed(
+    model,
+    texts: list[str],
+    batch_size: int = 32,
+    max_tokens: typing.Optional[int] = None,
+    **encode_kwargs,
+):
+    """
+    Encodes strings with a SentenceTransformers model one length bucket at a
+    time, then restores the input order. The model only sorts each `encode`
+    call by character count, which for LOINC names (dense with abbreviations
+    that split into several tokens) is a poor guide to the padded length.
+
+    :param model: The SentenceTransformer model to encode with.
+    :param texts: The strings to encode.
+    :param batch_size: The most strings per model forward pass.
+    :param max_tokens: Optionally, the most padded tokens per forward pass.
+    :param encode_kwargs: Additional keyword arguments passed to
+      `model.encode`, which must return a tensor or numpy array. A
+      `show_progress_bar` argument shows progress over the buckets.
+    :returns: The embeddings, in the same order as `texts`.
+    """
+    show_progress_bar = encode_kwargs.pop("show_progress_bar", False)
+    if not texts:
+        return model.encode(texts, **encode_kwargs)
+
+    batches = length_batches(token_lengths(model, texts), batch_size, max_tokens)
+    progress: typing.Iterable[list[int]] = batches
+    if show_progress_bar:
+        from tqdm.auto import tqdm
+
+        progress = tqdm(batches, desc="Batches")
+    results = [
+        model.encode([texts[i] for i in batch], batch_size=len(batch), **encode_kwargs)
+        for batch in progress
+    ]
+    order = np.fromiter((i for batch in batches for i in batch), dtype=np.int64, count=len(texts))
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+
+    if hasattr(results[0], "cpu"):
+        import torch
+
+        return torch.cat(list(results))[torch.from_numpy(inverse)]
+    return np.concatenate(results)[inverse]
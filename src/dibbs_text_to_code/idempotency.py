@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import threading
+import time
+import typing
+from dataclasses import dataclass
+
+import boto3
+from aws_lambda_typing import events as lambda_events
+from botocore.client import BaseClient
+
+# The store is off unless one of these is set; a DynamoDB table takes
+# precedence over a local SQLite database
+IDEMPOTENCY_TABLE = os.getenv("TTC_IDEMPOTENCY_TABLE")
+IDEMPOTENCY_DB = os.getenv("TTC_IDEMPOTENCY_DB")
+# How long a completed object is remembered; SQS retries stop well before this
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("TTC_IDEMPOTENCY_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+@dataclass(frozen=True)
+class ObjectIdentity:
+    """
+    Identifies one version of an S3 object named in an event. Two events for
+    the same key with different ETags are different versions of the object,
+    and both need processing.
+    """
+
+    bucket: str
+    key: str
+    etag: str = ""
+
+    @property
+    def store_key(self) -> str:
+        """
+        The key the object is recorded under in an idempotency store.
+        """
+        return f"{self.bucket}/{self.key}#{self.etag}"
+
+
+def object_identity(event: lambda_events.EventBridgeEvent) -> ObjectIdentity:
+    """
+    Reads the bucket, key and ETag of the object an S3 event refers to.
+    """
+    detail = event["detail"]
+    return ObjectIdentity(
+        detail["bucket"]["name"],
+        detail["object"]["key"],
+        (detail["object"].get("etag") or "").strip('"'),
+    )
+
+
+class IdempotencyStore(typing.Protocol):
+    """
+    Remembers which objects have been fully processed, so redelivered events
+    for them can be skipped.
+    """
+
+    def is_complete(self, identity: ObjectIdentity) -> bool:
+        """
+        Whether the object was processed within the store's TTL.
+        """
+        ...
+
+    def mark_complete(self, identity: ObjectIdentity) -> None:
+        """
+        Records that the object has been processed.
+        """
+        ...
+
+
+class SQLiteIdempotencyStore:
+    """
+    An idempotency store in a local SQLite database. Useful for the HTTP
+    server, local runs and tests; Lambda containers don't share a disk, so
+    deployed functions should use `DynamoDBIdempotencyStore`.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS):
+        """
+        :param path: The database file, or ":memory:".
+        :param ttl_seconds: How long a completed object is remembered.
+        """
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completed_objects "
+                "(store_key TEXT PRIMARY KEY, completed_at REAL NOT NULL)"
+            )
+
+    def is_complete(self, identity: ObjectIdentity) -> bool:
+        """
+        Whether the object was processed within the store's TTL.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT completed_at FROM completed_objects WHERE store_key = ?",
+                (identity.store_key,),
+            ).fetchone()
+        return row is not None and row[0] > time.time() - self.ttl_seconds
+
+    def mark_complete(self, identity: ObjectIdentity) -> None:
+        """
+        Records that the object has been processed.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completed_objects (store_key, completed_at) VALUES (?, ?)",
+                (identity.store_key, time.time()),
+            )
+
+
+class DynamoDBIdempotencyStore:
+    """
+    An idempotency store in a DynamoDB table, shared by every container. The
+    table needs a string partition key named `store_key`; enabling DynamoDB
+    TTL on its `expires_at` attribute lets old entries be deleted for free.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS,
+        client: typing.Optional[BaseClient] = None,
+    ):
+        """
+        :param table_name: The DynamoDB table.
+        :param ttl_seconds: How long a completed object is remembered.
+        :param client: Optionally, the DynamoDB client to use.
+        """
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.client = client or create_dynamodb_client()
+
+    def is_complete(self, identity: ObjectIdentity) -> bool:
+        """
+        Whether the object was processed within the store's TTL. DynamoDB
+        deletes expired items lazily, so the expiry is checked here too.
+        """
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={"store_key": {"S": identity.store_key}},
+            ConsistentRead=True,
+        )
+        item = response.get("Item")
+        return item is not None and float(item["expires_at"]["N"]) > time.time()
+
+    def mark_complete(self, identity: ObjectIdentity) -> None:
+        """
+        Records that the object has been processed.
+        """
+        now = time.time()
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "store_key": {"S": identity.store_key},
+                "completed_at": {"N": str(int(now))},
+                "expires_at": {"N": str(int(now + self.ttl_seconds))},
+            },
+        )
+
+
+def create_dynamodb_client() -> BaseClient:
+    """
+    Creates a DynamoDB client.
+    """
+    endpoint_url = os.getenv("DYNAMODB_ENDPOINT_URL")
+    region_name = os.getenv("AWS_REGION")
+
+    return boto3.client("dynamodb", endpoint_url=endpoint_url, region_name=region_name)
+
+
+_default_store: typing.Optional[IdempotencyStore] = None
+
+
+def get_idempotency_store() -> typing.Optional[IdempotencyStore]:
+    """
+    Returns the container's idempotency store, created on first use, or
+    None when neither TTC_IDEMPOTENCY_TABLE nor TTC_IDEMPOTENCY_DB is set.
+    """
+    global _default_store
+    if _default_store is None:
+        if IDEMPOTENCY_TABLE:
+            _default_store = DynamoDBIdempotencyStore(IDEMPOTENCY_TABLE)
+        elif IDEMPOTENCY_DB:
+            _default_store = SQLiteIdempotencyStore(IDEMPOTENCY_DB)
+    return _default_store
@@ -0,0 +1,364 @@
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import typing
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+from . import s3_handler
+from .batching import EncodeFn
+from .valuesets import Concept
+from .valuesets import EmbeddingIndex
+from .valuesets import load_valueset_csv
+from .valuesets import normalize_rows
+
+# Where the versioned index manifest lives; hot-swapping is off without a bucket
+INDEX_BUCKET = os.getenv("TTC_INDEX_BUCKET")
+INDEX_MANIFEST_KEY = os.getenv("TTC_INDEX_MANIFEST_KEY", "indexes/manifest.json")
+# /tmp is the only writable path on Lambda
+INDEX_DIR = os.getenv("TTC_INDEX_DIR", os.path.join(tempfile.gettempdir(), "ttc-indexes"))
+# How often a warm container looks for a new version, and how many to keep on disk
+INDEX_CHECK_SECONDS = float(os.getenv("TTC_INDEX_CHECK_SECONDS", "60"))
+INDEX_KEEP_VERSIONS = int(os.getenv("TTC_INDEX_KEEP_VERSIONS", "3"))
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CONCEPTS_FILE = "concepts.csv"
+
+logger = logging.getLogger(__name__)
+
+
+class IndexManager:
+    """
+    Keeps the embedding index of a warm container up to date with a
+    versioned manifest in S3. The manifest names the current version and
+    the objects holding each version's concepts and normalized embeddings:
+
+        {"current": "20250911",
+         "versions": {"20250911": {"concepts_key": "...", "embeddings_key": "..."}}}
+
+    When the manifest points at a new version, it is downloaded and loaded on
+    a background thread while requests keep using the current index, then
+    swapped in by replacing a single reference, so a request sees either the
+    old index or the new one and never a partial load. Embeddings are
+    memory-mapped rather than read into memory. The most recent versions
+    stay on disk so `rollback` can return to one without a download.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        manifest_key: str = INDEX_MANIFEST_KEY,
+        encode_fn: typing.Optional[EncodeFn] = None,
+        index_dir: str = INDEX_DIR,
+        check_seconds: float = INDEX_CHECK_SECONDS,
+        keep_versions: int = INDEX_KEEP_VERSIONS,
+    ):
+        """
+        :param bucket: The S3 bucket holding the manifest and index objects.
+        :param manifest_key: The key of the manifest.
+        :param encode_fn: The batch encoder for queries. It can also be set
+          later, e.g. once a server has loaded its model, through
+          `encode_fn` or `get_index_manager`; searching without one raises
+          a RuntimeError.
+        :param index_dir: The local directory versions are downloaded to.
+        :param check_seconds: The least time between manifest checks.
+        :param keep_versions: The number of versions to keep on disk.
+        """
+        if keep_versions < 1:
+            raise ValueError("keep_versions must be at least 1")
+        self.bucket = bucket
+        self.manifest_key = manifest_key
+        self.encode_fn = encode_fn
+        self.index_dir = index_dir
+        self.check_seconds = check_seconds
+        self.keep_versions = keep_versions
+
+        self._current: typing.Optional[tuple[str, EmbeddingIndex]] = None
+        # Versions on disk, oldest first
+        self._history: list[str] = []
+        self._lock = threading.Lock()
+        # Held for a whole refresh, so concurrent first requests don't both
+        # download the same version
+        self._refresh_lock = threading.Lock()
+        self._loader: typing.Optional[threading.Thread] = None
+        self._last_check = float("-inf")
+        self.last_error: typing.Optional[Exception] = None
+
+    @property
+    def index(self) -> typing.Optional[EmbeddingIndex]:
+        """
+        The index currently in use, or None before the first load.
+        """
+        current = self._current
+        return current[1] if current is not None else None
+
+    @property
+    def version(self) -> typing.Optional[str]:
+        """
+        The version of the index currently in use.
+        """
+        current = self._current
+        return current[0] if current is not None else None
+
+    def maybe_refresh(self) -> None:
+        """
+        Starts a background check for a new version if one is due and none
+        is already running. Without a loaded index the check runs in the
+        calling thread instead, since there is nothing to serve meanwhile;
+        it is throttled the same way, so a missing or broken manifest costs
+        one failed attempt per check interval rather than one per call.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_check < self.check_seconds:
+                return
+            if self._loader is not None and self._loader.is_alive():
+                return
+            if self._current is not None:
+                self._last_check = now
+                self._loader = threading.Thread(target=self._refresh_in_background, daemon=True)
+                self._loader.start()
+                return
+        self.refresh()
+
+    def wait(self, timeout: typing.Optional[float] = None) -> None:
+        """
+        Waits for a background refresh, if any, to finish.
+        """
+        loader = self._loader
+        if loader is not None:
+            loader.join(timeout)
+
+    def refresh(self) -> bool:
+        """
+        Reads the manifest and swaps in its current version if it differs
+        from the one in use.
+
+        :returns: Whether a new version was swapped in.
+        """
+        with self._refresh_lock:
+            self._last_check = time.monotonic()
+            manifest = json.loads(s3_handler.get_file(self.bucket, self.manifest_key))
+            version = manifest["current"]
+            if version == self.version:
+                return False
+            self._download(version, manifest["versions"][version])
+            self._activate(version)
+            return True
+
+    def rollback(self, version: typing.Optional[str] = None) -> str:
+        """
+        Swaps back to a version kept on disk, by default the one loaded
+        before the current version. The manifest is not changed, so a later
+        refresh moves forward again unless the manifest is rolled back too.
+
+        :returns: The version now in use.
+        :raises ValueError: If there is no such version on disk.
+        """
+        with self._lock:
+            history = list(self._history)
+        if version is None:
+            earlier = [v for v in history if v != self.version]
+            if not earlier:
+                raise ValueError("No earlier index version is available")
+            version = earlier[-1]
+        if version not in history:
+            raise ValueError(f"Index version '{version}' is not on disk")
+        with self._refresh_lock:
+            self._activate(version)
+        return version
+
+    def _encode_queries(self, texts: list[str]):
+        """
+        Encodes queries with the encoder the manager currently has, so one
+        set after an index was loaded is still used by that index.
+        """
+        if self.encode_fn is None:
+            raise RuntimeError("The index manager has no query encoder")
+        return self.encode_fn(texts)
+
+    def _refresh_in_background(self) -> None:
+        """
+        Refreshes on the loader thread, keeping the current index on failure.
+        """
+        try:
+            self.refresh()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = e
+            logger.exception("Could not refresh the index; keeping version %s", self.version)
+
+    def _download(self, version: str, entry: dict) -> None:
+        """
+        Downloads a version's objects into its own directory, unless it is
+        already on disk. Files land in a temporary directory that is renamed
+        into place, so a version directory only exists once complete.
+        """
+        version_dir = os.path.join(self.index_dir, version)
+        if os.path.isdir(version_dir):
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{version}-", dir=self.index_dir)
+        try:
+            s3_handler.download_file(
+                self.bucket, entry["concepts_key"], os.path.join(tmp_dir, CONCEPTS_FILE)
+            )
+            s3_handler.download_file(
+                self.bucket, entry["embeddings_key"], os.path.join(tmp_dir, EMBEDDINGS_FILE)
+            )
+            os.replace(tmp_dir, version_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            # Another process sharing the directory finished the same version
+            if os.path.isdir(version_dir):
+                return
+            raise
+
+    def _activate(self, version: str) -> None:
+        """
+        Loads a version from disk, swaps it in and prunes old versions.
+        """
+        version_dir = os.path.join(self.index_dir, version)
+        concepts = load_valueset_csv(os.path.join(version_dir, CONCEPTS_FILE))
+        embeddings = np.load(os.path.join(version_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        if embeddings.shape[0] != len(concepts):
+            raise ValueError(
+                f"Index version '{version}' has {embeddings.shape[0]} embeddings "
+                f"for {len(concepts)} concepts"
+            )
+        index = EmbeddingIndex(
+            concepts, self._encode_queries, embeddings=embeddings, normalized=True
+        )
+
+        with self._lock:
+            self._current = (version, index)
+            if version in self._history:
+                self._history.remove(version)
+            self._history.append(version)
+            stale = self._history[: -self.keep_versions]
+            self._history = self._history[-self.keep_versions :]
+        # Requests still holding an old index keep working, since a deleted
+        # file stays mapped until it is released
+        for old_version in stale:
+            shutil.rmtree(os.path.join(self.index_dir, old_version), ignore_errors=True)
+
+
+def publish_index(
+    bucket: str,
+    version: str,
+    concepts: list[Concept],
+    embeddings: np.ndarray,
+    manifest_key: str = INDEX_MANIFEST_KEY,
+    prefix: str = "indexes",
+) -> dict:
+    """
+    Uploads a new index version and makes it current in the manifest.
+    Earlier versions are left in place so the manifest can be rolled back.
+
+    :param bucket: The S3 bucket to publish to.
+    :param version: The version name, e.g. the snapshot date.
+    :param concepts: The concepts in the value set.
+    :param embeddings: One embedding per concept; normalized before upload.
+    :param manifest_key: The key of the manifest.
+    :param prefix: The key prefix for the version's objects.
+    :returns: The updated manifest.
+    """
+    if len(concepts) != len(embeddings):
+        raise ValueError(f"{len(embeddings)} embeddings for {len(concepts)} concepts")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        concepts_path = os.path.join(tmp_dir, CONCEPTS_FILE)
+        with open(concepts_path, "w", newline="", encoding="utf-8") as fp:
+            writer = csv.writer(fp, delimiter="|")
+            writer.writerow(["code", "text"])
+            writer.writerows([c.code, c.text] for c in concepts)
+        embeddings_path = os.path.join(tmp_dir, EMBEDDINGS_FILE)
+        np.save(embeddings_path, normalize_rows(np.asarray(embeddings, dtype=np.float32)))
+
+        entry = {
+            "concepts_key": f"{prefix}/{version}/{CONCEPTS_FILE}",
+            "embeddings_key": f"{prefix}/{version}/{EMBEDDINGS_FILE}",
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        with open(concepts_path, "rb") as fp:
+            s3_handler.put_file(fp, bucket, entry["concepts_key"])
+        with open(embeddings_path, "rb") as fp:
+            s3_handler.put_file(fp, bucket, entry["embeddings_key"])
+
+    manifest = _read_manifest(bucket, manifest_key)
+    manifest["versions"][version] = entry
+    manifest["current"] = version
+    _write_manifest(bucket, manifest_key, manifest)
+    return manifest
+
+
+def rollback_manifest(
+    bucket: str, manifest_key: str = INDEX_MANIFEST_KEY, version: typing.Optional[str] = None
+) -> str:
+    """
+    Points the manifest back at an earlier version, by default the one
+    published before the current version. Containers pick it up on their
+    next refresh.
+
+    :returns: The version now current.
+    :raises ValueError: If there is no such version in the manifest.
+    """
+    manifest = _read_manifest(bucket, manifest_key)
+    if version is None:
+        published = sorted(manifest["versions"], key=lambda v: manifest["versions"][v]["created"])
+        earlier = published[: published.index(manifest["current"])]
+        if not earlier:
+            raise ValueError("No earlier index version is available")
+        version = earlier[-1]
+    if version not in manifest["versions"]:
+        raise ValueError(f"Index version '{version}' is not in the manifest")
+    manifest["current"] = version
+    _write_manifest(bucket, manifest_key, manifest)
+    return version
+
+
+_default_manager: typing.Optional[IndexManager] = None
+
+
+def get_index_manager(
+    encode_fn: typing.Optional[EncodeFn] = None,
+) -> typing.Optional[IndexManager]:
+    """
+    Returns the container's index manager, created on first use, or None
+    when TTC_INDEX_BUCKET is not set.
+
+    :param encode_fn: Optionally, the query encoder for the manager to use
+      from now on.
+    """
+    global _default_manager
+    if _default_manager is None and INDEX_BUCKET:
+        _default_manager = IndexManager(INDEX_BUCKET)
+    if _default_manager is not None and encode_fn is not None:
+        _default_manager.encode_fn = encode_fn
+    return _default_manager
+
+
+def _read_manifest(bucket: str, manifest_key: str) -> dict:
+    """
+    Reads the manifest, or returns an empty one if none exists yet.
+    """
+    try:
+        return json.loads(s3_handler.get_file(bucket, manifest_key))
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "NoSuchKey":
+            raise
+        return {"current": None, "versions": {}}
+
+
+def _write_manifest(bucket: str, manifest_key: str, manifest: dict) -> None:
+    """
+    Writes the manifest back to S3.
+    """
+    s3_handler.put_file(io.BytesIO(json.dumps(manifest, indent=2).encode()), bucket, manifest_key)
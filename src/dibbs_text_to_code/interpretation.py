@@ -0,0 +1,181 @@
+import csv
+import typing
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+
+# Labels used by `data_curation/synthetic_lab_results.py`
+LABEL_POSITIVE = 1
+LABEL_NEGATIVE = 2
+
+DEFAULT_N_FEATURES = 2**18
+DEFAULT_NGRAM_RANGE = (1, 4)
+# Result words repeat heavily, so predictions for recently seen strings are
+# kept rather than recomputed
+DEFAULT_CACHE_SIZE = 100000
+
+
+def read_training_csv(path: str) -> tuple[list[str], list[int]]:
+    """
+    Reads a labeled CSV of result words as written by
+    `synthetic_lab_results.py`, with a header row of "word,label".
+
+    :param path: The path to the CSV file.
+    :returns: A tuple of the words and their integer labels.
+    """
+    words = []
+    labels = []
+    with open(path, "r", newline="") as fp:
+        for row in csv.DictReader(fp):
+            words.append(row["word"])
+            labels.append(int(row["label"]))
+    return words, labels
+
+
+def _make_vectorizer(n_features: int, ngram_range: tuple[int, int]) -> HashingVectorizer:
+    """
+    Builds the stateless character n-gram featurizer. Hashing avoids storing a
+    vocabulary, so only the linear model's weights need to be shipped. The
+    n-grams are allowed to span word boundaries so that negations such as
+    "not positive" produce different features than "positive".
+    """
+    return HashingVectorizer(
+        analyzer="char",
+        ngram_range=ngram_range,
+        n_features=n_features,
+        alternate_sign=False,
+        lowercase=True,
+        norm="l2",
+    )
+
+
+class InterpretationClassifier:
+    """
+    A linear classifier over hashed character n-grams for labeling short lab
+    result strings (e.g. "Not Detected", "POSITVE") as positive or negative.
+    Character n-grams make it tolerant of the case changes and typos found
+    in real result values.
+    """
+
+    def __init__(
+        self,
+        coef: np.ndarray,
+        intercept: float,
+        classes: typing.Sequence[int],
+        n_features: int = DEFAULT_N_FEATURES,
+        ngram_range: tuple[int, int] = DEFAULT_NGRAM_RANGE,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        """
+        :param coef: The weight of each hashed feature.
+        :param intercept: The bias term of the linear model.
+        :param classes: The two class labels; the weights score the second.
+        :param n_features: The number of hash buckets used by the featurizer.
+        :param ngram_range: The range of character n-gram lengths.
+        :param cache_size: The number of distinct strings to memoize.
+        """
+        self.coef = np.asarray(coef, dtype=np.float32).ravel()
+        self.intercept = float(intercept)
+        self.classes = np.asarray(classes)
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.cache_size = cache_size
+        self._vectorizer = _make_vectorizer(n_features, self.ngram_range)
+        self._cache: dict[str, float] = {}
+
+    @classmethod
+    def train(
+        cls,
+        words: list[str],
+        labels: list[int],
+        n_features: int = DEFAULT_N_FEATURES,
+        ngram_range: tuple[int, int] = DEFAULT_NGRAM_RANGE,
+        c: float = 10.0,
+    ) -> "InterpretationClassifier":
+        """
+        Fits a logistic regression model on hashed character n-grams.
+
+        :param words: The training strings.
+        :param labels: The label for each training string.
+        :param n_features: The number of hash buckets used by the featurizer.
+        :param ngram_range: The range of character n-gram lengths.
+        :param c: The inverse regularization strength.
+        :returns: The trained classifier.
+        """
+        features = _make_vectorizer(n_features, ngram_range).transform(words)
+        model = LogisticRegression(C=c, solver="liblinear")
+        model.fit(features, labels)
+        return cls(model.coef_, model.intercept_[0], model.classes_, n_features, ngram_range)
+
+    def decision_function(self, texts: list[str]) -> np.ndarray:
+        """
+        Returns the raw linear score for each string; positive scores favor
+        the second class.
+        """
+        scores = np.empty(len(texts), dtype=np.float32)
+        missing: dict[str, list[int]] = {}
+        for i, text in enumerate(texts):
+            cached = self._cache.get(text)
+            if cached is None:
+                missing.setdefault(text, []).append(i)
+            else:
+                scores[i] = cached
+
+        if missing:
+            unique = list(missing)
+            computed = self._vectorizer.transform(unique) @ self.coef + self.intercept
+            if len(self._cache) + len(unique) > self.cache_size:
+                self._cache.clear()
+            for text, score in zip(unique, computed):
+                scores[missing[text]] = score
+                if len(unique) <= self.cache_size:
+                    self._cache[text] = float(score)
+        return scores
+
+    def predict_proba(self, texts: list[str]) -> np.ndarray:
+        """
+        Returns an (n, 2) array of class probabilities, ordered as `classes`.
+        """
+        p = 1.0 / (1.0 + np.exp(-self.decision_function(texts)))
+        return np.column_stack([1.0 - p, p])
+
+    def predict(self, texts: list[str]) -> np.ndarray:
+        """
+        Returns the predicted label for each string.
+        """
+        return self.classes[(self.decision_function(texts) > 0).astype(int)]
+
+    def save(self, path: str) -> None:
+        """
+        Writes the model to a compressed .npz file. Only the non-zero weights
+        are stored, which keeps the file small enough for the Lambda image.
+        """
+        nonzero = np.flatnonzero(self.coef).astype(np.int32)
+        np.savez_compressed(
+            path,
+            indices=nonzero,
+            values=self.coef[nonzero],
+            intercept=np.float32(self.intercept),
+            classes=self.classes,
+            n_features=np.int64(self.n_features),
+            ngram_range=np.asarray(self.ngram_range),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "InterpretationClassifier":
+        """
+        Reads a model previously written by `save`.
+        """
+        with np.load(path) as data:
+            n_features = int(data["n_features"])
+            coef = np.zeros(n_features, dtype=np.float32)
+            coef[data["indices"]] = data["values"]
+            ngram_range = data["ngram_range"]
+            return cls(
+                coef,
+                float(data["intercept"]),
+                data["classes"].tolist(),
+                n_features,
+                (int(ngram_range[0]), int(ngram_range[1])),
+            )
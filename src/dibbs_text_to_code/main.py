@@ -1,22 +1,73 @@
 import json
+import logging
 
 from aws_lambda_typing import context as lambda_context
 from aws_lambda_typing import events as lambda_events
 
+from .idempotency import get_idempotency_store
+from .idempotency import object_identity
+from .idempotency import ObjectIdentity
+from .index_manager import get_index_manager
+from .metrics import StageMetrics
 from .s3_handler import get_file_content_from_s3_event
 
+logger = logging.getLogger(__name__)
+
 
 def handler(event: lambda_events.SQSEvent, context: lambda_context.Context):
     """
     Text to Code lambda entry point
     """
+    metrics = StageMetrics("handler")
+    # A new index version is loaded in the background; this invocation keeps
+    # using whichever version is current when it starts. A failed refresh
+    # leaves the current version (or none) in place rather than failing the
+    # batch
+    index_manager = get_index_manager()
+    if index_manager is not None:
+        try:
+            with metrics.stage("index_refresh"):
+                index_manager.maybe_refresh()
+        except Exception:
+            metrics.increment("index_refresh_errors")
+            logger.exception("Could not refresh the index")
+
+    # S3 notifications and SQS redelivery both produce duplicate events, so
+    # each object version is only fetched once per batch, and not at all if
+    # the idempotency store has it as already processed. Objects are only
+    # marked complete once the whole batch has succeeded, since a failure
+    # makes SQS redeliver every record in it
+    store = get_idempotency_store()
+    seen: set[ObjectIdentity] = set()
+    processed: list[ObjectIdentity] = []
     file_contents = []
     for record in event.get("Records", []):
         body = record.get("body")
         if not body:
             continue
-        s3_event = json.loads(body)
-        file_content = get_file_content_from_s3_event(s3_event)
+        with metrics.stage("parse"):
+            s3_event = json.loads(body)
+        identity = object_identity(s3_event)
+        if identity in seen:
+            metrics.increment("duplicates")
+            continue
+        seen.add(identity)
+        # Without an ETag a new upload can't be told apart from a retry
+        use_store = store is not None and identity.etag != ""
+        if use_store and store.is_complete(identity):
+            metrics.increment("already_processed")
+            continue
+
+        file_content = get_file_content_from_s3_event(s3_event, metrics=metrics)
         file_contents.append(file_content)
+        metrics.increment("records")
+        if use_store:
+            processed.append(identity)
+    for identity in processed:
+        store.mark_complete(identity)  # ty: ignore
+    metrics.emit()
 
-    return {"message": "DIBBS Text to Code!", "event": event, "file_contents": file_contents}
+    response = {"message": "DIBBS Text to Code!", "event": event, "file_contents": file_contents}
+    if index_manager is not None:
+        response["index_version"] = index_manager.version
+    return response
@@ -0,0 +1,183 @@
+import contextlib
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import typing
+
+# Supported values for the TTC_METRICS environment variable
+METRICS_FORMAT_LOG = "log"
+METRICS_FORMAT_EMF = "emf"
+METRICS_FORMATS = (METRICS_FORMAT_LOG, METRICS_FORMAT_EMF)
+# Passed as a metrics format to turn instrumentation off whatever TTC_METRICS says
+METRICS_OFF = "off"
+
+DEFAULT_NAMESPACE = "DIBBsTextToCode"
+
+logger = logging.getLogger(__name__)
+
+# Unrecognised TTC_METRICS values already warned about, so a misconfigured
+# container logs once rather than on every invocation
+_warned_formats: set[str] = set()
+
+
+def get_metrics_format() -> typing.Optional[str]:
+    """
+    Reads the metrics output format from the environment. Instrumentation is
+    off unless TTC_METRICS is set to "log" (structured JSON log lines) or
+    "emf" (CloudWatch Embedded Metric Format); any other value logs a
+    warning.
+    """
+    metrics_format = (os.getenv("TTC_METRICS") or "").strip().lower()
+    if metrics_format in METRICS_FORMATS:
+        return metrics_format
+    if metrics_format not in ("", METRICS_OFF) and metrics_format not in _warned_formats:
+        _warned_formats.add(metrics_format)
+        logger.warning(
+            "Ignoring unsupported TTC_METRICS value '%s'; expected one of %s",
+            metrics_format,
+            METRICS_FORMATS + (METRICS_OFF,),
+        )
+    return None
+
+
+def peak_rss_bytes() -> int:
+    """
+    Returns the peak resident set size of the current process in bytes.
+    """
+    # On Linux `ru_maxrss` carries over from the parent across fork and exec,
+    # so a fresh process would report its parent's peak; the high-water mark
+    # in /proc covers only this process's own memory
+    try:
+        with open("/proc/self/status", "r") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageMetrics:
+    """
+    Collects per-stage timings and byte counts for a single invocation and
+    emits them as one record. When instrumentation is disabled every method
+    is a no-op, so it is safe to leave the calls in place in production.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        metrics_format: typing.Optional[str] = None,
+        namespace: typing.Optional[str] = None,
+    ):
+        """
+        :param name: The name of the instrumented operation (e.g. "handler").
+        :param metrics_format: The output format, one of `METRICS_FORMATS`,
+          or `METRICS_OFF` to disable instrumentation. Defaults to the format
+          configured by the TTC_METRICS environment variable.
+        :param namespace: The CloudWatch namespace used for EMF output.
+        :raises ValueError: If `metrics_format` isn't a supported format.
+        """
+        if metrics_format is None:
+            metrics_format = get_metrics_format()
+        elif metrics_format == METRICS_OFF:
+            metrics_format = None
+        elif metrics_format not in METRICS_FORMATS:
+            raise ValueError(
+                f"Unsupported metrics format '{metrics_format}'; "
+                f"expected one of {METRICS_FORMATS + (METRICS_OFF,)}"
+            )
+        self.name = name
+        self.metrics_format = metrics_format
+        self.namespace = namespace or os.getenv("TTC_METRICS_NAMESPACE", DEFAULT_NAMESPACE)
+        self.timings_ms: dict[str, float] = {}
+        self.byte_counts: dict[str, int] = {}
+        self.counts: dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Whether instrumentation is turned on for this invocation.
+        """
+        return self.metrics_format is not None
+
+    @contextlib.contextmanager
+    def stage(self, stage_name: str) -> typing.Generator[None, None, None]:
+        """
+        Times the enclosed block and adds the elapsed milliseconds to the
+        named stage. Repeated stages (e.g. one S3 read per record) accumulate.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000.0
+            self.timings_ms[stage_name] = self.timings_ms.get(stage_name, 0.0) + elapsed
+
+    def add_bytes(self, stage_name: str, num_bytes: int) -> None:
+        """
+        Adds to the number of bytes processed by the named stage.
+        """
+        if self.enabled:
+            self.byte_counts[stage_name] = self.byte_counts.get(stage_name, 0) + num_bytes
+
+    def increment(self, counter_name: str, amount: int = 1) -> None:
+        """
+        Adds to a named counter, such as the number of records processed.
+        """
+        if self.enabled:
+            self.counts[counter_name] = self.counts.get(counter_name, 0) + amount
+
+    def to_record(self) -> dict[str, typing.Any]:
+        """
+        Builds the metrics record in the configured output format.
+        """
+        values: dict[str, typing.Any] = {}
+        units: dict[str, str] = {}
+        for stage_name, ms in self.timings_ms.items():
+            values[f"{stage_name}_ms"] = round(ms, 3)
+            units[f"{stage_name}_ms"] = "Milliseconds"
+        for stage_name, num_bytes in self.byte_counts.items():
+            values[f"{stage_name}_bytes"] = num_bytes
+            units[f"{stage_name}_bytes"] = "Bytes"
+        for counter_name, count in self.counts.items():
+            values[counter_name] = count
+            units[counter_name] = "Count"
+        values["peak_rss_bytes"] = peak_rss_bytes()
+        units["peak_rss_bytes"] = "Bytes"
+
+        if self.metrics_format == METRICS_FORMAT_EMF:
+            return {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Operation"]],
+                            "Metrics": [{"Name": k, "Unit": u} for k, u in units.items()],
+                        }
+                    ],
+                },
+                "Operation": self.name,
+                **values,
+            }
+        return {"metrics": self.name, **values}
+
+    def emit(self) -> typing.Optional[dict[str, typing.Any]]:
+        """
+        Writes the metrics record to stdout as a single JSON line, which is
+        where Lambda picks up both structured logs and EMF records.
+        """
+        if not self.enabled:
+            return None
+        record = self.to_record()
+        print(json.dumps(record), flush=True)
+        return record
@@ -0,0 +1,211 @@
+import datetime
+import io
+import json
+import os
+import threading
+import time
+import typing
+import uuid
+import zlib
+
+from . import s3_handler
+
+# An object is closed once it reaches this compressed size or age, whichever
+# comes first, so S3 requests scale with the volume of results rather than
+# the number of records
+DEFAULT_MAX_OBJECT_BYTES = int(os.getenv("TTC_RESULTS_MAX_OBJECT_BYTES", str(64 * 2**20)))
+DEFAULT_MAX_AGE_SECONDS = float(os.getenv("TTC_RESULTS_MAX_AGE_SECONDS", "60"))
+# Compressed output is uploaded in parts of this size once an object outgrows
+# one part; S3 requires every part but the last to be at least 5 MiB
+DEFAULT_PART_SIZE = 8 * 2**20
+MIN_PART_SIZE = 5 * 2**20
+
+
+class ResultWriter:
+    """
+    Buffers coded results and writes them to S3 as gzip-compressed,
+    newline-delimited JSON objects holding many records each. Records are
+    compressed as they are written, and an object that grows past one part
+    is streamed to S3 with a multipart upload, so memory stays bounded by
+    the part size however large an object gets.
+
+    Objects are keyed by date, then by a per-writer run id and sequence
+    number, e.g. `results/2025/09/11/3f2a9c1e04b7-000001.ndjson.gz`. Age is
+    checked whenever a record is written or `flush_if_due` is called; a
+    Lambda invocation should call `flush` (or `close`) before returning,
+    since a frozen container can't flush on a timer.
+
+    If an upload fails the error is raised, but nothing buffered is lost:
+    the records (including any being written) stay in the current object,
+    and the next write or flush retries the upload where it stopped.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str,
+        prefix: str = "results",
+        max_object_bytes: int = DEFAULT_MAX_OBJECT_BYTES,
+        max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+        part_size: int = DEFAULT_PART_SIZE,
+        compress_level: int = 6,
+    ):
+        """
+        :param bucket_name: The S3 bucket to write results to.
+        :param prefix: The key prefix for result objects.
+        :param max_object_bytes: The compressed size at which an object is
+          closed and a new one started.
+        :param max_age_seconds: The longest time a record may wait before
+          its object is written.
+        :param part_size: The size of each multipart upload part.
+        :param compress_level: The gzip compression level.
+        """
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        self.bucket_name = bucket_name
+        self.prefix = prefix.rstrip("/")
+        self.max_object_bytes = max_object_bytes
+        self.max_age_seconds = max_age_seconds
+        self.part_size = part_size
+        self.compress_level = compress_level
+        self.run_id = uuid.uuid4().hex[:12]
+        self.written_keys: list[str] = []
+
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._reset()
+
+    def __enter__(self) -> "ResultWriter":
+        """
+        Returns the writer for use in a `with` block.
+        """
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """
+        Writes any buffered records when the `with` block exits.
+        """
+        self.close()
+
+    def write(self, record: dict) -> None:
+        """
+        Adds a result to the current object, writing the object out if it
+        has reached its size or age limit.
+        """
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        with self._lock:
+            if self._closing:
+                # A previous attempt to write the object out failed
+                self._finish_object()
+            if self._num_records == 0:
+                self._started = time.monotonic()
+            self._buffer += self._compressor.compress(line)
+            self._num_records += 1
+            while len(self._buffer) >= self.part_size:
+                self._upload_part()
+            if self._compressed_bytes() >= self.max_object_bytes or self._is_due():
+                self._finish_object()
+
+    def write_many(self, records: typing.Iterable[dict]) -> None:
+        """
+        Adds several results to the current object.
+        """
+        for record in records:
+            self.write(record)
+
+    def flush_if_due(self) -> typing.Optional[str]:
+        """
+        Writes the current object if its oldest record has waited too long.
+
+        :returns: The key written, if any.
+        """
+        with self._lock:
+            if self._num_records > 0 and self._is_due():
+                return self._finish_object()
+        return None
+
+    def flush(self) -> typing.Optional[str]:
+        """
+        Writes the current object, if it holds any records.
+
+        :returns: The key written, if any.
+        """
+        with self._lock:
+            if self._num_records > 0:
+                return self._finish_object()
+        return None
+
+    def close(self) -> None:
+        """
+        Writes any buffered records.
+        """
+        self.flush()
+
+    def _reset(self) -> None:
+        """
+        Starts a new, empty object.
+        """
+        self._compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, 31)
+        self._buffer = bytearray()
+        self._closing = False
+        self._num_records = 0
+        self._started = time.monotonic()
+        self._upload: typing.Optional[s3_handler.MultipartUpload] = None
+        self._uploaded_bytes = 0
+        self._key: typing.Optional[str] = None
+
+    def _compressed_bytes(self) -> int:
+        """
+        The compressed size of the current object so far.
+        """
+        return self._uploaded_bytes + len(self._buffer)
+
+    def _is_due(self) -> bool:
+        """
+        Whether the current object has been open for its maximum age.
+        """
+        return time.monotonic() - self._started >= self.max_age_seconds
+
+    def _object_key(self) -> str:
+        """
+        The key of the current object, assigned when it is first needed.
+        """
+        if self._key is None:
+            self._sequence += 1
+            date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y/%m/%d")
+            self._key = f"{self.prefix}/{date}/{self.run_id}-{self._sequence:06d}.ndjson.gz"
+        return self._key
+
+    def _upload_part(self) -> None:
+        """
+        Sends one full part of the buffer to the object's multipart upload,
+        starting the upload if needed.
+        """
+        if self._upload is None:
+            self._upload = s3_handler.MultipartUpload(self.bucket_name, self._object_key())
+        part = bytes(self._buffer[: self.part_size])
+        self._upload.upload_part(part)
+        # Only dropped once stored, so a failed part is sent again on retry
+        del self._buffer[: self.part_size]
+        self._uploaded_bytes += len(part)
+
+    def _finish_object(self) -> str:
+        """
+        Writes out the rest of the current object and starts a new one.
+        Small objects are written with a single PUT. Safe to call again after
+        a failure, which picks up from the step that failed.
+        """
+        if not self._closing:
+            self._buffer += self._compressor.flush()
+            self._closing = True
+        key = self._object_key()
+        if self._upload is None:
+            s3_handler.put_file(io.BytesIO(self._buffer), self.bucket_name, key)
+        else:
+            if self._buffer:
+                self._upload.upload_part(bytes(self._buffer))
+                self._uploaded_bytes += len(self._buffer)
+                self._buffer = bytearray()
+            self._upload.complete()
+        self.written_keys.append(key)
+        self._reset()
+        return key
@@ -0,0 +1,129 @@
+import typing
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .batching import EncodeFn
+from .valuesets import Concept
+from .valuesets import encode_matrix
+from .valuesets import load_related_names
+from .valuesets import load_valueset_csv
+from .valuesets import Match
+from .valuesets import normalize_rows
+
+# How many sparse candidates are passed on to the dense stage
+DEFAULT_POOL_SIZE = 100
+# Weight of the dense score in the fused score; the rest goes to the sparse score
+DEFAULT_DENSE_WEIGHT = 0.5
+# Queries are scored this many at a time, since each query's sparse scores
+# over every concept are densified to pick its candidate pool
+SEARCH_CHUNK_SIZE = 256
+
+
+class HybridRetriever:
+    """
+    A two-stage retriever that combines lexical and semantic similarity. A
+    TF-IDF index over character n-grams of each concept's name and its
+    related names shortlists `pool_size` candidates cheaply; only those are
+    then scored against the query embedding, and the final ranking uses a
+    weighted sum of the two cosine similarities.
+
+    Character n-grams give credit to abbreviations and fragments such as
+    "Vit." or "D2" that dense models often miss, while the dense stage
+    handles paraphrases with little lexical overlap.
+    """
+
+    def __init__(
+        self,
+        concepts: list[Concept],
+        encode_fn: EncodeFn,
+        related_names: typing.Optional[dict[str, list[str]]] = None,
+        embeddings: typing.Optional[np.ndarray] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        dense_weight: float = DEFAULT_DENSE_WEIGHT,
+        ngram_range: tuple[int, int] = (2, 4),
+    ):
+        """
+        :param concepts: The concepts to retrieve from.
+        :param encode_fn: The batch encoder used for queries and, when
+          `embeddings` is not supplied, for the concept names.
+        :param related_names: Optionally, a mapping of code to related names,
+          such as the output of `valuesets.load_related_names`. These are added
+          to the sparse index only.
+        :param embeddings: Optionally, precomputed embeddings for the concepts.
+        :param pool_size: The number of sparse candidates scored by the
+          dense stage.
+        :param dense_weight: The weight in [0, 1] of the dense score.
+        :param ngram_range: The range of character n-gram lengths.
+        """
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        if not 0.0 <= dense_weight <= 1.0:
+            raise ValueError("dense_weight must be between 0 and 1")
+        self.concepts = concepts
+        self.encode_fn = encode_fn
+        self.pool_size = pool_size
+        self.dense_weight = dense_weight
+
+        related_names = related_names or {}
+        documents = [" ; ".join([c.text] + related_names.get(c.code, [])) for c in concepts]
+        self._vectorizer = TfidfVectorizer(
+            analyzer="char_wb", ngram_range=ngram_range, lowercase=True, sublinear_tf=True
+        )
+        self._sparse = self._vectorizer.fit_transform(documents).T.tocsr()
+
+        if embeddings is None:
+            embeddings = encode_matrix(encode_fn, [c.text for c in concepts])
+        self.embeddings = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+    def search(self, texts: list[str], top_k: int = 5) -> list[list[Match]]:
+        """
+        Returns the best `top_k` matches for each input string.
+        """
+        if not texts or not self.concepts:
+            return [[] for _ in texts]
+
+        results = []
+        for start in range(0, len(texts), SEARCH_CHUNK_SIZE):
+            results.extend(self._search_chunk(texts[start : start + SEARCH_CHUNK_SIZE], top_k))
+        return results
+
+    def _search_chunk(self, texts: list[str], top_k: int) -> list[list[Match]]:
+        """
+        Searches for one chunk of input strings.
+        """
+        sparse_scores = (self._vectorizer.transform(texts) @ self._sparse).toarray()
+        queries = normalize_rows(encode_matrix(self.encode_fn, texts))
+        pool_size = min(self.pool_size, len(self.concepts))
+
+        results = []
+        for query, sparse_row in zip(queries, sparse_scores):
+            pool = np.argpartition(-sparse_row, pool_size - 1)[:pool_size]
+            dense_row = self.embeddings[pool] @ query
+            fused = self.dense_weight * dense_row + (1.0 - self.dense_weight) * sparse_row[pool]
+            ranked = np.argsort(-fused)[:top_k]
+            results.append(
+                [
+                    Match(
+                        self.concepts[pool[i]].code,
+                        self.concepts[pool[i]].text,
+                        round(float(fused[i]), 5),
+                    )
+                    for i in ranked
+                ]
+            )
+        return results
+
+
+def build_lab_name_retriever(path: str, encode_fn: EncodeFn, **kwargs) -> HybridRetriever:
+    """
+    Builds a hybrid retriever over a LOINC lab names value set file, indexing
+    the long, short and display names along with each code's related names.
+
+    :param path: The path to the LOINC value set CSV file.
+    :param encode_fn: The batch encoder for the dense stage.
+    :param kwargs: Additional keyword arguments for `HybridRetriever`.
+    :returns: The hybrid retriever.
+    """
+    concepts = load_valueset_csv(path, ("long_name", "short_name", "display_name"))
+    return HybridRetriever(concepts, encode_fn, load_related_names(path), **kwargs)
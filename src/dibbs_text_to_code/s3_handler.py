@@ -5,6 +5,8 @@ import boto3
 from aws_lambda_typing import events as lambda_events
 from botocore.client import BaseClient
 
+from .metrics import StageMetrics
+
 
 def create_s3_client() -> BaseClient:
     """
@@ -16,18 +18,28 @@ def create_s3_client() -> BaseClient:
     return boto3.client("s3", endpoint_url=endpoint_url, region_name=region_name)
 
 
-def get_file_content_from_s3_event(event: lambda_events.EventBridgeEvent) -> bytes:
+def get_file_content_from_s3_event(
+    event: lambda_events.EventBridgeEvent, metrics: typing.Optional[StageMetrics] = None
+) -> bytes:
     """
     Extracts the file content from an S3 event triggered by a Lambda function.
+    Optionally, records the time spent in `get_object` and reading the body,
+    along with the number of bytes read, on the supplied metrics collector.
     """
+    if metrics is None:
+        metrics = StageMetrics("get_file_content_from_s3_event")
 
     bucket_name = event["detail"]["bucket"]["name"]
     object_key = event["detail"]["object"]["key"]
 
     client = create_s3_client()
 
-    response = client.get_object(Bucket=bucket_name, Key=object_key)
-    return response["Body"].read()
+    with metrics.stage("s3_get_object"):
+        response = client.get_object(Bucket=bucket_name, Key=object_key)
+    with metrics.stage("s3_read"):
+        content = response["Body"].read()
+    metrics.add_bytes("s3_read", len(content))
+    return content
 
 
 def put_file(file_obj: typing.BinaryIO, bucket_name: str, object_key: str):
@@ -36,3 +48,75 @@ def put_file(file_obj: typing.BinaryIO, bucket_name: str, object_key: str):
     """
     client = create_s3_client()
     client.put_object(Body=file_obj, Bucket=bucket_name, Key=object_key)
+
+
+def get_file(bucket_name: str, object_key: str) -> bytes:
+    """
+    Reads the content of an object in a S3 bucket.
+    """
+    client = create_s3_client()
+    response = client.get_object(Bucket=bucket_name, Key=object_key)
+    return response["Body"].read()
+
+
+def download_file(bucket_name: str, object_key: str, path: str) -> None:
+    """
+    Downloads an object in a S3 bucket to a local file, streaming it to disk
+    rather than holding it in memory.
+    """
+    client = create_s3_client()
+    client.download_file(Bucket=bucket_name, Key=object_key, Filename=path)
+
+
+class MultipartUpload:
+    """
+    Uploads an object to a S3 bucket in parts, so large outputs never need
+    to be held in memory whole. Every part except the last must be at least
+    5 MiB.
+    """
+
+    def __init__(
+        self, bucket_name: str, object_key: str, client: typing.Optional[BaseClient] = None
+    ):
+        """
+        Starts the multipart upload.
+        """
+        self.bucket_name = bucket_name
+        self.object_key = object_key
+        self.client = client or create_s3_client()
+        response = self.client.create_multipart_upload(Bucket=bucket_name, Key=object_key)
+        self.upload_id = response["UploadId"]
+        self.parts: list[dict] = []
+
+    def upload_part(self, body: bytes) -> None:
+        """
+        Uploads the next part of the object.
+        """
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Body=body,
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def complete(self) -> None:
+        """
+        Assembles the uploaded parts into the final object.
+        """
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.object_key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+
+    def abort(self) -> None:
+        """
+        Discards the upload and any parts already stored.
+        """
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket_name, Key=self.object_key, UploadId=self.upload_id
+        )
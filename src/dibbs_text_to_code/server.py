@@ -0,0 +1,269 @@
+import concurrent.futures
+import json
+import logging
+import os
+import signal
+import threading
+import typing
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from . import batching
+from .index_manager import get_index_manager
+from .main import handler
+
+MODEL_NAME = os.getenv("TTC_MODEL_NAME", "all-MiniLM-L6-v2")
+SERVER_HOST = os.getenv("TTC_SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("TTC_SERVER_PORT", "8000"))
+# Upper bound on the size of a request body, to protect the warm process
+MAX_BODY_BYTES = int(os.getenv("TTC_MAX_BODY_BYTES", str(10 * 1024 * 1024)))
+# Longest an encode request waits on the model, so a stuck encode can't hold
+# every request thread
+ENCODE_TIMEOUT_SECONDS = float(os.getenv("TTC_ENCODE_TIMEOUT_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+def load_encoder(model_name: str = MODEL_NAME) -> batching.EncodeFn:
+    """
+    Loads a SentenceTransformers model once and returns a batch encode
+    function for it. Embeddings are returned as numpy rows so they can be
+    serialized into HTTP responses.
+    """
+    # Imported here so the Lambda handler doesn't pay for loading the
+    # transformer stack when it isn't serving embeddings
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name)
+    return batching.sentence_transformer_encode_fn(model, convert_to_tensor=False)
+
+
+def _json_default(obj: typing.Any) -> typing.Any:
+    """
+    Serializes values the standard JSON encoder can't handle, namely the raw
+    S3 file contents and array-like embeddings.
+    """
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class RequestBodyError(ValueError):
+    """
+    Raised when a request body can't be read, carrying the status to reply with.
+    """
+
+    def __init__(self, status: HTTPStatus, message: str):
+        """
+        :param status: The HTTP status for the response.
+        :param message: The error message for the response.
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class TextToCodeServer(ThreadingHTTPServer):
+    """
+    A long-running HTTP server that runs the same pipeline as the Lambda
+    handler. Each request is handled on its own thread, and encode requests
+    from all threads share one warm model through a `MicroBatcher`.
+    """
+
+    # Wait for in-flight requests to finish when the server is closed
+    block_on_close = True
+    daemon_threads = False
+
+    def __init__(self, server_address: tuple[str, int]):
+        """
+        :param server_address: The (host, port) pair to listen on.
+        """
+        super().__init__(server_address, TextToCodeRequestHandler)
+        self.batcher: typing.Optional[batching.MicroBatcher] = None
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+
+    def warm_up(self, encode_fn: typing.Optional[batching.EncodeFn] = None) -> None:
+        """
+        Loads the model (unless an encode function is supplied), hands it to
+        the index manager for encoding queries, and marks the server as ready
+        to receive traffic.
+        """
+        if encode_fn is None:
+            encode_fn = load_encoder()
+        get_index_manager(encode_fn)
+        self.batcher = batching.MicroBatcher(encode_fn)
+        self.ready.set()
+        logger.info("Text to Code server is ready")
+
+    def graceful_shutdown(self) -> None:
+        """
+        Stops accepting new requests, waits for in-flight requests to finish
+        and then releases the model. Must not be called from the thread
+        running `serve_forever`.
+        """
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        self.ready.clear()
+        self.shutdown()
+        self.server_close()
+        if self.batcher is not None:
+            self.batcher.close()
+        logger.info("Text to Code server stopped")
+
+
+class TextToCodeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes HTTP requests to the health probes and the coding pipeline.
+
+    GET  /health       Liveness probe, OK as soon as the process is serving.
+    GET  /ready        Readiness probe, OK once the model is loaded.
+    POST /invocations  Runs an SQS event batch through the Lambda handler.
+    POST /encode       Encodes a batch of strings: {"texts": [...]}.
+    """
+
+    @property
+    def _ttc_server(self) -> TextToCodeServer:
+        """
+        The server this handler belongs to, with its readiness and batcher.
+        """
+        return typing.cast(TextToCodeServer, self.server)
+
+    def do_GET(self) -> None:
+        """
+        Handles the health and readiness probes.
+        """
+        if self.path == "/health":
+            self._send_json(HTTPStatus.OK, {"status": "ok"})
+        elif self.path == "/ready":
+            if self._ttc_server.ready.is_set():
+                self._send_json(HTTPStatus.OK, {"status": "ready"})
+            else:
+                self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"status": "not ready"})
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:
+        """
+        Handles pipeline invocations and batch encode requests.
+        """
+        routes = {"/invocations": self._invoke, "/encode": self._encode}
+        route = routes.get(self.path)
+        if route is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"Unknown path {self.path}"})
+            return
+        if not self._ttc_server.ready.is_set():
+            self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Server is not ready"})
+            return
+
+        try:
+            payload = self._read_json()
+        except RequestBodyError as e:
+            self._send_json(e.status, {"error": str(e)})
+            return
+
+        try:
+            status, body = route(payload)
+        except Exception:
+            logger.exception("Error handling %s", self.path)
+            status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
+        self._send_json(status, body)
+
+    def log_message(self, format: str, *args: typing.Any) -> None:
+        """
+        Sends access logs through the logging module instead of stderr.
+        """
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def _invoke(self, payload: typing.Any) -> tuple[HTTPStatus, typing.Any]:
+        """
+        Passes an SQS event through the same entry point Lambda uses.
+        """
+        if not isinstance(payload, dict):
+            return HTTPStatus.BAD_REQUEST, {"error": "Expected an SQS event object"}
+        return HTTPStatus.OK, handler(payload, {})  # ty: ignore
+
+    def _encode(self, payload: typing.Any) -> tuple[HTTPStatus, typing.Any]:
+        """
+        Encodes every string in the request through the shared micro-batcher
+        so that concurrent requests are coalesced into larger model calls.
+        """
+        texts = payload.get("texts") if isinstance(payload, dict) else None
+        if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+            return HTTPStatus.BAD_REQUEST, {"error": "Expected 'texts' to be a list of strings"}
+        batcher = self._ttc_server.batcher
+        assert batcher is not None
+        futures = [batcher.submit(t) for t in texts]
+        done, not_done = concurrent.futures.wait(futures, timeout=ENCODE_TIMEOUT_SECONDS)
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Timed out waiting for the encoder"}
+        return HTTPStatus.OK, {"embeddings": [f.result() for f in futures]}
+
+    def _read_json(self) -> typing.Any:
+        """
+        Reads and decodes the JSON request body.
+
+        :raises RequestBodyError: If the body is missing, too large, of an
+          invalid length or not JSON.
+        """
+        header = self.headers.get("Content-Length")
+        if header is None:
+            raise RequestBodyError(HTTPStatus.LENGTH_REQUIRED, "Content-Length is required")
+        try:
+            length = int(header)
+        except ValueError:
+            raise RequestBodyError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length < 0:
+            raise RequestBodyError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise RequestBodyError(
+                HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Request body exceeds {MAX_BODY_BYTES} bytes"
+            )
+        raw = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(raw)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise RequestBodyError(HTTPStatus.BAD_REQUEST, f"Invalid JSON body: {e}")
+
+    def _send_json(self, status: HTTPStatus, body: typing.Any) -> None:
+        """
+        Writes a JSON response with the given status code.
+        """
+        data = json.dumps(body, default=_json_default).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT) -> None:
+    """
+    Runs the Text to Code HTTP server until it receives SIGTERM or SIGINT.
+    The model is loaded in the background so that the liveness probe
+    answers immediately while the readiness probe waits for the model.
+    """
+    server = TextToCodeServer((host, port))
+
+    def _stop(signum, frame):
+        logger.info("Received signal %s, shutting down", signum)
+        # shutdown() blocks until serve_forever() returns, so it has to run
+        # on a different thread than the one serving requests
+        threading.Thread(target=server.graceful_shutdown).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    threading.Thread(target=server.warm_up, name="model-warm-up", daemon=True).start()
+    logger.info("Text to Code server listening on %s:%s", host, port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve()
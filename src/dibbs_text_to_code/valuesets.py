@@ -0,0 +1,360 @@
+import csv
+import difflib
+import os
+import typing
+from dataclasses import dataclass
+
+import numpy as np
+
+from .batching import EncodeFn
+from .fuzzy_index import FuzzyIndex
+
+# eICR fields that can be coded, and the value set each one is coded against
+FIELD_LAB_NAME = "lab_name"
+FIELD_RESULT_VALUE = "result_value"
+FIELD_INTERPRETATION = "interpretation"
+
+VALUESET_DIR = os.getenv("TTC_VALUESET_DIR", "data/snoinc_extracts")
+DEFAULT_VALUESET_FILES = {
+    FIELD_LAB_NAME: "loinc_lab_names_20250911.csv",
+    FIELD_RESULT_VALUE: "snomed_lab_value_20250911.csv",
+    FIELD_INTERPRETATION: "hl7_lab_interp_20250911.csv",
+}
+
+# Value sets at or below this size are matched lexically; an embedding
+# search over a few dozen rows costs more than it gains
+SMALL_VALUESET_MAX_ROWS = 100
+# Embeddings stored in a narrower dtype are upcast for scoring this many rows
+# at a time, so a search never holds a float32 copy of the whole index
+SEARCH_BLOCK_ROWS = 16384
+
+
+@dataclass(frozen=True)
+class Concept:
+    """
+    A single coded concept from a value set.
+    """
+
+    code: str
+    text: str
+
+
+@dataclass(frozen=True)
+class Match:
+    """
+    A candidate concept for an input string, with a similarity score in [0, 1].
+    """
+
+    code: str
+    text: str
+    score: float
+
+
+class ValueSetIndex(typing.Protocol):
+    """
+    The interface shared by every per-value-set index in the registry.
+    """
+
+    def search(self, texts: list[str], top_k: int = 5) -> list[list[Match]]:
+        """
+        Returns the best `top_k` matches for each input string.
+        """
+        ...
+
+
+def load_valueset_csv(
+    path: str, text_columns: typing.Sequence[str] = ("text",), code_column: str = "code"
+) -> list[Concept]:
+    """
+    Reads a pipe-delimited value set file as written by
+    `terminology_valueset_sync.save_valueset_csv_file`. Every non-empty
+    text column of a row becomes its own concept, so a LOINC row with short,
+    long and display names yields three concepts sharing one code.
+
+    :param path: The path to the value set CSV file.
+    :param text_columns: The columns holding names for the code.
+    :param code_column: The column holding the code.
+    :returns: A list of concepts in file order.
+    """
+    concepts = []
+    with open(path, "r", newline="", encoding="utf-8") as fp:
+        for row in csv.DictReader(fp, delimiter="|"):
+            code = (row.get(code_column) or "").strip()
+            if code == "":
+                continue
+            for column in text_columns:
+                text = (row.get(column) or "").strip()
+                if text != "":
+                    concepts.append(Concept(code, text))
+    return concepts
+
+
+def load_related_names(
+    path: str, related_column: str = "related_names", code_column: str = "code"
+) -> dict[str, list[str]]:
+    """
+    Reads the related names of each code from a LOINC value set file. LOINC
+    stores these (its RELATEDNAMES2 field) as one ';' separated string, which
+    is split into individual names here.
+
+    :param path: The path to the value set CSV file.
+    :param related_column: The column holding the related names.
+    :param code_column: The column holding the code.
+    :returns: A mapping of code to its related names.
+    """
+    related: dict[str, list[str]] = {}
+    with open(path, "r", newline="", encoding="utf-8") as fp:
+        for row in csv.DictReader(fp, delimiter="|"):
+            code = (row.get(code_column) or "").strip()
+            names = [n.strip() for n in (row.get(related_column) or "").split(";")]
+            names = [n for n in names if n != ""]
+            if code != "" and names:
+                related.setdefault(code, []).extend(names)
+    return related
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a string for lexical comparison by lowercasing it and
+    collapsing whitespace.
+    """
+    return " ".join(text.lower().split())
+
+
+class LexicalMatcher:
+    """
+    A cheap matcher for small value sets. Inputs are first looked up exactly
+    (case and whitespace insensitive) against both the concept text and its
+    code, then against a `FuzzyIndex` for typos within a couple of edits, and
+    only then fall back to a slower fuzzy string similarity scan.
+    """
+
+    def __init__(self, concepts: list[Concept], min_score: float = 0.6):
+        """
+        :param concepts: The concepts in the value set.
+        :param min_score: The lowest fuzzy similarity to return as a match.
+        """
+        self.concepts = concepts
+        self.min_score = min_score
+        self._exact: dict[str, list[Concept]] = {}
+        for concept in concepts:
+            for key in {normalize_text(concept.text), normalize_text(concept.code)}:
+                self._exact.setdefault(key, []).append(concept)
+        self._keys = list(self._exact)
+        self._fuzzy = FuzzyIndex.from_terms((key, key) for key in self._keys)
+
+    def search(self, texts: list[str], top_k: int = 5) -> list[list[Match]]:
+        """
+        Returns the best `top_k` matches for each input string.
+        """
+        return [self._search_one(text, top_k) for text in texts]
+
+    def _search_one(self, text: str, top_k: int) -> list[Match]:
+        """
+        Matches a single input string.
+        """
+        key = normalize_text(text)
+        if key in self._exact:
+            return [Match(c.code, c.text, 1.0) for c in self._exact[key]][:top_k]
+
+        scored: list[tuple[float, str]] = []
+        for fuzzy_match in self._fuzzy.lookup(key):
+            ratio = 1.0 - fuzzy_match.distance / max(len(fuzzy_match.term), len(key))
+            if ratio >= self.min_score:
+                scored.append((ratio, fuzzy_match.term))
+        if not scored:
+            for candidate in difflib.get_close_matches(
+                key, self._keys, n=top_k, cutoff=self.min_score
+            ):
+                ratio = difflib.SequenceMatcher(None, key, candidate).ratio()
+                scored.append((ratio, candidate))
+
+        matches: list[Match] = []
+        seen: set[Concept] = set()
+        for ratio, candidate in scored:
+            for concept in self._exact[candidate]:
+                if concept not in seen:
+                    seen.add(concept)
+                    matches.append(Match(concept.code, concept.text, round(ratio, 5)))
+        return matches[:top_k]
+
+
+class EmbeddingIndex:
+    """
+    An exact cosine-similarity index over the embedded names of a value set.
+    Embeddings are L2-normalized once at build time and stored as a single
+    contiguous matrix, so a search is one matrix product.
+    """
+
+    def __init__(
+        self,
+        concepts: list[Concept],
+        encode_fn: EncodeFn,
+        embeddings: typing.Optional[np.ndarray] = None,
+        dtype: typing.Any = np.float32,
+        normalized: bool = False,
+    ):
+        """
+        :param concepts: The concepts in the value set.
+        :param encode_fn: A batch encoder, e.g. from
+          `batching.sentence_transformer_encode_fn`, used for the queries and,
+          when `embeddings` is not supplied, for the concepts.
+        :param embeddings: Optionally, precomputed embeddings for the concepts.
+        :param dtype: The dtype to store embeddings in; float16 halves memory.
+          Searches then upcast `SEARCH_BLOCK_ROWS` rows at a time, so the
+          saving holds during a search too.
+        :param normalized: Whether `embeddings` are already L2-normalized. If
+          so they are used as given, without a copy, which keeps a
+          memory-mapped array on disk until it is searched.
+        """
+        self.concepts = concepts
+        self.encode_fn = encode_fn
+        if embeddings is None:
+            embeddings = self._encode([c.text for c in concepts])
+        elif normalized:
+            self.embeddings = embeddings
+            return
+        self.embeddings = normalize_rows(np.asarray(embeddings, dtype=np.float32)).astype(dtype)
+
+    def search(self, texts: list[str], top_k: int = 5) -> list[list[Match]]:
+        """
+        Returns the best `top_k` matches for each input string.
+        """
+        if not texts or not self.concepts:
+            return [[] for _ in texts]
+        queries = normalize_rows(self._encode(texts))
+        scores = self._scores(queries)
+        k = min(top_k, len(self.concepts))
+        # Partition first so only the top k scores of each row get sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, top):
+            ranked = candidates[np.argsort(-row[candidates])]
+            results.append(
+                [
+                    Match(self.concepts[i].code, self.concepts[i].text, round(float(row[i]), 5))
+                    for i in ranked
+                ]
+            )
+        return results
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Computes the cosine similarity of each query with every concept.
+        float32 embeddings are multiplied in place; narrower ones are upcast
+        a block of rows at a time, since BLAS only handles float32 and wider.
+        """
+        if self.embeddings.dtype == np.float32:
+            return queries @ self.embeddings.T
+        scores = np.empty((len(queries), len(self.embeddings)), dtype=np.float32)
+        for start in range(0, len(self.embeddings), SEARCH_BLOCK_ROWS):
+            block = np.asarray(self.embeddings[start : start + SEARCH_BLOCK_ROWS], np.float32)
+            scores[:, start : start + len(block)] = queries @ block.T
+        return scores
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        """
+        Encodes strings with the index's encoder.
+        """
+        return encode_matrix(self.encode_fn, texts)
+
+
+class IndexRegistry:
+    """
+    Holds one index per value set and routes each eICR field to the index
+    for the value set that field is coded against.
+    """
+
+    def __init__(self):
+        """
+        Creates an empty registry.
+        """
+        self._indexes: dict[str, ValueSetIndex] = {}
+
+    def register(self, field: str, index: ValueSetIndex) -> None:
+        """
+        Routes a field to an index, replacing any index already registered.
+        """
+        self._indexes[field] = index
+
+    def get(self, field: str) -> ValueSetIndex:
+        """
+        Returns the index registered for a field.
+        """
+        if field not in self._indexes:
+            raise KeyError(f"No value set index registered for field '{field}'")
+        return self._indexes[field]
+
+    @property
+    def fields(self) -> list[str]:
+        """
+        The fields that have a registered index.
+        """
+        return list(self._indexes)
+
+    def search(self, field: str, texts: list[str], top_k: int = 5) -> list[list[Match]]:
+        """
+        Codes a batch of values of one field against its value set.
+        """
+        return self.get(field).search(texts, top_k=top_k)
+
+
+def build_index(
+    concepts: list[Concept],
+    encode_fn: typing.Optional[EncodeFn] = None,
+    small_max_rows: int = SMALL_VALUESET_MAX_ROWS,
+) -> ValueSetIndex:
+    """
+    Builds the appropriate index for a value set: a lexical matcher for small
+    sets, or when no encoder is available, and an embedding index otherwise.
+    """
+    if encode_fn is None or len(concepts) <= small_max_rows:
+        return LexicalMatcher(concepts)
+    return EmbeddingIndex(concepts, encode_fn)
+
+
+def build_default_registry(
+    encode_fn: typing.Optional[EncodeFn] = None,
+    valueset_dir: str = VALUESET_DIR,
+    valueset_files: typing.Optional[dict[str, str]] = None,
+) -> IndexRegistry:
+    """
+    Builds a registry over the synced LOINC, SNOMED and HL7 value sets,
+    skipping any whose file is not present.
+
+    :param encode_fn: The batch encoder for the embedding indexes.
+    :param valueset_dir: The directory holding the value set CSV files.
+    :param valueset_files: Optionally, a mapping of field to file name to use
+      instead of `DEFAULT_VALUESET_FILES`.
+    :returns: The populated registry.
+    """
+    registry = IndexRegistry()
+    for field, filename in (valueset_files or DEFAULT_VALUESET_FILES).items():
+        path = os.path.join(valueset_dir, filename)
+        if not os.path.exists(path):
+            continue
+        if field == FIELD_LAB_NAME:
+            concepts = load_valueset_csv(path, ("long_name", "short_name", "display_name"))
+        else:
+            concepts = load_valueset_csv(path)
+        registry.register(field, build_index(concepts, encode_fn))
+    return registry
+
+
+def encode_matrix(encode_fn: EncodeFn, texts: list[str]) -> np.ndarray:
+    """
+    Encodes strings into a float32 matrix, whatever array type (list, numpy
+    array or torch tensor) the encoder returns.
+    """
+    embeddings = encode_fn(texts)
+    if hasattr(embeddings, "cpu"):
+        embeddings = embeddings.cpu().numpy()  # ty: ignore
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Scales each row of a matrix to unit length.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
@@ -5,6 +5,10 @@ import boto3
 import moto
 import pytest
 
+TINY_MODEL_WORDS = (
+    "the a of in blood serum glucose hemoglobin test level measurement is for and plasma"
+)
+
 
 @pytest.fixture(scope="function")
 def moto_setup(monkeypatch):
@@ -32,3 +36,39 @@ def moto_setup(monkeypatch):
 @pytest.fixture(autouse=True)
 def fixed_random_seed():
     random.seed(42)
+
+
+@pytest.fixture
+def tiny_model_dir(tmp_path):
+    # A two-layer BERT with a fifteen word vocabulary, small enough to train in a test
+    from transformers import BertConfig
+    from transformers import BertModel
+    from transformers import BertTokenizerFast
+
+    model_dir = str(tmp_path / "tiny-bert")
+    os.makedirs(model_dir)
+    vocab_path = os.path.join(model_dir, "vocab.txt")
+    with open(vocab_path, "w") as fp:
+        fp.write(
+            "\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + TINY_MODEL_WORDS.split())
+        )
+    BertTokenizerFast(vocab_path).save_pretrained(model_dir)
+    config = BertConfig(
+        vocab_size=20,
+        hidden_size=16,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=32,
+        max_position_embeddings=64,
+    )
+    BertModel(config).save_pretrained(model_dir)
+    return model_dir
+
+
+@pytest.fixture
+def tiny_model(tiny_model_dir):
+    from sentence_transformers import models
+    from sentence_transformers import SentenceTransformer
+
+    transformer = models.Transformer(tiny_model_dir, max_seq_length=32)
+    return SentenceTransformer(modules=[transformer, models.Pooling(16, "cls")], device="cpu")
@@ -0,0 +1,86 @@
+import csv
+import os
+import random
+
+from data_curation import augmentation_pipeline
+
+EXTRACT = (
+    "code|short_name|long_name|display_name|related_names\n"
+    "4544-3|Hct VFr Bld Auto|Hematocrit [Volume Fraction] of Blood by Automated count|"
+    "Hematocrit Bld Auto|HCT; Packed cell volume; PCV\n"
+    "718-7|Hgb Bld-mCnc|Hemoglobin [Mass/volume] in Blood|Hemoglobin Bld|\n"
+    "2345-7|Glucose SerPl-mCnc|Glucose [Mass/volume] in Serum or Plasma|Glucose SerPl|"
+    "Gluc; Random\n"
+)
+
+
+def write_extract(tmp_path):
+    path = tmp_path / "loinc.csv"
+    path.write_text(EXTRACT)
+    return str(path)
+
+
+def read_pairs(output_dir):
+    rows = []
+    for filename in sorted(os.listdir(output_dir)):
+        with open(os.path.join(output_dir, filename), newline="") as fp:
+            rows.extend(csv.reader(fp, delimiter="|"))
+    return rows
+
+
+class TestIterLoincRows:
+    def test_splits_related_names(self, tmp_path):
+        rows = list(augmentation_pipeline.iter_loinc_rows(write_extract(tmp_path)))
+        assert [code for code, _, _ in rows] == ["4544-3", "718-7", "2345-7"]
+        assert rows[0][2] == ["HCT", "Packed cell volume", "PCV"]
+        assert rows[1][2] == []
+        assert len(rows[0][1]) == 3
+
+
+class TestIterShards:
+    def test_iter_shards(self):
+        assert list(augmentation_pipeline.iter_shards(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+class TestRunPipeline:
+    def test_writes_pairs_for_every_name(self, tmp_path):
+        output_dir = str(tmp_path / "out")
+        total = augmentation_pipeline.run_pipeline(
+            write_extract(tmp_path), output_dir, variants=4, shard_size=2, workers=0
+        )
+        pairs = read_pairs(output_dir)
+
+        assert total == len(pairs) == 3 * 3 * 4
+        assert sorted(os.listdir(output_dir)) == ["pairs-00000.csv", "pairs-00001.csv"]
+        assert {code for _, _, code in pairs} == {"4544-3", "718-7", "2345-7"}
+        # Augmentation only reorders and adds words, never drops them
+        for augmented, name, _ in pairs:
+            assert set(name.split()) <= set(augmented.split())
+
+    def test_output_is_independent_of_worker_count(self, tmp_path):
+        extract = write_extract(tmp_path)
+        augmentation_pipeline.run_pipeline(
+            extract, str(tmp_path / "serial"), variants=3, shard_size=1, workers=0
+        )
+        augmentation_pipeline.run_pipeline(
+            extract, str(tmp_path / "parallel"), variants=3, shard_size=1, workers=2
+        )
+        assert read_pairs(str(tmp_path / "serial")) == read_pairs(str(tmp_path / "parallel"))
+
+    def test_leaves_global_random_state_alone(self, tmp_path):
+        random.seed(7)
+        expected = random.random()
+        random.seed(7)
+        augmentation_pipeline.run_pipeline(
+            write_extract(tmp_path), str(tmp_path / "out"), variants=2, workers=0
+        )
+        assert random.random() == expected
+
+    def test_removes_stale_shards(self, tmp_path):
+        extract = write_extract(tmp_path)
+        output_dir = str(tmp_path / "out")
+        augmentation_pipeline.run_pipeline(extract, output_dir, shard_size=1, workers=0)
+        assert len(os.listdir(output_dir)) == 3
+
+        augmentation_pipeline.run_pipeline(extract, output_dir, shard_size=2, workers=0)
+        assert sorted(os.listdir(output_dir)) == ["pairs-00000.csv", "pairs-00001.csv"]
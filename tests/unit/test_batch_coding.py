@@ -0,0 +1,178 @@
+import json
+import os
+import pickle
+
+import pytest
+import torch
+
+from model_tuning import batch_coding
+
+LOINC_NAMES = ["Hematocrit of Blood", "Glucose in Serum", "Vitamin D panel"]
+LOINC_CODES = ["4544-3", "2345-7", "62292-8"]
+
+
+class FakeModel:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def encode(self, texts, batch_size=32, convert_to_tensor=False, **kwargs):
+        # Embed each string by which of the LOINC names' first words it contains
+        keys = [name.split()[0].lower() for name in LOINC_NAMES]
+        return torch.tensor(
+            [[1.0 if k in t.lower() else 0.0 for k in keys] + [0.01] for t in texts]
+        )
+
+
+def write_embeddings(path):
+    model = FakeModel("fake")
+    with open(path, "wb") as fp:
+        pickle.dump(
+            {
+                "names": LOINC_NAMES,
+                "loinc_codes": LOINC_CODES,
+                "extract_path": "loinc.csv",
+                "embeddings": model.encode(LOINC_NAMES),
+            },
+            fp,
+        )
+
+
+def read_results(output_dir):
+    results = []
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.startswith("codes-"):
+            with open(os.path.join(output_dir, filename)) as fp:
+                results.extend(json.loads(line) for line in fp)
+    return results
+
+
+class TestIterInputLines:
+    def test_local_file(self, tmp_path):
+        path = tmp_path / "labs.txt"
+        path.write_text("Hct Bld\n\nGlucose Ser|2345-7\n")
+        assert list(batch_coding.iter_input_lines(str(path))) == ["Hct Bld", "Glucose Ser"]
+
+    def test_local_directory(self, tmp_path):
+        (tmp_path / "b.txt").write_text("second\n")
+        (tmp_path / "a.txt").write_text("first\n")
+        assert list(batch_coding.iter_input_lines(str(tmp_path))) == ["first", "second"]
+
+    def test_s3_prefix(self, moto_setup):
+        bucket = moto_setup.bucket_name
+        moto_setup.put_object(Bucket=bucket, Key="labs/1.txt", Body=b"Hct Bld\nGlucose\n")
+        moto_setup.put_object(Bucket=bucket, Key="labs/2.txt", Body=b"Vit D\n")
+        moto_setup.put_object(Bucket=bucket, Key="other/3.txt", Body=b"ignored\n")
+
+        lines = list(batch_coding.iter_input_lines(f"s3://{bucket}/labs/"))
+        assert lines == ["Hct Bld", "Glucose", "Vit D"]
+
+
+class TestIterShards:
+    def test_shards_are_stable_and_sized(self, tmp_path):
+        path = tmp_path / "labs.txt"
+        path.write_text("\n".join(f"lab {i}" for i in range(5)))
+
+        shards = list(batch_coding.iter_shards([str(path)], shard_size=2))
+        assert [len(s.texts) for s in shards] == [2, 2, 1]
+        assert [s.shard_id for s in shards] == [
+            s.shard_id for s in batch_coding.iter_shards([str(path)], shard_size=2)
+        ]
+        assert len({s.shard_id for s in shards}) == 3
+
+
+class TestRunBatchCoding:
+    def test_codes_and_resumes(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(batch_coding, "SentenceTransformer", FakeModel)
+        embeddings_path = str(tmp_path / "embeddings.pkl")
+        write_embeddings(embeddings_path)
+        input_path = tmp_path / "labs.txt"
+        input_path.write_text("hematocrit bld\nglucose ser\nvitamin d1d2d3\n")
+        output_dir = str(tmp_path / "out")
+
+        kwargs = dict(embeddings_path=embeddings_path, shard_size=2, top_k=1, workers=0)
+        summary = batch_coding.run_batch_coding([str(input_path)], output_dir, **kwargs)
+        assert summary == {"shards_coded": 2, "shards_skipped": 0, "texts_coded": 3}
+
+        results = read_results(output_dir)
+        assert [r["matches"][0]["code"] for r in results] == LOINC_CODES
+        assert [r["matches"][0]["name"] for r in results] == LOINC_NAMES
+        with open(os.path.join(output_dir, batch_coding.MANIFEST_FILE)) as fp:
+            assert json.load(fp)["index"]["extract_path"] == "loinc.csv"
+
+        # Running again finds every shard already complete
+        summary = batch_coding.run_batch_coding([str(input_path)], output_dir, **kwargs)
+        assert summary == {"shards_coded": 0, "shards_skipped": 2, "texts_coded": 0}
+
+    def test_changed_input_is_recoded(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(batch_coding, "SentenceTransformer", FakeModel)
+        embeddings_path = str(tmp_path / "embeddings.pkl")
+        write_embeddings(embeddings_path)
+        input_path = tmp_path / "labs.txt"
+        input_path.write_text("hematocrit bld\nglucose ser\nvitamin d1d2d3\n")
+        output_dir = str(tmp_path / "out")
+        kwargs = dict(embeddings_path=embeddings_path, shard_size=2, top_k=1, workers=0)
+        batch_coding.run_batch_coding([str(input_path)], output_dir, **kwargs)
+
+        input_path.write_text("hematocrit bld\nvitamin d\nglucose ser\n")
+        summary = batch_coding.run_batch_coding([str(input_path)], output_dir, **kwargs)
+
+        assert summary == {"shards_coded": 2, "shards_skipped": 0, "texts_coded": 3}
+        assert [r["text"] for r in read_results(output_dir)] == [
+            "hematocrit bld",
+            "vitamin d",
+            "glucose ser",
+        ]
+
+    def test_rejects_different_settings(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(batch_coding, "SentenceTransformer", FakeModel)
+        embeddings_path = str(tmp_path / "embeddings.pkl")
+        write_embeddings(embeddings_path)
+        input_path = tmp_path / "labs.txt"
+        input_path.write_text("hematocrit bld\nglucose ser\n")
+        output_dir = str(tmp_path / "out")
+        kwargs = dict(embeddings_path=embeddings_path, top_k=1, workers=0)
+        batch_coding.run_batch_coding([str(input_path)], output_dir, shard_size=2, **kwargs)
+
+        with pytest.raises(ValueError):
+            batch_coding.run_batch_coding([str(input_path)], output_dir, shard_size=1, **kwargs)
+
+    def test_builds_vector_db_with_codes(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(batch_coding, "SentenceTransformer", FakeModel)
+        monkeypatch.setattr(
+            batch_coding, "embed_loinc_names", lambda model, names: model.encode(names)
+        )
+        extract_path = tmp_path / "loinc.csv"
+        extract_path.write_text(
+            "code|long_name|short_name|display_name\n"
+            + "".join(f"{code}|{name}||\n" for code, name in zip(LOINC_CODES, LOINC_NAMES))
+        )
+        input_path = tmp_path / "labs.txt"
+        input_path.write_text("glucose ser\n")
+        output_dir = str(tmp_path / "out")
+
+        batch_coding.run_batch_coding(
+            [str(input_path)],
+            output_dir,
+            embeddings_path=str(tmp_path / "embeddings.pkl"),
+            extract_path=str(extract_path),
+            top_k=1,
+            workers=0,
+        )
+
+        assert read_results(output_dir)[0]["matches"][0]["code"] == "2345-7"
+
+    def test_rejects_embeddings_without_codes(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(batch_coding, "SentenceTransformer", FakeModel)
+        embeddings_path = str(tmp_path / "embeddings.pkl")
+        with open(embeddings_path, "wb") as fp:
+            pickle.dump({"codes": LOINC_NAMES, "embeddings": torch.zeros(3, 4)}, fp)
+        input_path = tmp_path / "labs.txt"
+        input_path.write_text("glucose ser\n")
+
+        with pytest.raises(ValueError):
+            batch_coding.run_batch_coding(
+                [str(input_path)],
+                str(tmp_path / "out"),
+                embeddings_path=embeddings_path,
+                workers=0,
+            )
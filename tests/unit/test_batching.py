@@ -0,0 +1,165 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import numpy as np
+import pytest
+import torch
+
+from dibbs_text_to_code import batching
+
+
+class RecordingEncoder:
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.calls.append(list(texts))
+        return [t.upper() for t in texts]
+
+
+class TestMicroBatcher:
+    def test_encode_single(self):
+        encoder = RecordingEncoder()
+        with batching.MicroBatcher(encoder, max_batch_size=8, max_wait_ms=1) as batcher:
+            assert batcher.encode("blood") == "BLOOD"
+        assert encoder.calls == [["blood"]]
+
+    def test_concurrent_requests_are_batched(self):
+        encoder = RecordingEncoder()
+        texts = [f"text {i}" for i in range(20)]
+        with batching.MicroBatcher(encoder, max_batch_size=8, max_wait_ms=200) as batcher:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=20) as pool:
+                results = list(pool.map(batcher.encode, texts))
+
+        assert results == [t.upper() for t in texts]
+        assert all(len(call) <= 8 for call in encoder.calls)
+        assert len(encoder.calls) < len(texts)
+
+    def test_encode_async(self):
+        encoder = RecordingEncoder()
+
+        async def run(batcher):
+            return await asyncio.gather(*(batcher.encode_async(t) for t in ["a", "b", "c"]))
+
+        with batching.MicroBatcher(encoder, max_batch_size=3, max_wait_ms=200) as batcher:
+            results = asyncio.run(run(batcher))
+
+        assert results == ["A", "B", "C"]
+        assert encoder.calls == [["a", "b", "c"]]
+
+    def test_encoder_error_is_raised_to_callers(self):
+        def failing_encoder(texts):
+            raise RuntimeError("model unavailable")
+
+        with batching.MicroBatcher(failing_encoder, max_wait_ms=1) as batcher:
+            with pytest.raises(RuntimeError, match="model unavailable"):
+                batcher.encode("blood")
+
+    def test_close_drains_queue_and_rejects_new_work(self):
+        encoder = RecordingEncoder()
+        batcher = batching.MicroBatcher(encoder, max_batch_size=2, max_wait_ms=50)
+        futures = [batcher.submit(t) for t in ["a", "b", "c"]]
+        batcher.close()
+
+        assert [f.result(timeout=1) for f in futures] == ["A", "B", "C"]
+        with pytest.raises(RuntimeError):
+            batcher.submit("d")
+
+    def test_leftovers_after_shutdown_are_batched(self):
+        encoder = RecordingEncoder()
+        release = threading.Event()
+
+        def blocking_encoder(texts):
+            release.wait(1)
+            return encoder(texts)
+
+        batcher = batching.MicroBatcher(blocking_encoder, max_batch_size=2, max_wait_ms=0)
+        first = batcher.submit("a")
+        # Queue work behind the shutdown marker while the first batch is encoding
+        batcher._queue.put(batching._SHUTDOWN)
+        futures = []
+        for text in ["b", "c", "d"]:
+            future: concurrent.futures.Future = concurrent.futures.Future()
+            batcher._queue.put((text, future))
+            futures.append(future)
+        release.set()
+        batcher._worker.join(1)
+
+        assert first.result(timeout=1) == "A"
+        assert [f.result(timeout=1) for f in futures] == ["B", "C", "D"]
+        assert encoder.calls == [["a"], ["b", "c"], ["d"]]
+        batcher.close()
+
+    @pytest.mark.parametrize("kwargs", [{"max_batch_size": 0}, {"max_wait_ms": -1}])
+    def test_invalid_settings(self, kwargs):
+        with pytest.raises(ValueError):
+            batching.MicroBatcher(RecordingEncoder(), **kwargs)
+
+
+class FakeTokenizer:
+    def __call__(self, texts, add_special_tokens=True, truncation=False, max_length=None):
+        ids = [[0] + [1] * len(t.split()) + [2] for t in texts]
+        if truncation:
+            ids = [i[:max_length] for i in ids]
+        return {"input_ids": ids}
+
+
+class FakeSentenceTransformer:
+    tokenizer = FakeTokenizer()
+    max_seq_length = 6
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts, batch_size=32, convert_to_tensor=False, **kwargs):
+        self.calls.append(list(texts))
+        embeddings = np.array([[float(len(t.split())), float(len(t))] for t in texts])
+        return torch.from_numpy(embeddings) if convert_to_tensor else embeddings
+
+
+class TestLengthBucketing:
+    def test_token_lengths_are_capped(self):
+        model = FakeSentenceTransformer()
+        assert batching.token_lengths(model, ["a", "a b c d e f g"]) == [3, 6]
+
+    def test_length_batches_group_similar_lengths(self):
+        lengths = [3, 30, 4, 28, 3, 29]
+        batches = batching.length_batches(lengths, batch_size=3)
+        assert batches == [[1, 5, 3], [2, 0, 4]]
+        assert batching.padded_token_count(lengths, batches) == 102
+
+    def test_length_batches_token_budget(self):
+        batches = batching.length_batches([10, 10, 10, 2, 2, 2], batch_size=4, max_tokens=20)
+        assert batches == [[0, 1], [2, 3], [4, 5]]
+
+    def test_encode_bucketed_restores_order(self):
+        model = FakeSentenceTransformer()
+        texts = ["a", "a b c d", "a b", "a b c d", "b"]
+        result = batching.encode_bucketed(model, texts, batch_size=2, convert_to_tensor=True)
+
+        assert isinstance(result, torch.Tensor)
+        assert result[:, 0].tolist() == [1.0, 4.0, 2.0, 4.0, 1.0]
+        assert model.calls == [["a b c d", "a b c d"], ["a b", "a"], ["b"]]
+
+        result = batching.encode_bucketed(model, texts, batch_size=2)
+        assert isinstance(result, np.ndarray)
+        assert result[:, 1].tolist() == [1.0, 7.0, 3.0, 7.0, 1.0]
+
+    def test_encode_fn_buckets_batches(self):
+        model = FakeSentenceTransformer()
+        encode_fn = batching.sentence_transformer_encode_fn(model, bucket_size=2)
+        result = encode_fn(["a b c", "a", "a b c"])
+
+        assert result[:, 0].tolist() == [3.0, 1.0, 3.0]
+        assert model.calls == [["a b c", "a b c"], ["a"]]
+
+    @pytest.mark.parametrize("bucket_size", [None, 3])
+    def test_encode_fn_small_batches_use_one_call(self, bucket_size):
+        model = FakeSentenceTransformer()
+        encode_fn = batching.sentence_transformer_encode_fn(model, bucket_size=bucket_size)
+        encode_fn(["a b c", "a", "a b c"])
+
+        assert model.calls == [["a b c", "a", "a b c"]]
@@ -0,0 +1,113 @@
+import os
+
+import pytest
+import torch
+from sentence_transformers import SentenceTransformer
+
+from model_tuning import distillation
+from model_tuning.evaluation import EvalConfig
+
+SENTENCES = [
+    "glucose level in blood",
+    "hemoglobin measurement",
+    "serum and plasma test for glucose",
+    "the test is for hemoglobin in serum",
+    "a level of glucose in plasma",
+    "blood test",
+]
+
+
+class TestStudent:
+    def test_layers_to_keep(self):
+        assert distillation.layers_to_keep(6, 3) == [0, 2, 5]
+        assert distillation.layers_to_keep(12, 6) == [0, 2, 4, 7, 9, 11]
+        assert distillation.layers_to_keep(6, 1) == [5]
+        with pytest.raises(ValueError):
+            distillation.layers_to_keep(6, 7)
+
+    def test_make_student_prunes_layers(self, tiny_model_dir):
+        student = distillation.make_student(tiny_model_dir, num_layers=1, device="cpu")
+        assert len(student[0].auto_model.encoder.layer) == 1
+        assert student[0].auto_model.config.num_hidden_layers == 1
+        assert student.encode(["blood test"]).shape == (1, 16)
+
+
+class TestDistill:
+    @pytest.mark.parametrize("token_cache", [False, True])
+    def test_student_learns_teacher_embeddings(self, tiny_model_dir, tmp_path, token_cache):
+        teacher = SentenceTransformer(tiny_model_dir, device="cpu")
+        student = distillation.make_student(tiny_model_dir, num_layers=1, device="cpu")
+        # Push the student well away from the teacher so it has something to learn
+        torch.manual_seed(0)
+        with torch.no_grad():
+            for param in student.parameters():
+                param.add_(torch.randn_like(param) * 0.5)
+
+        def mse():
+            target = teacher.encode(SENTENCES, convert_to_tensor=True)
+            return torch.nn.functional.mse_loss(
+                student.encode(SENTENCES, convert_to_tensor=True), target
+            ).item()
+
+        before = mse()
+        output_dir = str(tmp_path / "student")
+        distillation.distill(
+            teacher,
+            student,
+            SENTENCES,
+            output_dir,
+            epochs=20,
+            batch_size=3,
+            learning_rate=1e-3,
+            token_cache_dir=str(tmp_path / "tokens") if token_cache else None,
+        )
+        assert mse() < before
+
+        saved = SentenceTransformer(output_dir, device="cpu")
+        assert saved[0].auto_model.config.num_hidden_layers == 1
+
+    def test_load_training_sentences(self, tmp_path):
+        extract = tmp_path / "loinc.csv"
+        extract.write_text(
+            "code|short_name|long_name|display_name\n"
+            "718-7|Hgb Bld-mCnc|Hemoglobin [Mass/volume] in Blood|Hemoglobin\n"
+        )
+        pairs_dir = tmp_path / "pairs"
+        os.makedirs(pairs_dir)
+        (pairs_dir / "pairs-00000.csv").write_text(
+            "Blood Hemoglobin|Hemoglobin|718-7\nHemoglobin|Hemoglobin|718-7\n"
+        )
+
+        sentences = distillation.load_training_sentences(str(extract), str(pairs_dir))
+        assert sentences == [
+            "Hemoglobin [Mass/volume] in Blood",
+            "Hgb Bld-mCnc",
+            "Hemoglobin",
+            "Blood Hemoglobin",
+        ]
+
+
+class TestCompareToTeacher:
+    def test_report(self):
+        teacher, student = EvalConfig("teacher"), EvalConfig("student")
+        results = {
+            "results": {
+                teacher.name: {
+                    "top_k_accuracy": {"1": 0.8, "5": 0.95},
+                    "queries_per_second": 100.0,
+                    "p95_latency_ms": 12.0,
+                },
+                student.name: {
+                    "top_k_accuracy": {"1": 0.77, "5": 0.94},
+                    "queries_per_second": 300.0,
+                    "p95_latency_ms": 4.0,
+                },
+            }
+        }
+
+        report = distillation.compare_to_teacher(results, teacher, student, 0.02)
+        assert report["accuracy_drop"] == {"1": 0.03, "5": 0.01}
+        assert report["throughput_speedup"] == 3.0
+        assert report["p95_latency_speedup"] == 3.0
+        assert not report["passed"]
+        assert distillation.compare_to_teacher(results, teacher, student, 0.05)["passed"]
@@ -0,0 +1,69 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from model_tuning import embedding_job
+
+NAMES = [f"LOINC name {i}" for i in range(7)]
+
+
+class FakeModel:
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **kwargs):
+        self.encoded.append(list(texts))
+        return np.array([[float(t.split()[-1]), 1.0] for t in texts])
+
+
+class FailingModel(FakeModel):
+    def encode(self, texts, **kwargs):
+        if len(self.encoded) == 1:
+            raise RuntimeError("out of time")
+        return super().encode(texts, **kwargs)
+
+
+class TestRunEmbeddingJob:
+    def test_merges_shards_in_order(self, tmp_path):
+        out_path = str(tmp_path / "index.pkl")
+        model = FakeModel()
+        embedding_job.run_embedding_job(
+            NAMES, str(tmp_path / "work"), out_path, shard_size=3, model=model
+        )
+
+        assert [len(batch) for batch in model.encoded] == [3, 3, 1]
+        with open(out_path, "rb") as fp:
+            index = pickle.load(fp)
+        assert index["codes"] == NAMES
+        assert index["embeddings"][:, 0].tolist() == list(range(7))
+
+    def test_resumes_from_completed_shards(self, tmp_path):
+        work_dir = str(tmp_path / "work")
+        out_path = str(tmp_path / "index.pkl")
+        with pytest.raises(RuntimeError):
+            embedding_job.run_embedding_job(
+                NAMES, work_dir, out_path, shard_size=3, model=FailingModel()
+            )
+        assert os.path.exists(embedding_job.shard_path(work_dir, 0))
+        assert not os.path.exists(out_path)
+
+        model = FakeModel()
+        embedding_job.run_embedding_job(NAMES, work_dir, out_path, shard_size=3, model=model)
+
+        # Only the two shards that didn't finish are encoded again
+        assert model.encoded == [NAMES[3:6], NAMES[6:]]
+        with open(out_path, "rb") as fp:
+            assert pickle.load(fp)["embeddings"].shape == (7, 2)
+
+    def test_rejects_work_dir_from_other_job(self, tmp_path):
+        work_dir = str(tmp_path / "work")
+        embedding_job.prepare_work_dir(work_dir, "model-a", NAMES, 3)
+        embedding_job.prepare_work_dir(work_dir, "model-a", NAMES, 3)
+        with pytest.raises(ValueError):
+            embedding_job.prepare_work_dir(work_dir, "model-a", NAMES[::-1], 3)
+
+    def test_merge_requires_every_shard(self, tmp_path):
+        with pytest.raises(ValueError):
+            embedding_job.merge_shards(str(tmp_path), NAMES, 3, str(tmp_path / "index.pkl"))
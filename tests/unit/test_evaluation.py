@@ -0,0 +1,151 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+from dibbs_text_to_code import metrics
+from dibbs_text_to_code.valuesets import Concept
+from dibbs_text_to_code.valuesets import Match
+from model_tuning import evaluation
+
+EXTRACT = """\
+code|short_name|long_name|display_name|related_names
+718-7|Hgb Bld-mCnc|Hemoglobin [Mass/volume] in Blood|Hemoglobin|HGB; Hb
+2345-7|Glucose SerPl-mCnc|Glucose [Mass/volume] in Serum or Plasma|Glucose|Gluc
+"""
+GOLD = """\
+hemoglobin|Hemoglobin [Mass/volume] in Blood
+glucose|Glucose [Mass/volume] in Serum or Plasma
+sugar level|Glucose [Mass/volume] in Serum or Plasma
+
+ignored line without a label
+"""
+
+
+def keyword_encoder(texts):
+    # Hemoglobin-like strings point one way, everything else the other
+    return np.array([[1.0, 0.0] if "h" in t.lower()[:2] else [0.0, 1.0] for t in texts])
+
+
+@pytest.fixture
+def files(tmp_path):
+    extract = tmp_path / "loinc.csv"
+    extract.write_text(EXTRACT)
+    gold = tmp_path / "gold.txt"
+    gold.write_text(GOLD)
+    return str(extract), str(gold)
+
+
+class TestEvaluation:
+    def test_load_gold_set(self, files):
+        examples = evaluation.load_gold_set([files[1]])
+        assert examples[0] == ("hemoglobin", "Hemoglobin [Mass/volume] in Blood")
+        assert len(examples) == 3
+
+    def test_load_quoted_pair_shard(self, tmp_path):
+        shard = tmp_path / "pairs-00000.csv"
+        shard.write_text('"Hct | auto"|Hematocrit of Blood|4544-3\n')
+        assert evaluation.load_gold_set([str(shard)]) == [("Hct | auto", "Hematocrit of Blood")]
+
+    def test_codes_are_not_compared_with_names(self):
+        class FakeIndex:
+            def search(self, texts, top_k=5):
+                return [[Match("Glucose", "Hemoglobin", 1.0), Match("2345-7", "Glucose", 0.9)]]
+
+        concepts = [Concept("2345-7", "Glucose")]
+        result = evaluation.evaluate_index(FakeIndex(), [("sugar", "Glucose")], [1, 2], concepts)
+        assert result["top_k_accuracy"] == {"1": 0.0, "2": 1.0}
+
+    def test_lexical_metrics(self, files):
+        extract, gold = files
+        results = evaluation.run_evaluation(
+            [evaluation.EvalConfig(index_type="lexical")], [gold], extract, k_values=[1, 3]
+        )
+        result = results["results"]["all-MiniLM-L6-v2/lexical/float32"]
+
+        # "sugar level" has no lexical match, the other two are exact hits on the display name
+        assert result["top_k_accuracy"] == {"1": 0.66667, "3": 0.66667}
+        assert result["mrr"] == 0.66667
+        assert result["num_examples"] == 3
+        assert result["queries_per_second"] > 0
+        assert result["peak_rss_bytes"] > 0
+
+    def test_peak_memory_is_per_config(self, files):
+        extract, gold = files
+        # Memory this process has already used isn't charged to the config
+        ballast = np.ones(2**27, dtype=np.uint8)
+        results = evaluation.run_evaluation(
+            [evaluation.EvalConfig(index_type="lexical")], [gold], extract, k_values=[1]
+        )
+        result = results["results"]["all-MiniLM-L6-v2/lexical/float32"]
+
+        assert result["peak_rss_bytes"] < metrics.peak_rss_bytes()
+        del ballast
+
+    def test_dense_metrics(self, files):
+        extract, gold = files
+        config = evaluation.EvalConfig(model="fake", index_type="dense", dtype="float16")
+        results = evaluation.run_evaluation(
+            [config],
+            [gold],
+            extract,
+            k_values=[1],
+            load_encoder=lambda name: keyword_encoder,
+            isolate=False,
+        )
+        assert results["results"]["fake/dense/float16"]["top_k_accuracy"]["1"] > 0
+
+    def test_unknown_index_type(self):
+        with pytest.raises(ValueError):
+            evaluation.build_index(evaluation.EvalConfig(index_type="ann"), [], keyword_encoder)
+
+
+def make_results(accuracy=0.9, qps=100.0, p95=10.0, rss=1000):
+    return {
+        "gold_set_digest": "abc",
+        "results": {
+            "model/dense/float32": {
+                "top_k_accuracy": {"1": accuracy},
+                "mrr": accuracy,
+                "queries_per_second": qps,
+                "p95_latency_ms": p95,
+                "peak_rss_bytes": rss,
+            }
+        },
+    }
+
+
+class TestCompareResults:
+    def test_no_regressions_within_tolerance(self):
+        candidate = make_results(qps=95.0, p95=10.5, rss=1050)
+        assert evaluation.compare_results(make_results(), candidate) == []
+
+    def test_regressions_are_reported(self):
+        candidate = make_results(accuracy=0.8, qps=50.0, p95=20.0, rss=2000)
+        regressions = evaluation.compare_results(make_results(), candidate)
+        assert len(regressions) == 5
+
+    def test_missing_config(self):
+        candidate = make_results()
+        candidate["results"] = {}
+        assert evaluation.compare_results(make_results(), candidate) == [
+            "model/dense/float32: missing from the candidate run"
+        ]
+
+    def test_different_gold_sets(self):
+        candidate = make_results()
+        candidate["gold_set_digest"] = "def"
+        with pytest.raises(ValueError):
+            evaluation.compare_results(make_results(), candidate)
+
+    def test_compare_command_fails_on_regression(self, tmp_path, monkeypatch):
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps(make_results()))
+        candidate = tmp_path / "candidate.json"
+        candidate.write_text(json.dumps(make_results(qps=10.0)))
+
+        monkeypatch.setattr(sys, "argv", ["evaluation", "compare", str(baseline), str(candidate)])
+        with pytest.raises(SystemExit) as exc:
+            evaluation.main()
+        assert exc.value.code == 1
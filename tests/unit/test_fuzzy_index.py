@@ -0,0 +1,104 @@
+import random
+import time
+
+import pytest
+
+from dibbs_text_to_code import fuzzy_index
+from dibbs_text_to_code import valuesets
+
+SNOMED_FILE = "data/snoinc_extracts/snomed_lab_value_20250911.csv"
+
+
+class TestEditDistance:
+    @pytest.mark.parametrize(
+        "a, b, expected",
+        [
+            ("positive", "positive", 0),
+            ("positive", "posxtive", 1),  # substitution
+            ("positive", "positve", 1),  # deletion
+            ("positive", "posiitive", 1),  # insertion
+            ("positive", "psoitive", 1),  # transposition
+            ("detected", "dteceted", 2),
+            ("", "ab", 2),
+        ],
+    )
+    def test_edit_distance(self, a, b, expected):
+        assert fuzzy_index.edit_distance(a, b, max_distance=2) == expected
+
+    def test_stops_past_max_distance(self):
+        assert fuzzy_index.edit_distance("negative", "positive", max_distance=1) == 2
+
+
+class TestFuzzyIndex:
+    @pytest.fixture
+    def index(self):
+        terms = ["positive", "negative", "not detected", "detected", "reactive", "non-reactive"]
+        return fuzzy_index.FuzzyIndex.from_terms((t, t.upper()) for t in terms)
+
+    def test_exact(self, index):
+        matches = index.lookup("positive")
+        assert matches[0] == fuzzy_index.FuzzyMatch("positive", 0, ("POSITIVE",))
+
+    @pytest.mark.parametrize(
+        "query, term, distance",
+        [
+            ("postive", "positive", 1),
+            ("negatiev", "negative", 1),
+            ("not detectd", "not detected", 1),
+            ("nonreactive", "non-reactive", 1),
+            ("dtectd", "detected", 2),
+        ],
+    )
+    def test_typos(self, index, query, term, distance):
+        assert (index.lookup(query)[0].term, index.lookup(query)[0].distance) == (term, distance)
+
+    def test_results_sorted_by_distance(self):
+        index = fuzzy_index.FuzzyIndex.from_terms((t, t) for t in ["high", "hi", "highs", "low"])
+        assert [(m.term, m.distance) for m in index.lookup("high")] == [
+            ("high", 0),
+            ("highs", 1),
+            ("hi", 2),
+        ]
+
+    def test_lower_max_distance(self, index):
+        assert index.lookup("dtectd", max_distance=1) == []
+        assert index.lookup("positive", max_distance=0)[0].term == "positive"
+        assert index.lookup("postive", max_distance=0) == []
+
+    def test_max_distance_above_index(self, index):
+        with pytest.raises(ValueError):
+            index.lookup("positive", max_distance=3)
+
+    def test_duplicate_terms_collect_payloads(self):
+        index = fuzzy_index.FuzzyIndex.from_terms([("carrier", "CAR"), ("carrier", "Carrier")])
+        assert len(index) == 1
+        assert index.lookup("carier")[0].payloads == ("CAR", "Carrier")
+
+    def test_long_value_set_names(self):
+        concepts = valuesets.load_valueset_csv(SNOMED_FILE)
+        index = fuzzy_index.FuzzyIndex.from_terms(
+            (valuesets.normalize_text(c.text), c) for c in concepts
+        )
+        query = valuesets.normalize_text(concepts[100].text)
+        typo = query[:3] + query[4:]
+        assert concepts[100] in index.lookup(typo)[0].payloads
+
+    def test_lookup_latency(self):
+        concepts = valuesets.load_valueset_csv(SNOMED_FILE)
+        terms = [(valuesets.normalize_text(c.text), c) for c in concepts]
+        index = fuzzy_index.FuzzyIndex.from_terms(terms)
+        queries = []
+        for term, concept in random.sample(terms, 200):
+            i = random.randrange(len(term))
+            queries.append((term[:i] + term[i + 1 :], concept))
+
+        best = float("inf")
+        for _ in range(3):
+            start = time.perf_counter()
+            results = [index.lookup(query) for query, _ in queries]
+            best = min(best, (time.perf_counter() - start) / len(queries))
+
+        for (_, concept), matches in zip(queries, results):
+            assert any(concept in m.payloads for m in matches)
+        # Typo'd full names are looked up in well under a millisecond each
+        assert best < 0.001
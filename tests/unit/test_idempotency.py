@@ -0,0 +1,63 @@
+import boto3
+import pytest
+
+from dibbs_text_to_code import idempotency
+
+IDENTITY = idempotency.ObjectIdentity("bucket", "eicr/1.xml", "abc123")
+
+
+def s3_event(key, etag=None):
+    obj = {"key": key}
+    if etag is not None:
+        obj["etag"] = etag
+    return {"detail": {"bucket": {"name": "bucket"}, "object": obj}}
+
+
+class TestObjectIdentity:
+    def test_object_identity(self):
+        assert idempotency.object_identity(s3_event("eicr/1.xml", '"abc123"')) == IDENTITY
+        assert idempotency.object_identity(s3_event("eicr/1.xml")).etag == ""
+        assert IDENTITY.store_key == "bucket/eicr/1.xml#abc123"
+
+
+class TestSQLiteIdempotencyStore:
+    def test_mark_complete(self, tmp_path):
+        path = str(tmp_path / "idempotency.db")
+        store = idempotency.SQLiteIdempotencyStore(path)
+        assert not store.is_complete(IDENTITY)
+        store.mark_complete(IDENTITY)
+        assert store.is_complete(IDENTITY)
+
+        # A new ETag is a new version of the object
+        assert not store.is_complete(idempotency.ObjectIdentity("bucket", "eicr/1.xml", "def"))
+        # Entries survive reopening the database
+        assert idempotency.SQLiteIdempotencyStore(path).is_complete(IDENTITY)
+
+    def test_entries_expire(self):
+        store = idempotency.SQLiteIdempotencyStore(":memory:", ttl_seconds=-1)
+        store.mark_complete(IDENTITY)
+        assert not store.is_complete(IDENTITY)
+
+
+class TestDynamoDBIdempotencyStore:
+    @pytest.fixture
+    def table(self, moto_setup):
+        client = boto3.client("dynamodb", region_name="us-east-1")
+        client.create_table(
+            TableName="ttc-idempotency",
+            KeySchema=[{"AttributeName": "store_key", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "store_key", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        return "ttc-idempotency"
+
+    def test_mark_complete(self, table):
+        store = idempotency.DynamoDBIdempotencyStore(table)
+        assert not store.is_complete(IDENTITY)
+        store.mark_complete(IDENTITY)
+        assert store.is_complete(IDENTITY)
+
+    def test_entries_expire(self, table):
+        store = idempotency.DynamoDBIdempotencyStore(table, ttl_seconds=-10)
+        store.mark_complete(IDENTITY)
+        assert not store.is_complete(IDENTITY)
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from dibbs_text_to_code import index_manager
+from dibbs_text_to_code import main
+from dibbs_text_to_code import valuesets
+
+CONCEPTS = [
+    valuesets.Concept("718-7", "Hemoglobin [Mass/volume] in Blood"),
+    valuesets.Concept("2345-7", "Glucose [Mass/volume] in Serum or Plasma"),
+]
+
+
+def keyword_encoder(texts):
+    return np.array([[1.0, 0.0] if "hemo" in t.lower() else [0.0, 1.0] for t in texts])
+
+
+def publish(s3, version, embeddings):
+    return index_manager.publish_index(s3.bucket_name, version, CONCEPTS, np.array(embeddings))
+
+
+@pytest.fixture
+def manager(moto_setup, tmp_path):
+    return index_manager.IndexManager(
+        moto_setup.bucket_name,
+        encode_fn=keyword_encoder,
+        index_dir=str(tmp_path / "indexes"),
+        check_seconds=0,
+        keep_versions=2,
+    )
+
+
+class TestIndexManager:
+    def test_first_load_is_synchronous(self, moto_setup, manager):
+        publish(moto_setup, "v1", [[1.0, 0.0], [0.0, 2.0]])
+        manager.maybe_refresh()
+
+        assert manager.version == "v1"
+        assert isinstance(manager.index.embeddings, np.memmap)
+        # Embeddings are normalized when published
+        assert manager.index.embeddings[1].tolist() == [0.0, 1.0]
+        assert manager.index.search(["hemoglobin"], top_k=1)[0][0].code == "718-7"
+
+    def test_new_version_swapped_in_background(self, moto_setup, manager):
+        publish(moto_setup, "v1", [[1.0, 0.0], [0.0, 1.0]])
+        manager.maybe_refresh()
+        old_index = manager.index
+
+        publish(moto_setup, "v2", [[0.0, 1.0], [1.0, 0.0]])
+        manager.maybe_refresh()
+        manager.wait(timeout=10)
+
+        assert manager.version == "v2"
+        assert manager.last_error is None
+        assert manager.index.search(["hemoglobin"], top_k=1)[0][0].code == "2345-7"
+        # A request still holding the old index can finish with it
+        assert old_index.search(["hemoglobin"], top_k=1)[0][0].code == "718-7"
+
+    def test_failed_refresh_keeps_current_index(self, moto_setup, manager, caplog):
+        publish(moto_setup, "v1", [[1.0, 0.0], [0.0, 1.0]])
+        manager.maybe_refresh()
+        manifest = publish(moto_setup, "v2", [[1.0, 0.0], [0.0, 1.0]])
+        moto_setup.delete_object(
+            Bucket=moto_setup.bucket_name, Key=manifest["versions"]["v2"]["embeddings_key"]
+        )
+
+        manager.maybe_refresh()
+        manager.wait(timeout=10)
+
+        assert manager.version == "v1"
+        assert manager.last_error is not None
+        assert "Could not refresh the index" in caplog.text
+        assert not os.path.exists(os.path.join(manager.index_dir, "v2"))
+
+    def test_failed_first_load_is_throttled(self, moto_setup, manager, monkeypatch):
+        manager.check_seconds = 3600
+        calls = []
+        get_file = index_manager.s3_handler.get_file
+
+        def counting_get_file(*args):
+            calls.append(args)
+            return get_file(*args)
+
+        monkeypatch.setattr(index_manager.s3_handler, "get_file", counting_get_file)
+        # No manifest has been published
+        with pytest.raises(Exception):
+            manager.maybe_refresh()
+        manager.maybe_refresh()
+
+        assert len(calls) == 1
+        assert manager.index is None
+
+    def test_concurrent_first_loads(self, moto_setup, manager):
+        publish(moto_setup, "v1", [[1.0, 0.0], [0.0, 1.0]])
+        errors = []
+
+        def load():
+            try:
+                manager.maybe_refresh()
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=load) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        assert errors == []
+        assert manager.version == "v1"
+        assert os.listdir(manager.index_dir) == ["v1"]
+
+    def test_encoder_set_after_load(self, moto_setup, manager, monkeypatch):
+        publish(moto_setup, "v1", [[1.0, 0.0], [0.0, 1.0]])
+        manager.encode_fn = None
+        manager.maybe_refresh()
+        with pytest.raises(RuntimeError):
+            manager.index.search(["hemoglobin"], top_k=1)
+
+        monkeypatch.setattr(index_manager, "_default_manager", manager)
+        index_manager.get_index_manager(keyword_encoder)
+        assert manager.index.search(["hemoglobin"], top_k=1)[0][0].code == "718-7"
+
+    def test_rollback_and_pruning(self, moto_setup, manager):
+        for version in ["v1", "v2", "v3"]:
+            publish(moto_setup, version, [[1.0, 0.0], [0.0, 1.0]])
+            manager.refresh()
+
+        # Only the two most recent versions are kept on disk
+        assert sorted(os.listdir(manager.index_dir)) == ["v2", "v3"]
+        assert manager.rollback() == "v2"
+        assert manager.version == "v2"
+        with pytest.raises(ValueError):
+            manager.rollback("v1")
+
+    def test_rollback_manifest(self, moto_setup, manager):
+        publish(moto_setup, "v1", [[1.0, 0.0], [0.0, 1.0]])
+        publish(moto_setup, "v2", [[1.0, 0.0], [0.0, 1.0]])
+
+        assert index_manager.rollback_manifest(moto_setup.bucket_name) == "v1"
+        manager.refresh()
+        assert manager.version == "v1"
+        with pytest.raises(ValueError):
+            index_manager.rollback_manifest(moto_setup.bucket_name)
+
+
+class TestHandlerIndexRefresh:
+    def test_handler_loads_index(self, moto_setup, manager, monkeypatch):
+        publish(moto_setup, "v1", [[1.0, 0.0], [0.0, 1.0]])
+        monkeypatch.setattr(index_manager, "_default_manager", manager)
+
+        result = main.handler({"Records": []}, {})
+        assert result["index_version"] == "v1"
+
+        manifest = json.loads(
+            moto_setup.get_object(Bucket=moto_setup.bucket_name, Key="indexes/manifest.json")[
+                "Body"
+            ].read()
+        )
+        assert manifest["current"] == "v1"
+
+    def test_handler_survives_failed_refresh(self, moto_setup, manager, monkeypatch):
+        # No manifest has been published, so the first load fails
+        monkeypatch.setattr(index_manager, "_default_manager", manager)
+
+        result = main.handler({"Records": []}, {})
+        assert result["index_version"] is None
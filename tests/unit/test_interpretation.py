@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+import pytest
+
+from data_curation import synthetic_lab_results
+from dibbs_text_to_code import interpretation
+
+
+@pytest.fixture(scope="module")
+def training_data():
+    rng = random.Random(0)
+    all_words = [(w, 1) for w in synthetic_lab_results.positive_words] + [
+        (w, 2) for w in synthetic_lab_results.negative_words
+    ]
+    words, labels = [], []
+    for _ in range(3000):
+        word, label = rng.choice(all_words)
+        if rng.random() < 0.5:
+            word = synthetic_lab_results.random_case(word)
+        if rng.random() < 0.1:
+            word = synthetic_lab_results.introduce_typo(word)
+        words.append(word)
+        labels.append(label)
+    return words, labels
+
+
+@pytest.fixture(scope="module")
+def model(training_data):
+    return interpretation.InterpretationClassifier.train(*training_data)
+
+
+class TestReadTrainingCsv:
+    def test_read_training_csv(self, tmp_path):
+        path = tmp_path / "results.csv"
+        path.write_text("word,label\nPositive,1\nnot detected,2\n")
+        assert interpretation.read_training_csv(str(path)) == (
+            ["Positive", "not detected"],
+            [1, 2],
+        )
+
+
+class TestInterpretationClassifier:
+    @pytest.mark.parametrize(
+        "text, label",
+        [
+            ("POSITIVE", interpretation.LABEL_POSITIVE),
+            ("Detected", interpretation.LABEL_POSITIVE),
+            ("Not Detected", interpretation.LABEL_NEGATIVE),
+            ("non-reactive", interpretation.LABEL_NEGATIVE),
+            ("negatve", interpretation.LABEL_NEGATIVE),
+        ],
+    )
+    def test_predict(self, model, text, label):
+        assert model.predict([text])[0] == label
+
+    def test_predict_proba(self, model):
+        proba = model.predict_proba(["positive", "negative"])
+        assert proba.shape == (2, 2)
+        np.testing.assert_allclose(proba.sum(axis=1), 1.0, rtol=1e-6)
+        # Columns follow `classes`, so the first column is the positive label
+        assert proba[0, 0] > 0.5 > proba[1, 0]
+
+    def test_cached_predictions_match(self, model, training_data):
+        words = training_data[0][:200]
+        first = model.predict(words)
+        assert np.array_equal(first, model.predict(words))
+
+    def test_save_and_load(self, model, training_data, tmp_path):
+        path = str(tmp_path / "model.npz")
+        model.save(path)
+        loaded = interpretation.InterpretationClassifier.load(path)
+
+        words = training_data[0][:200]
+        assert np.array_equal(model.predict(words), loaded.predict(words))
+        assert loaded.ngram_range == model.ngram_range
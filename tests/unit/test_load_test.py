@@ -0,0 +1,136 @@
+import http.server
+import json
+import random
+import threading
+import time
+
+import pytest
+
+from dev_scripts import load_test
+from dibbs_text_to_code import main
+
+
+@pytest.fixture
+def lambda_emulator(moto_setup):
+    """
+    Serves main.handler on a local port, the way the runtime emulator does.
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            event = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            try:
+                body = main.handler(event, None)
+            except Exception as e:
+                body = {"errorType": type(e).__name__, "errorMessage": str(e)}
+            data = json.dumps(body, default=lambda b: b.decode()).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/2015-03-31/functions/function/invocations"
+    server.shutdown()
+    server.server_close()
+
+
+class TestEvents:
+    def test_parse_size_range(self):
+        assert load_test.parse_size_range("100") == (100, 100)
+        assert load_test.parse_size_range("100-200") == (100, 200)
+        with pytest.raises(ValueError):
+            load_test.parse_size_range("200-100")
+
+    def test_seed_objects(self, moto_setup):
+        objects = load_test.seed_objects(moto_setup, moto_setup.bucket_name, 5, (100, 300))
+
+        assert len(objects) == 5
+        for obj in objects:
+            head = moto_setup.head_object(Bucket=moto_setup.bucket_name, Key=obj["key"])
+            assert 100 <= obj["size"] <= 300
+            assert head["ContentLength"] == obj["size"]
+            assert head["ETag"].strip('"') == obj["etag"]
+
+    def test_sqs_batch_event(self):
+        objects = [{"key": f"k{i}", "size": 10, "etag": f"e{i}"} for i in range(100)]
+        event = load_test.sqs_batch_event("bucket", objects, 10, random.Random(0))
+
+        assert len(event["Records"]) == 10
+        record = event["Records"][0]
+        assert record["eventSource"] == "aws:sqs"
+        detail = json.loads(record["body"])["detail"]
+        assert detail["bucket"]["name"] == "bucket"
+        assert detail["object"]["key"] in {obj["key"] for obj in objects}
+
+    def test_duplicate_rate(self):
+        objects = [{"key": f"k{i}", "size": 10, "etag": f"e{i}"} for i in range(1000)]
+        event = load_test.sqs_batch_event("bucket", objects, 10, random.Random(0), 1.0)
+
+        keys = {json.loads(r["body"])["detail"]["object"]["key"] for r in event["Records"]}
+        assert len(keys) == 1
+
+
+class TestReport:
+    def test_percentile(self):
+        values = [i / 100 for i in range(1, 101)]
+        assert load_test.percentile(values, 50) == 0.5
+        assert load_test.percentile(values, 99) == 0.99
+        assert load_test.percentile([], 50) == 0.0
+
+    def test_summarize(self):
+        report = load_test.summarize(
+            [0.1, 0.2, 0.3, 0.4], ["Timeout"], 2.0, batch_size=5, memory=[100, 300, 200]
+        )
+
+        assert report["invocations"] == 4
+        # The failed invocation's records weren't processed
+        assert report["records"] == 15
+        assert report["records_per_second"] == 7.5
+        assert report["error_rate"] == 0.25
+        assert report["errors"] == {"Timeout": 1}
+        assert report["p50_latency_ms"] == 200.0
+        assert report["memory_peak_bytes"] == 300
+        assert report["memory_growth_bytes"] == 100
+
+    def test_container_memory_bytes(self, monkeypatch):
+        class Result:
+            stdout = "312.5MiB / 7.6GiB\n"
+
+        monkeypatch.setattr(load_test.subprocess, "run", lambda *args, **kwargs: Result())
+        assert load_test.container_memory_bytes("lambda") == int(312.5 * 2**20)
+
+
+class TestRunLoadTest:
+    def test_drives_handler(self, moto_setup, lambda_emulator):
+        objects = load_test.seed_objects(moto_setup, moto_setup.bucket_name, 10, (50, 100))
+        report = load_test.run_load_test(
+            lambda_emulator, moto_setup.bucket_name, objects, rps=50, duration=0.2, batch_size=3
+        )
+
+        assert report["invocations"] == 10
+        assert report["records"] == 30
+        assert report["error_rate"] == 0.0
+        assert report["p99_latency_ms"] >= report["p50_latency_ms"] > 0
+
+    def test_latency_from_scheduled_time(self, lambda_emulator):
+        # An invocation sent a second late was queued for that second
+        latency, error = load_test.invoke(
+            lambda_emulator, {"Records": []}, 10.0, scheduled=time.perf_counter() - 1.0
+        )
+
+        assert error is None
+        assert latency >= 1.0
+
+    def test_counts_handler_errors(self, moto_setup, lambda_emulator):
+        missing = [{"key": "missing.txt", "size": 1, "etag": "x"}]
+        report = load_test.run_load_test(
+            lambda_emulator, moto_setup.bucket_name, missing, rps=50, duration=0.1, batch_size=1
+        )
+
+        assert report["error_rate"] == 1.0
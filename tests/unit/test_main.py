@@ -2,6 +2,7 @@ import json
 
 import pytest
 
+from dibbs_text_to_code import idempotency
 from dibbs_text_to_code import main
 
 
@@ -44,3 +45,81 @@ class TestHandler:
 
         assert result["file_contents"] == []
         assert len(result["file_contents"]) == 0
+
+    def test_handler_emits_metrics(self, moto_setup, monkeypatch, capsys):
+        monkeypatch.setenv("TTC_METRICS", "log")
+        moto_setup.put_object(Bucket=moto_setup.bucket_name, Key="test.txt", Body=b"eICR")
+        s3_event = {
+            "detail": {"bucket": {"name": moto_setup.bucket_name}, "object": {"key": "test.txt"}}
+        }
+
+        main.handler({"Records": [{"body": json.dumps(s3_event)}]}, {})
+
+        record = json.loads(capsys.readouterr().out)
+        assert record["records"] == 1
+        assert record["s3_read_bytes"] == 4
+        assert {"parse_ms", "s3_get_object_ms", "s3_read_ms"} <= record.keys()
+
+    def test_handler_skips_duplicate_objects(self, moto_setup):
+        for key in ["a.txt", "b.txt"]:
+            moto_setup.put_object(Bucket=moto_setup.bucket_name, Key=key, Body=key.encode())
+
+        def record(key, etag):
+            s3_event = {
+                "detail": {
+                    "bucket": {"name": moto_setup.bucket_name},
+                    "object": {"key": key, "etag": etag},
+                }
+            }
+            return {"body": json.dumps(s3_event)}
+
+        event = {
+            "Records": [
+                record("a.txt", "1"),
+                record("a.txt", "1"),
+                record("b.txt", "1"),
+                # The same key with a new ETag is a new upload
+                record("a.txt", "2"),
+            ]
+        }
+        result = main.handler(event, {})
+        assert result["file_contents"] == [b"a.txt", b"b.txt", b"a.txt"]
+
+    def test_handler_skips_completed_objects(self, moto_setup, monkeypatch):
+        store = idempotency.SQLiteIdempotencyStore(":memory:")
+        monkeypatch.setattr(idempotency, "_default_store", store)
+        moto_setup.put_object(Bucket=moto_setup.bucket_name, Key="a.txt", Body=b"eICR")
+        s3_event = {
+            "detail": {
+                "bucket": {"name": moto_setup.bucket_name},
+                "object": {"key": "a.txt", "etag": "1"},
+            }
+        }
+        event = {"Records": [{"body": json.dumps(s3_event)}]}
+
+        assert main.handler(event, {})["file_contents"] == [b"eICR"]
+        # A redelivery of the same event is skipped
+        assert main.handler(event, {})["file_contents"] == []
+
+    def test_failed_batch_is_retried_in_full(self, moto_setup, monkeypatch):
+        store = idempotency.SQLiteIdempotencyStore(":memory:")
+        monkeypatch.setattr(idempotency, "_default_store", store)
+        moto_setup.put_object(Bucket=moto_setup.bucket_name, Key="a.txt", Body=b"a")
+
+        def record(key):
+            s3_event = {
+                "detail": {
+                    "bucket": {"name": moto_setup.bucket_name},
+                    "object": {"key": key, "etag": "1"},
+                }
+            }
+            return {"body": json.dumps(s3_event)}
+
+        # The second object doesn't exist yet, so the batch fails
+        event = {"Records": [record("a.txt"), record("b.txt")]}
+        with pytest.raises(Exception):
+            main.handler(event, {})
+
+        # SQS redelivers the whole batch, and the first object is processed again
+        moto_setup.put_object(Bucket=moto_setup.bucket_name, Key="b.txt", Body=b"b")
+        assert main.handler(event, {})["file_contents"] == [b"a", b"b"]
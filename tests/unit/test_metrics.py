@@ -0,0 +1,79 @@
+import json
+
+import pytest
+
+from dibbs_text_to_code import metrics
+
+
+class TestGetMetricsFormat:
+    @pytest.mark.parametrize(
+        "value, expected",
+        [(None, None), ("", None), ("off", None), ("log", "log"), ("EMF", "emf")],
+    )
+    def test_get_metrics_format(self, monkeypatch, value, expected):
+        if value is None:
+            monkeypatch.delenv("TTC_METRICS", raising=False)
+        else:
+            monkeypatch.setenv("TTC_METRICS", value)
+        assert metrics.get_metrics_format() == expected
+
+    def test_warns_on_unsupported_value(self, monkeypatch, caplog):
+        monkeypatch.setenv("TTC_METRICS", "json")
+        monkeypatch.setattr(metrics, "_warned_formats", set())
+
+        assert metrics.get_metrics_format() is None
+        assert metrics.get_metrics_format() is None
+        warnings = [r for r in caplog.records if r.levelname == "WARNING"]
+        assert len(warnings) == 1
+        assert "json" in warnings[0].getMessage()
+
+
+class TestStageMetrics:
+    def test_disabled_is_noop(self, monkeypatch, capsys):
+        monkeypatch.delenv("TTC_METRICS", raising=False)
+        m = metrics.StageMetrics("handler")
+        with m.stage("parse"):
+            pass
+        m.add_bytes("s3_read", 10)
+        m.increment("records")
+
+        assert m.emit() is None
+        assert m.timings_ms == {}
+        assert capsys.readouterr().out == ""
+
+    def test_off_overrides_environment(self, monkeypatch):
+        monkeypatch.setenv("TTC_METRICS", "log")
+        assert metrics.StageMetrics("handler").enabled
+        assert not metrics.StageMetrics("handler", metrics_format=metrics.METRICS_OFF).enabled
+
+    def test_invalid_format(self):
+        with pytest.raises(ValueError):
+            metrics.StageMetrics("handler", metrics_format="xml")
+
+    def test_stages_accumulate(self):
+        m = metrics.StageMetrics("handler", metrics_format="log")
+        for _ in range(3):
+            with m.stage("parse"):
+                pass
+            m.add_bytes("s3_read", 5)
+        m.increment("records", 3)
+
+        record = m.to_record()
+        assert record["metrics"] == "handler"
+        assert record["parse_ms"] >= 0
+        assert record["s3_read_bytes"] == 15
+        assert record["records"] == 3
+        assert record["peak_rss_bytes"] > 0
+
+    def test_emf_record(self, capsys):
+        m = metrics.StageMetrics("handler", metrics_format="emf", namespace="Test")
+        with m.stage("parse"):
+            pass
+        m.emit()
+
+        record = json.loads(capsys.readouterr().out)
+        directive = record["_aws"]["CloudWatchMetrics"][0]
+        assert directive["Namespace"] == "Test"
+        assert {"Name": "parse_ms", "Unit": "Milliseconds"} in directive["Metrics"]
+        assert record["Operation"] == "handler"
+        assert "parse_ms" in record
@@ -0,0 +1,110 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from dibbs_text_to_code import result_writer
+
+
+def read_records(s3, key):
+    body = s3.get_object(Bucket=s3.bucket_name, Key=key)["Body"].read()
+    return [json.loads(line) for line in gzip.decompress(body).splitlines()]
+
+
+class TestResultWriter:
+    def test_records_batched_into_one_object(self, moto_setup):
+        records = [{"text": f"lab {i}", "code": "718-7", "score": 0.9} for i in range(100)]
+        with result_writer.ResultWriter(moto_setup.bucket_name) as writer:
+            writer.write_many(records)
+
+        assert len(writer.written_keys) == 1
+        key = writer.written_keys[0]
+        assert key.startswith("results/") and key.endswith("-000001.ndjson.gz")
+        assert read_records(moto_setup, key) == records
+
+    def test_flush_by_size(self, moto_setup):
+        writer = result_writer.ResultWriter(moto_setup.bucket_name, max_object_bytes=1)
+        writer.write({"text": "a"})
+        writer.write({"text": "b"})
+
+        assert len(writer.written_keys) == 2
+        assert writer.flush() is None
+
+    def test_flush_by_age(self, moto_setup):
+        writer = result_writer.ResultWriter(moto_setup.bucket_name, max_age_seconds=3600)
+        writer.write({"text": "a"})
+        assert writer.flush_if_due() is None
+
+        writer.max_age_seconds = 0
+        key = writer.flush_if_due()
+        assert read_records(moto_setup, key) == [{"text": "a"}]
+
+    def test_large_object_uses_multipart_upload(self, moto_setup):
+        # Random hex only compresses by half, so this is well over one part
+        records = [{"text": os.urandom(500).hex()} for _ in range(12000)]
+        with result_writer.ResultWriter(
+            moto_setup.bucket_name, part_size=result_writer.MIN_PART_SIZE
+        ) as writer:
+            writer.write_many(records)
+            assert writer._upload is not None
+
+        assert len(writer.written_keys) == 1
+        assert read_records(moto_setup, writer.written_keys[0]) == records
+
+    def test_failed_part_upload_is_retried(self, moto_setup, monkeypatch):
+        upload_part = result_writer.s3_handler.MultipartUpload.upload_part
+        calls = []
+
+        def flaky_upload_part(self, body):
+            calls.append(len(body))
+            if len(calls) == 1:
+                raise ConnectionError("S3 is unavailable")
+            upload_part(self, body)
+
+        monkeypatch.setattr(
+            result_writer.s3_handler.MultipartUpload, "upload_part", flaky_upload_part
+        )
+        records = [{"text": os.urandom(500).hex()} for _ in range(12000)]
+        writer = result_writer.ResultWriter(
+            moto_setup.bucket_name, part_size=result_writer.MIN_PART_SIZE
+        )
+        failures = 0
+        for record in records:
+            # The record is kept even when the upload it triggers fails
+            try:
+                writer.write(record)
+            except ConnectionError:
+                failures += 1
+        writer.flush()
+
+        assert failures == 1
+        assert len(writer.written_keys) == 1
+        assert read_records(moto_setup, writer.written_keys[0]) == records
+
+    def test_failed_put_is_retried(self, moto_setup, monkeypatch):
+        put_file = result_writer.s3_handler.put_file
+        calls = []
+
+        def flaky_put_file(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise ConnectionError("S3 is unavailable")
+            put_file(*args, **kwargs)
+
+        monkeypatch.setattr(result_writer.s3_handler, "put_file", flaky_put_file)
+        writer = result_writer.ResultWriter(moto_setup.bucket_name)
+        writer.write({"text": "a"})
+        with pytest.raises(ConnectionError):
+            writer.flush()
+        writer.write({"text": "b"})
+        writer.flush()
+
+        assert [read_records(moto_setup, key) for key in writer.written_keys] == [
+            [{"text": "a"}],
+            [{"text": "b"}],
+        ]
+
+    def test_part_size_must_meet_s3_minimum(self):
+        with pytest.raises(ValueError):
+            result_writer.ResultWriter("bucket", part_size=1024)
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from dibbs_text_to_code import retrieval
+from dibbs_text_to_code import valuesets
+
+CONCEPTS = [
+    valuesets.Concept("1989-3", "25-Hydroxyvitamin D3 [Mass/volume] in Serum or Plasma"),
+    valuesets.Concept("718-7", "Hemoglobin [Mass/volume] in Blood"),
+    valuesets.Concept("2345-7", "Glucose [Mass/volume] in Serum or Plasma"),
+    valuesets.Concept("4544-3", "Hematocrit [Volume Fraction] of Blood by Automated count"),
+]
+RELATED_NAMES = {"4544-3": ["HCT", "Packed cell volume", "PCV"]}
+
+
+class CountingEncoder:
+    # Every string gets the same embedding, so rankings come from the sparse stage
+    def __init__(self):
+        self.num_encoded = 0
+
+    def __call__(self, texts):
+        self.num_encoded += len(texts)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+class TestHybridRetriever:
+    def test_abbreviation_matches_lexically(self):
+        retriever = retrieval.HybridRetriever(CONCEPTS, CountingEncoder(), RELATED_NAMES)
+        results = retriever.search(["Vit D3 Ser/Plas", "Glucose Ser"], top_k=2)
+        assert results[0][0].code == "1989-3"
+        assert results[1][0].code == "2345-7"
+
+    def test_related_names_are_searchable(self):
+        retriever = retrieval.HybridRetriever(CONCEPTS, CountingEncoder(), RELATED_NAMES)
+        assert retriever.search(["PCV"], top_k=1)[0][0].code == "4544-3"
+
+    def test_pool_limits_candidates(self):
+        retriever = retrieval.HybridRetriever(CONCEPTS, CountingEncoder(), pool_size=2)
+        results = retriever.search(["Hemoglobin Blood"], top_k=5)
+        assert len(results[0]) == 2
+        assert results[0][0].code == "718-7"
+
+    def test_dense_weight_controls_ranking(self):
+        # The dense embeddings favor glucose no matter the query
+        embeddings = np.eye(4, dtype=np.float32)
+
+        def encoder(texts):
+            return np.tile(embeddings[2], (len(texts), 1))
+
+        query = ["Hemoglobin Blood"]
+        sparse_only = retrieval.HybridRetriever(
+            CONCEPTS, encoder, embeddings=embeddings, dense_weight=0.0
+        )
+        dense_only = retrieval.HybridRetriever(
+            CONCEPTS, encoder, embeddings=embeddings, dense_weight=1.0
+        )
+        assert sparse_only.search(query, top_k=1)[0][0].code == "718-7"
+        assert dense_only.search(query, top_k=1)[0][0].code == "2345-7"
+
+    def test_queries_encoded_in_one_batch(self):
+        encoder = CountingEncoder()
+        retriever = retrieval.HybridRetriever(CONCEPTS, encoder)
+        encoder.num_encoded = 0
+        retriever.search(["a", "b", "c"])
+        assert encoder.num_encoded == 3
+
+    def test_queries_searched_in_chunks(self, monkeypatch):
+        retriever = retrieval.HybridRetriever(CONCEPTS, CountingEncoder(), RELATED_NAMES)
+        queries = ["Vit D3 Ser/Plas", "Glucose Ser", "PCV", "Hemoglobin Blood", "HCT"]
+        expected = retriever.search(queries, top_k=2)
+
+        monkeypatch.setattr(retrieval, "SEARCH_CHUNK_SIZE", 2)
+        assert retriever.search(queries, top_k=2) == expected
+
+    @pytest.mark.parametrize("kwargs", [{"pool_size": 0}, {"dense_weight": 1.5}])
+    def test_invalid_settings(self, kwargs):
+        with pytest.raises(ValueError):
+            retrieval.HybridRetriever(CONCEPTS, CountingEncoder(), **kwargs)
+
+
+class TestBuildLabNameRetriever:
+    def test_build_from_loinc_file(self, tmp_path):
+        path = tmp_path / "loinc_lab_names.csv"
+        path.write_text(
+            "code|short_name|long_name|display_name|related_names\n"
+            "4544-3|Hct VFr Bld Auto|Hematocrit of Blood by Automated count|Hct Bld Auto|"
+            "HCT; Packed cell volume; PCV\n"
+            "718-7|Hgb Bld-mCnc|Hemoglobin [Mass/volume] in Blood|Hgb Bld|Haemoglobin; HGB\n"
+        )
+        retriever = retrieval.build_lab_name_retriever(str(path), CountingEncoder())
+        assert len(retriever.concepts) == 6
+        assert retriever.search(["packed cell vol"], top_k=1)[0][0].code == "4544-3"
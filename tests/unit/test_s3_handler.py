@@ -33,3 +33,17 @@ class TestPutFile:
 
         response = moto_setup.get_object(Bucket=moto_setup.bucket_name, Key="test.txt")
         assert response["Body"].read() == b"This eICR is good"
+
+
+class TestMultipartUpload:
+    def test_upload_and_abort(self, moto_setup):
+        upload = s3_handler.MultipartUpload(moto_setup.bucket_name, "big.txt")
+        upload.upload_part(b"last part may be small")
+        upload.complete()
+        response = moto_setup.get_object(Bucket=moto_setup.bucket_name, Key="big.txt")
+        assert response["Body"].read() == b"last part may be small"
+
+        upload = s3_handler.MultipartUpload(moto_setup.bucket_name, "abandoned.txt")
+        upload.abort()
+        uploads = moto_setup.list_multipart_uploads(Bucket=moto_setup.bucket_name)
+        assert uploads.get("Uploads", []) == []
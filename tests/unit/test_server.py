@@ -0,0 +1,118 @@
+import http.client
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from dibbs_text_to_code import server
+
+
+def fake_encoder(texts):
+    return [[float(len(t))] for t in texts]
+
+
+@pytest.fixture
+def running_server():
+    srv = server.TextToCodeServer(("127.0.0.1", 0))
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.graceful_shutdown()
+    thread.join(timeout=5)
+
+
+def request(srv, method, path, body=None):
+    host, port = srv.server_address[:2]
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(f"http://{host}:{port}{path}", data=data, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=5) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+class TestProbes:
+    def test_health(self, running_server):
+        assert request(running_server, "GET", "/health") == (200, {"status": "ok"})
+
+    def test_ready_after_warm_up(self, running_server):
+        assert request(running_server, "GET", "/ready")[0] == 503
+        running_server.warm_up(fake_encoder)
+        assert request(running_server, "GET", "/ready") == (200, {"status": "ready"})
+
+    def test_unknown_path(self, running_server):
+        assert request(running_server, "GET", "/nope")[0] == 404
+
+
+class TestEncode:
+    def test_encode_batch(self, running_server):
+        running_server.warm_up(fake_encoder)
+        status, body = request(running_server, "POST", "/encode", {"texts": ["ab", "abcd"]})
+        assert status == 200
+        assert body == {"embeddings": [[2.0], [4.0]]}
+
+    def test_encode_not_ready(self, running_server):
+        assert request(running_server, "POST", "/encode", {"texts": ["ab"]})[0] == 503
+
+    @pytest.mark.parametrize("body", [{"texts": "ab"}, {"texts": [1]}, []])
+    def test_encode_bad_request(self, running_server, body):
+        running_server.warm_up(fake_encoder)
+        assert request(running_server, "POST", "/encode", body)[0] == 400
+
+    @pytest.mark.parametrize(
+        "content_length,status", [(None, 411), ("-1", 400), ("abc", 400), ("99999999999", 413)]
+    )
+    def test_invalid_content_length(self, running_server, content_length, status):
+        running_server.warm_up(fake_encoder)
+        conn = http.client.HTTPConnection(*running_server.server_address[:2], timeout=5)
+        conn.putrequest("POST", "/encode")
+        if content_length is not None:
+            conn.putheader("Content-Length", content_length)
+        conn.endheaders()
+        response = conn.getresponse()
+        conn.close()
+
+        assert response.status == status
+
+    def test_encode_timeout(self, running_server, monkeypatch):
+        release = threading.Event()
+
+        def stuck_encoder(texts):
+            release.wait(5)
+            return fake_encoder(texts)
+
+        monkeypatch.setattr(server, "ENCODE_TIMEOUT_SECONDS", 0.1)
+        running_server.warm_up(stuck_encoder)
+        try:
+            assert request(running_server, "POST", "/encode", {"texts": ["ab"]})[0] == 503
+        finally:
+            release.set()
+
+
+class TestInvocations:
+    def test_invocation_reads_s3_files(self, moto_setup, running_server):
+        running_server.warm_up(fake_encoder)
+        moto_setup.put_object(Bucket=moto_setup.bucket_name, Key="test.txt", Body=b"eICR")
+        s3_event = {
+            "detail": {"bucket": {"name": moto_setup.bucket_name}, "object": {"key": "test.txt"}}
+        }
+        event = {"Records": [{"body": json.dumps(s3_event)}]}
+
+        status, body = request(running_server, "POST", "/invocations", event)
+
+        assert status == 200
+        assert body["file_contents"] == ["eICR"]
+
+    def test_graceful_shutdown_clears_readiness(self):
+        srv = server.TextToCodeServer(("127.0.0.1", 0))
+        thread = threading.Thread(target=srv.serve_forever, daemon=True)
+        thread.start()
+        srv.warm_up(fake_encoder)
+        srv.graceful_shutdown()
+        thread.join(timeout=5)
+
+        assert not thread.is_alive()
+        assert not srv.ready.is_set()
@@ -0,0 +1,93 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+from model_tuning import token_cache
+from model_tuning.train_tsdae import SentenceFile
+
+TEXTS = [
+    "glucose",
+    "the hemoglobin level in blood is a test",
+    "serum glucose",
+    "plasma test for glucose and hemoglobin",
+    "a",
+]
+
+
+class TestTokenCache:
+    def test_matches_model_tokenize(self, tiny_model, tmp_path):
+        corpus = token_cache.load_or_build(
+            tiny_model, TEXTS, str(tmp_path / "tokens"), chunk_size=2
+        )
+
+        assert len(corpus) == len(TEXTS)
+        expected = tiny_model.tokenize(TEXTS)
+        assert corpus.lengths.tolist() == expected["attention_mask"].sum(dim=1).tolist()
+        for name, value in corpus.features(range(len(TEXTS))).items():
+            assert torch.equal(value, expected[name])
+
+    def test_reuses_entry_for_same_corpus(self, tiny_model, tmp_path):
+        first = token_cache.load_or_build(tiny_model, TEXTS, str(tmp_path / "tokens"))
+        second = token_cache.load_or_build(tiny_model, list(TEXTS), str(tmp_path / "tokens"))
+        assert second.path == first.path
+        assert isinstance(second.input_ids, np.memmap)
+
+        reordered = token_cache.load_or_build(tiny_model, TEXTS[::-1], str(tmp_path / "tokens"))
+        assert reordered.path != first.path
+        assert len(os.listdir(tmp_path / "tokens")) == 2
+
+    def test_streams_file_in_blocks(self, tiny_model, tmp_path, monkeypatch):
+        monkeypatch.setattr(token_cache, "COPY_BLOCK_SIZE", 3)
+        sentences_path = tmp_path / "sentences.txt"
+        sentences_path.write_text("\n".join(TEXTS) + "\n")
+
+        corpus = token_cache.load_or_build(
+            tiny_model, SentenceFile(str(sentences_path)), str(tmp_path / "tokens"), chunk_size=2
+        )
+
+        expected = tiny_model.tokenize(TEXTS)["attention_mask"].sum(dim=1)
+        assert corpus.lengths.tolist() == expected.tolist()
+        assert corpus.meta["corpus_digest"] == token_cache.corpus_digest(TEXTS)
+        assert sorted(os.listdir(corpus.path)) == sorted(
+            [token_cache.IDS_FILE, token_cache.OFFSETS_FILE, token_cache.META_FILE]
+        )
+
+    def test_rejects_single_pass_iterator(self, tiny_model, tmp_path):
+        with pytest.raises(TypeError):
+            token_cache.load_or_build(tiny_model, iter(TEXTS), str(tmp_path / "tokens"))
+
+    def test_fingerprint_follows_max_seq_length(self, tiny_model):
+        before = token_cache.tokenizer_fingerprint(tiny_model)
+        tiny_model.tokenize(TEXTS)
+        assert token_cache.tokenizer_fingerprint(tiny_model) == before
+
+        tiny_model.max_seq_length = 4
+        assert token_cache.tokenizer_fingerprint(tiny_model) != before
+
+    def test_pickles_by_path(self, tiny_model, tmp_path):
+        corpus = token_cache.load_or_build(tiny_model, TEXTS, str(tmp_path / "tokens"))
+        restored = pickle.loads(pickle.dumps(corpus))
+
+        assert restored.path == corpus.path
+        assert restored.token_ids(1).tolist() == corpus.token_ids(1).tolist()
+
+
+class TestEncodeCached:
+    def test_matches_model_encode(self, tiny_model, tmp_path):
+        corpus = token_cache.load_or_build(tiny_model, TEXTS, str(tmp_path / "tokens"))
+        embeddings = token_cache.encode_cached(tiny_model, corpus, batch_size=2)
+
+        assert isinstance(embeddings, np.ndarray)
+        np.testing.assert_allclose(embeddings, tiny_model.encode(TEXTS), atol=1e-5)
+
+    def test_positions(self, tiny_model, tmp_path):
+        corpus = token_cache.load_or_build(tiny_model, TEXTS, str(tmp_path / "tokens"))
+        embeddings = token_cache.encode_cached(
+            tiny_model, corpus, [3, 0], batch_size=1, convert_to_tensor=True
+        )
+
+        expected = tiny_model.encode([TEXTS[3], TEXTS[0]], convert_to_tensor=True)
+        assert torch.allclose(embeddings, expected, atol=1e-5)
@@ -0,0 +1,106 @@
+import os
+import random
+
+import pytest
+from sentence_transformers import SentenceTransformer
+from torch.utils.data import DataLoader
+
+from model_tuning import token_cache
+from model_tuning import train_tsdae
+
+SENTENCES = [
+    "the glucose level in blood is a test",
+    "hemoglobin is measurement of blood",
+    "serum and plasma test for glucose",
+    "the test is for hemoglobin in serum",
+    "a level of glucose in plasma",
+]
+
+
+@pytest.fixture
+def sentences_path(tmp_path):
+    path = tmp_path / "sentences.txt"
+    path.write_text("\n".join(SENTENCES * 2) + "\n\n")
+    return str(path)
+
+
+def batch_texts(model, batches):
+    return [model.tokenizer.batch_decode(original["input_ids"]) for _, original, _ in batches]
+
+
+class TestDeleteWords:
+    def test_keeps_at_least_one_word(self):
+        rng = random.Random(1)
+        assert len(train_tsdae.delete_words("glucose level", 1.0, rng).split()) == 1
+        assert train_tsdae.delete_words("glucose level", 0.0, rng) == "glucose level"
+        assert train_tsdae.delete_words("", 0.6, rng) == ""
+
+
+class TestDenoisingBatches:
+    def test_batches_are_dynamically_padded(self, tiny_model, sentences_path):
+        dataset = train_tsdae.DenoisingBatches(
+            sentences_path, tiny_model.tokenizer, 32, batch_size=4
+        )
+        batches = list(dataset)
+
+        assert [n for _, _, n in batches] == [4, 4, 2]
+        # The longest sentence in the first batch has 8 words plus [CLS] and [SEP]
+        assert batches[0][1]["input_ids"].shape == (4, 10)
+        assert batches[2][1]["input_ids"].shape == (2, 9)
+        for noisy, original, _ in batches:
+            assert noisy["input_ids"].shape[1] <= original["input_ids"].shape[1]
+
+    def test_worker_order_matches_file_order(self, tiny_model, sentences_path):
+        def load(workers, skip):
+            dataset = train_tsdae.DenoisingBatches(
+                sentences_path, tiny_model.tokenizer, 32, batch_size=2, skip_batches=skip
+            )
+            loader = DataLoader(dataset, batch_size=None, num_workers=workers)
+            return batch_texts(tiny_model, loader)
+
+        single = load(0, 0)
+        assert len(single) == 5
+        assert load(2, 0) == single
+        assert load(2, 3) == single[3:]
+
+    def test_original_sentences_from_token_cache(self, tiny_model, sentences_path, tmp_path):
+        sentences = list(train_tsdae.iter_sentences(sentences_path))
+        corpus = token_cache.load_or_build(tiny_model, sentences, str(tmp_path / "tokens"))
+
+        def load(cache):
+            dataset = train_tsdae.DenoisingBatches(
+                sentences_path, tiny_model.tokenizer, 32, batch_size=4, token_cache=cache
+            )
+            return batch_texts(tiny_model, DataLoader(dataset, batch_size=None, num_workers=2))
+
+        assert load(corpus) == load(None)
+
+
+class TestTrainTsdae:
+    def test_resume_and_save(self, tiny_model, sentences_path, tmp_path):
+        output_dir = str(tmp_path / "out")
+        state = train_tsdae.train_tsdae(
+            tiny_model,
+            sentences_path,
+            output_dir,
+            batch_size=2,
+            accumulation_steps=2,
+            workers=0,
+            max_steps=1,
+        )
+        assert state == {"epoch": 0, "batches_done": 2, "steps": 1, "samples": 4}
+        assert not os.path.exists(os.path.join(output_dir, "modules.json"))
+
+        state = train_tsdae.train_tsdae(
+            tiny_model,
+            sentences_path,
+            output_dir,
+            batch_size=2,
+            accumulation_steps=2,
+            workers=0,
+        )
+        # Five batches per epoch: two steps of two batches, then one short step
+        assert state == {"epoch": 1, "batches_done": 0, "steps": 3, "samples": 10}
+
+        trained = SentenceTransformer(output_dir, device="cpu")
+        assert trained.encode(["glucose level"]).shape == (1, 16)
@@ -0,0 +1,55 @@
+import spacy
+
+from model_tuning import tsdae
+
+PARTS = """\
+10000-8,"Transcortin is produced by the liver and is regulated by estrogens. It is an alpha-globulin found in plasma."
+10001-6,"Orange is a plant species of the genus citrus that provides the familiar orange fruit."
+10002-4,"Transcortin is produced by the liver and is regulated by estrogens. It is an alpha-globulin found in plasma."
+10003-2,"Hemoglobin is the iron-containing oxygen transport protein in red blood cells
+of almost all vertebrates."
+"""
+
+
+def write_parts(tmp_path):
+    path = tmp_path / "parts.csv"
+    path.write_text(PARTS)
+    return str(path)
+
+
+class TestIterUniquePartDescriptions:
+    def test_deduplicates_in_file_order(self, tmp_path):
+        descriptions = list(tsdae._iter_unique_part_descriptions(write_parts(tmp_path)))
+        assert len(descriptions) == 3
+        assert descriptions[0].startswith("Transcortin")
+        assert descriptions[1].startswith("Orange")
+        assert descriptions[2] == (
+            "Hemoglobin is the iron-containing oxygen transport protein in red blood cells "
+            "of almost all vertebrates."
+        )
+
+    def test_digest_is_stable(self):
+        assert tsdae._description_digest("abc") == tsdae._description_digest("abc")
+        assert tsdae._description_digest("abc") != tsdae._description_digest("abd")
+        assert tsdae._description_digest("abc") < 2**64
+
+
+class TestCreateTsdaeData:
+    def test_output_is_deterministic(self, tmp_path):
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer")
+        parts_fp = write_parts(tmp_path)
+        out_fp = tmp_path / "sentences.txt"
+
+        tsdae.create_tsdae_data(nlp, parts_fp, str(out_fp), batch_size=2)
+        first = out_fp.read_text()
+        tsdae.create_tsdae_data(nlp, parts_fp, str(out_fp), batch_size=2)
+
+        assert first == out_fp.read_text()
+        assert first.splitlines() == [
+            "Transcortin is produced by the liver and is regulated by estrogens.",
+            "It is an alpha-globulin found in plasma.",
+            "Orange is a plant species of the genus citrus that provides the familiar orange fruit.",
+            "Hemoglobin is the iron-containing oxygen transport protein in red blood cells "
+            "of almost all vertebrates.",
+        ]
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from dibbs_text_to_code import valuesets
+
+HL7_FILE = "data/snoinc_extracts/hl7_lab_interp_20250911.csv"
+SNOMED_FILE = "data/snoinc_extracts/snomed_lab_value_20250911.csv"
+
+
+def fake_encoder(texts):
+    # A bag-of-letters embedding is enough to exercise cosine search
+    vectors = np.zeros((len(texts), 26), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for ch in text.lower():
+            if "a" <= ch <= "z":
+                vectors[i, ord(ch) - ord("a")] += 1
+    return vectors
+
+
+class TestLoadValuesetCsv:
+    def test_load_hl7(self):
+        concepts = valuesets.load_valueset_csv(HL7_FILE)
+        assert len(concepts) == 48
+        assert valuesets.Concept("POS", "Positive") in concepts
+
+    def test_multiple_text_columns(self, tmp_path):
+        path = tmp_path / "loinc.csv"
+        path.write_text(
+            "code|short_name|long_name\n718-7|Hgb Bld-mCnc|Hemoglobin [Mass/volume] in Blood\n"
+        )
+        concepts = valuesets.load_valueset_csv(str(path), ("short_name", "long_name"))
+        assert [c.text for c in concepts] == ["Hgb Bld-mCnc", "Hemoglobin [Mass/volume] in Blood"]
+        assert {c.code for c in concepts} == {"718-7"}
+
+
+class TestLexicalMatcher:
+    @pytest.fixture
+    def matcher(self):
+        return valuesets.LexicalMatcher(valuesets.load_valueset_csv(HL7_FILE))
+
+    @pytest.mark.parametrize(
+        "text, code",
+        [("positive", "POS"), ("  NOT   detected ", "ND"), ("NEG", "NEG"), ("Postive", "POS")],
+    )
+    def test_search(self, matcher, text, code):
+        assert matcher.search([text], top_k=1)[0][0].code == code
+
+    def test_exact_match_scores_one(self, matcher):
+        assert matcher.search(["Negative"])[0][0].score == 1.0
+
+    def test_no_match(self, matcher):
+        assert matcher.search(["zzzzzzzz"]) == [[]]
+
+
+class TestEmbeddingIndex:
+    def test_search_ranks_by_cosine(self):
+        concepts = [valuesets.Concept("1", "abc"), valuesets.Concept("2", "xyz")]
+        index = valuesets.EmbeddingIndex(concepts, fake_encoder)
+        results = index.search(["xyzz", "cab"], top_k=2)
+        assert [m.code for m in results[0]] == ["2", "1"]
+        assert [m.code for m in results[1]] == ["1", "2"]
+        assert results[1][0].score == pytest.approx(1.0)
+
+    def test_float16_storage(self):
+        concepts = [valuesets.Concept("1", "abc")]
+        index = valuesets.EmbeddingIndex(concepts, fake_encoder, dtype=np.float16)
+        assert index.embeddings.dtype == np.float16
+        assert index.search(["abc"], top_k=5)[0][0].code == "1"
+
+    def test_float16_search_in_blocks(self, monkeypatch):
+        monkeypatch.setattr(valuesets, "SEARCH_BLOCK_ROWS", 2)
+        concepts = [valuesets.Concept(str(i), t) for i, t in enumerate(["ab", "cd", "ef", "xyz"])]
+        full = valuesets.EmbeddingIndex(concepts, fake_encoder)
+        half = valuesets.EmbeddingIndex(concepts, fake_encoder, dtype=np.float16)
+
+        for exact, blocked in zip(full.search(["xy", "cdd"], 4), half.search(["xy", "cdd"], 4)):
+            assert blocked[0].code == exact[0].code
+            assert [m.score for m in blocked] == pytest.approx([m.score for m in exact], abs=1e-3)
+
+
+class TestIndexRegistry:
+    def test_default_registry_routes_fields(self):
+        registry = valuesets.build_default_registry(
+            fake_encoder, valueset_dir="data/snoinc_extracts"
+        )
+        assert isinstance(registry.get(valuesets.FIELD_INTERPRETATION), valuesets.LexicalMatcher)
+        assert isinstance(registry.get(valuesets.FIELD_RESULT_VALUE), valuesets.EmbeddingIndex)
+        # The LOINC lab names extract isn't checked in, so it is skipped
+        assert valuesets.FIELD_LAB_NAME not in registry.fields
+
+        assert registry.search(valuesets.FIELD_INTERPRETATION, ["Detected"])[0][0].code == "DET"
+
+    def test_without_encoder_uses_lexical(self):
+        registry = valuesets.build_default_registry(valueset_dir="data/snoinc_extracts")
+        assert isinstance(registry.get(valuesets.FIELD_RESULT_VALUE), valuesets.LexicalMatcher)
+
+    def test_unknown_field(self):
+        with pytest.raises(KeyError):
+            valuesets.IndexRegistry().search("specimen", ["blood"])
+
+
+class TestLoadRelatedNames:
+    def test_load_related_names(self, tmp_path):
+        path = tmp_path / "loinc.csv"
+        path.write_text("code|long_name|related_names\n4544-3|Hematocrit|HCT; PCV ;\n718-7|Hgb|\n")
+        assert valuesets.load_related_names(str(path)) == {"4544-3": ["HCT", "PCV"]}